@@ -0,0 +1,155 @@
+import os
+import numpy as np
+from dense_index import DenseIndex, DenseIndexWriter, normalize_rows, top_k_indices
+
+# ========== Constants ==========
+IVF_FILE = "ivf.npz"
+DEFAULT_N_PROBE = 8
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLES_PER_LIST = 64
+ASSIGN_BLOCK_ROWS = 16384
+
+def default_n_lists(count):
+    """Rule-of-thumb number of inverted lists for ``count`` vectors"""
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+def assign_to_centroids(vectors, centroids):
+    """Index of the most similar centroid for every vector, computed in blocks.
+
+    The argmax does not depend on the row norm, so rows need not be normalized.
+    """
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], ASSIGN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + ASSIGN_BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def train_centroids(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on a normalized sample of the vectors"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(vectors.shape[0], n_lists * KMEANS_SAMPLES_PER_LIST)
+    sample = normalize_rows(vectors[np.sort(rng.choice(vectors.shape[0], sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        # Re-seed empty lists from random sample points so no list stays dead
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = sample[rng.choice(sample_size, empty.size, replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+class IVFIndex(DenseIndex):
+    """Approximate inverted-file (IVF) index on top of ``DenseIndex``.
+
+    Rows are stored grouped by their nearest k-means centroid, so each inverted
+    list is a contiguous slice of the memory-mapped matrix. A query scores the
+    centroids, scans the ``n_probe`` closest lists (more when those hold fewer
+    than k rows) and returns the exact cosine similarities of the rows it
+    visited. ``documents[i]`` still belongs to row ``i``; only the row order
+    differs from the source corpus.
+    """
+
+    def __init__(self, embeddings, documents, path=None, meta=None, centroids=None, list_offsets=None, n_probe=DEFAULT_N_PROBE):
+        super().__init__(embeddings, documents, path=path, meta=meta)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self):
+        return 0 if self.centroids is None else self.centroids.shape[0]
+
+    # ========== Persistence ==========
+    @staticmethod
+    def exists(path):
+        return DenseIndex.exists(path) and os.path.exists(os.path.join(path, IVF_FILE))
+
+    @classmethod
+    def build(cls, path, embeddings, documents, dtype="float32", extra_meta=None, n_lists=None, seed=0, centroids=None):
+        """Cluster, reorder rows by inverted list and write the index to ``path``.
+
+        Passing ``centroids`` reuses an existing quantizer instead of training one.
+        ``embeddings`` may be a memory-mapped matrix: it is only read in blocks.
+        """
+        embeddings = np.asarray(embeddings)
+        count = embeddings.shape[0]
+        if count != len(documents):
+            raise ValueError(f"Got {count} embeddings for {len(documents)} documents")
+        if centroids is None:
+            n_lists = min(n_lists or default_n_lists(count), max(count, 1))
+            print(f"Training IVF quantizer with {n_lists} lists on {count} vectors...")
+            if count:
+                centroids = train_centroids(embeddings, n_lists, seed=seed)
+            else:
+                centroids = np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+        n_lists = centroids.shape[0]
+
+        if count:
+            assignments = assign_to_centroids(embeddings, centroids)
+        else:
+            assignments = np.empty(0, dtype=np.int64)
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, IVF_FILE), centroids=centroids, list_offsets=list_offsets)
+        writer = DenseIndexWriter(path, dtype=dtype, extra_meta=extra_meta)
+        for start in range(0, max(count, 1), ASSIGN_BLOCK_ROWS):
+            rows = order[start:start + ASSIGN_BLOCK_ROWS]
+            writer.append(embeddings[rows], [documents[i] for i in rows])
+        return writer.finish(cls)
+
+    @classmethod
+    def load(cls, path):
+        index = super().load(path)
+        with np.load(os.path.join(path, IVF_FILE)) as ivf:
+            index.centroids = ivf["centroids"].astype(np.float32)
+            index.list_offsets = ivf["list_offsets"]
+        return index
+
+    # ========== Search ==========
+    def search(self, query_embedding, k, n_probe=None):
+        """Approximate top-k over the ``n_probe`` nearest inverted lists, widened until they hold k rows"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize_rows(query_embedding)[0]
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        order = np.argsort(-(self.centroids @ query), kind="stable")
+        # Probe further lists until the visited ones hold k rows: on a small corpus n_probe lists
+        # can hold fewer, which would silently shrink the candidate pool of fusion and reranking
+        enough = int(np.searchsorted(np.cumsum(np.diff(self.list_offsets)[order]), min(k, len(self)))) + 1
+        probed = order[:max(n_probe, enough)]
+
+        rows = []
+        scores = []
+        for list_id in probed.tolist():
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            block = np.asarray(self.embeddings[start:end], dtype=np.float32)
+            rows.append(np.arange(start, end))
+            scores.append(block @ query)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(rows)
+        scores = np.concatenate(scores)
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+    def search_many(self, query_embeddings, k, n_probe=None):
+        """Per-query IVF search; k is capped at the index size, so every row is full"""
+        queries = normalize_rows(query_embeddings)
+        k = min(k, len(self))
+        all_rows = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for q, query in enumerate(queries):
+            rows, scores = self.search(query, k, n_probe=n_probe)
+            all_rows[q, :rows.shape[0]] = rows
+            all_scores[q, :scores.shape[0]] = scores
+        return all_rows, all_scores
@@ -1,11 +1,20 @@
 import logging
+import time
+import math
 import torch
 import re
+from threading import Thread
 from typing import List, Dict, Any, Optional
 from search_engine import hybrid_search_and_rerank
 from mongo_manager import save_message, get_conversation_history
 from question_suggester import suggest_questions
-from transformers import StoppingCriteria, StoppingCriteriaList
+from embedding_utils import embed_queries
+from cache_utils import SemanticAnswerCache
+from configuration import CACHE_CONFIG, GENERATION_CONFIG
+from generation_service import get_generation_service
+from prompt_cache import StaticPrefixCache, ConversationKVCache, extend_past, reuse_past
+from kv_cache import to_legacy, to_model_cache
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 import uuid
 
 # ========== Constants ==========
@@ -18,6 +27,38 @@ DEFAULT_CONTEXT_WINDOW = 4096
 
 logger = logging.getLogger(__name__)
 
+# ========== Prompt ==========
+# The system message and the rule block open every prompt; together they form
+# the static prefix whose past key/values are computed once per model
+SYSTEM_MESSAGE = (
+    "Bạn là một bác sĩ tâm lý chuyên về lĩnh vực sức khỏe tinh thần. Nhiệm vụ của bạn là trả lời câu hỏi của bệnh nhân bằng Tiếng Việt một cách rõ ràng, đồng cảm và chính xác đồng thời đưa ra những lời khuyên chân thành cho họ. Nếu người hỏi có ý định tự hại bản thân thì hãy ngăn họ lại và đưa ra những lời khuyên."
+)
+PROMPT_RULES = [
+    "QUAN TRỌNG: Hãy tuân thủ các quy tắc ưu tiên sau khi trả lời:",
+    "1. ƯU TIÊN SỐ 1: Xem xét kỹ Lịch sử hội thoại gần đây. Nếu câu hỏi hiện tại của người dùng có liên quan trực tiếp hoặc có thể được trả lời dựa trên thông tin đã trao đổi trong lịch sử, hãy trả lời dựa CHỦ YẾU vào lịch sử đó.",
+    "2. ƯU TIÊN SỐ 2: CHỈ KHI Lịch sử hội thoại không đủ thông tin, không liên quan đến câu hỏi hiện tại, hoặc không tồn tại, thì bạn MỚI được phép sử dụng Thông tin tham khảo được cung cấp dưới đây.",
+    "3. Khi sử dụng Thông tin tham khảo, hãy tích hợp nó một cách tự nhiên vào câu trả lời, không chỉ liệt kê. Luôn giữ giọng văn thân thiện và hỗ trợ.",
+    "4. Tuyệt đối không được bịa đặt thông tin không có trong lịch sử hoặc thông tin tham khảo."
+]
+PROMPT_SPLIT_MARKER = "\ue000"  # private-use character that never occurs in a prompt
+
+# Tokens that close a model turn; a cached answer ends with them before the follow-up turn is appended
+TURN_END_MARKERS = {"gemma": "<end_of_turn>", "qwen": "<|im_end|>", "llama": "<|eot_id|>"}
+
+prefix_cache = StaticPrefixCache()
+conversation_cache = ConversationKVCache(
+    max_bytes=GENERATION_CONFIG["CONVERSATION_KV_MAX_BYTES"],
+    spill=GENERATION_CONFIG["CONVERSATION_KV_SPILL"],
+    spill_max_bytes=GENERATION_CONFIG["CONVERSATION_KV_SPILL_MAX_BYTES"],
+    spill_dir=GENERATION_CONFIG["CONVERSATION_KV_SPILL_DIR"]
+)
+
+answer_cache = SemanticAnswerCache(
+    max_size=CACHE_CONFIG["ANSWER_CACHE_SIZE"],
+    ttl_seconds=CACHE_CONFIG["ANSWER_CACHE_TTL"],
+    threshold=CACHE_CONFIG["ANSWER_CACHE_THRESHOLD"]
+)
+
 # ========== Stopping Criteria ==========
 class SentenceEndingCriteria(StoppingCriteria):
     def __init__(self, tokenizer, min_length: int = MIN_SENTENCE_LENGTH):
@@ -83,6 +124,55 @@ def generate_prompt_for_model(
     else:
         raise ValueError(f"Unsupported model: {model_name}")
 
+def generate_followup_for_model(model_name: str, user_message: str) -> str:
+    """Text that closes the previous answer and opens a new user turn, in the model's template"""
+    model_name = model_name.lower()
+    if "gemma" in model_name:
+        return f"<end_of_turn>\n<start_of_turn>user\n{user_message}<end_of_turn>\n<start_of_turn>model\nTrả lời với vai trò là bác sĩ tâm lý:\n"
+    elif "qwen" in model_name:
+        return f"<|im_end|>\n<|im_start|>user\n{user_message}<|im_end|>\n"
+    elif "llama" in model_name:
+        return f"<|eot_id|><|start_header_id|>user<|end_header_id>\n{user_message}<|eot_id|><|start_header_id|>assistant<|end_header_id>\n"
+    else:
+        raise ValueError(f"Unsupported model: {model_name}")
+
+def format_history(history: List[Dict[str, str]]) -> str:
+    """The recent-history section text of a prompt (``role``/``text`` messages, oldest first)"""
+    return "\n".join(
+        f"{'Người dùng' if msg['role'] == 'user' else 'Trợ lý AI'}: {msg['text']}"
+        for msg in history
+    ) if history else ""
+
+def build_turn_prompt(model_name: str, query: str, history_prompt: str, context_texts: List[str]):
+    """(prompt, followup) of one turn.
+
+    ``prompt`` is the full prompt: system message, rules, the recent history
+    section, the retrieved context and the query. ``followup`` is the turn
+    appended to a conversation held in the conversation KV cache instead. It
+    carries only the context and the query: the rules (same text) sit at the
+    start of that conversation, and the earlier turns are there verbatim, as
+    their own prompts and raw answers, in place of the history section. The
+    model therefore sees the same instructions, but the history in another
+    form; benchmark_conversation_cache.py compares the answers of both.
+    """
+    turn_sections = [
+        "--- THÔNG TIN THAM KHẢO (Ưu tiên 2 - Chỉ dùng khi lịch sử không đủ) ---",
+        "\n\n".join(f"- {ctx}" for ctx in context_texts) if context_texts else "--- Không tìm thấy Thông tin tham khảo ---",
+        "--- Kết thúc Thông tin tham khảo ---",
+        "--- CÂU HỎI HIỆN TẠI CỦA NGƯỜI DÙNG ---",
+        query,
+        "--- CÂU TRẢ LỜI CỦA BẠN (Hãy nhớ quy tắc ưu tiên ở trên) ---"
+    ]
+    prompt_sections = PROMPT_RULES + [
+        "--- LỊCH SỬ HỘI THOẠI GẦN ĐÂY (Ưu tiên 1) ---",
+        history_prompt or "--- Không có Lịch sử hội thoại ---",
+        "--- Kết thúc Lịch sử hội thoại ---",
+    ] + turn_sections
+    user_message = "\n\n".join(prompt_sections).strip()
+    prompt = generate_prompt_for_model(model_name, SYSTEM_MESSAGE, user_message, history_prompt, context_texts)
+    followup = generate_followup_for_model(model_name, "\n\n".join(turn_sections).strip())
+    return prompt, followup
+
 def clean_response(model_name: str, response: str, tokenizer) -> str:
     """Clean model-specific response"""
     model_name = model_name.lower()
@@ -154,8 +244,253 @@ def ensure_complete_response(text: str) -> str:
         sentences.append(current.strip())
     return ' '.join(sentences) if sentences else text
 
+def get_llm_model_id(llm_model) -> str:
+    """Identifier of the LLM, so cached answers are never served for another model"""
+    return getattr(getattr(llm_model, "config", None), "_name_or_path", None) or llm_model.__class__.__name__
+
+def serve_cached_answer(conversation_id: str, answer: str, similarity: float) -> str:
+    """The LLM answer of a cache hit; sources and suggestions are still built for this turn"""
+    stats = answer_cache.stats()
+    logger.info(f"Answer cache hit (similarity {similarity:.3f}, hit rate {stats['hit_rate']:.1%} "
+                f"over {stats['hits'] + stats['misses']} lookups, {stats['bypassed']} turns with history bypassed).")
+    # The cached conversation would not contain this turn; the next one starts from a fresh prompt
+    conversation_cache.discard(conversation_id)
+    return answer
+
+# ========== LLM Generation ==========
+def render_prompt_text(model_name: str, llm_tokenizer, prompt) -> str:
+    """The prompt of ``generate_prompt_for_model`` as the exact text that gets tokenized"""
+    if "qwen" in model_name:
+        if not hasattr(llm_tokenizer, 'apply_chat_template'):
+            raise ValueError("Qwen model requires apply_chat_template method in tokenizer")
+        return llm_tokenizer.apply_chat_template(prompt, tokenize=False)
+    if "gemma" in model_name or "llama" in model_name:
+        return prompt
+    raise ValueError(f"Unsupported model: {model_name}")
+
+def encode_prompt_text(model_name: str, llm_tokenizer, text: str, **kwargs):
+    # Llama prompts spell out <|begin_of_text|> themselves
+    return llm_tokenizer(text, return_tensors="pt", add_special_tokens="llama" not in model_name, **kwargs)
+
+def prompt_token_budget(llm_model, max_new_tokens: int) -> int:
+    context_window = getattr(getattr(llm_model, 'config', None), 'max_position_embeddings', DEFAULT_CONTEXT_WINDOW)
+    return context_window - max_new_tokens
+
+def prepare_model_inputs(model_name: str, llm_model, llm_tokenizer, prompt, max_new_tokens: int) -> Dict[str, Any]:
+    """Tokenized prompt plus family-specific ``generate`` arguments"""
+    max_length = prompt_token_budget(llm_model, max_new_tokens)
+    input_text = render_prompt_text(model_name, llm_tokenizer, prompt)
+    model_inputs = encode_prompt_text(model_name, llm_tokenizer, input_text, truncation=True, max_length=max_length).to(llm_model.device)
+    if "llama" in model_name:
+        stopping_criteria = StoppingCriteriaList([
+            SentenceEndingCriteria(llm_tokenizer, min_length=MIN_SENTENCE_LENGTH)
+        ])
+        return {"input_ids": model_inputs['input_ids'], "stopping_criteria": stopping_criteria}
+    return {"input_ids": model_inputs['input_ids']}
+
+def static_prompt_prefix(model_name: str, llm_tokenizer) -> str:
+    """Rendered text every prompt of this model family starts with: template header, system message and rules"""
+    user_message = "\n\n".join(PROMPT_RULES + [PROMPT_SPLIT_MARKER])
+    prompt = generate_prompt_for_model(model_name, SYSTEM_MESSAGE, user_message, "", [])
+    text = render_prompt_text(model_name, llm_tokenizer, prompt)
+    return text[:text.index(PROMPT_SPLIT_MARKER)]
+
+def reusable_prompt_past(model_name: str, llm_model, llm_tokenizer, input_ids):
+    """(past, n): cached past key/values of the first n prompt tokens, or (None, 0).
+
+    The static prefix is prefilled once per loaded model; a prompt reuses
+    as much of it as its token ids share (for llama, whose template puts
+    history and context before the rules, that is the system block).
+    """
+    prefix_text = static_prompt_prefix(model_name, llm_tokenizer)
+    prefix_ids = encode_prompt_text(model_name, llm_tokenizer, prefix_text)["input_ids"][0].tolist()
+    cached_ids, cached_past = prefix_cache.get(llm_model, prefix_ids)
+    return reuse_past(input_ids[0].tolist(), cached_ids, cached_past)
+
+def continue_conversation(model_name: str, llm_model, llm_tokenizer, conversation_id: str, followup: str, max_new_tokens: int):
+    """(input ids, past, n) of the conversation's cached prompt and answer followed by ``followup``, or None.
+
+    None when the conversation is not cached for this model or the continued
+    prompt would no longer fit the context window (the caller then sends a fresh prompt).
+    """
+    cached = conversation_cache.get(conversation_id, get_llm_model_id(llm_model))
+    if cached is None:
+        return None
+    cached_ids, cached_past = cached
+    family = next(name for name in TURN_END_MARKERS if name in model_name)
+    turn_end_ids = {llm_tokenizer.eos_token_id, llm_tokenizer.convert_tokens_to_ids(TURN_END_MARKERS[family])}
+    token_ids = list(cached_ids)
+    while token_ids and token_ids[-1] in turn_end_ids:
+        token_ids.pop()
+    token_ids += llm_tokenizer(followup, add_special_tokens=False)["input_ids"]
+    if len(token_ids) > prompt_token_budget(llm_model, max_new_tokens):
+        logger.info("Cached conversation no longer fits the context window; sending a fresh prompt.")
+        return None
+    past, reused = reuse_past(token_ids, cached_ids, cached_past)
+    return torch.tensor([token_ids], dtype=torch.long, device=llm_model.device), past, reused
+
+def decode_response(model_name: str, outputs, input_ids, llm_tokenizer) -> str:
+    """Decode and clean the full ``generate`` output of one prompt"""
+    full_response = llm_tokenizer.decode(outputs[0], skip_special_tokens=False)
+    if "gemma" in model_name:
+        return clean_response("gemma", full_response, llm_tokenizer)
+    if "qwen" in model_name:
+        input_text_with_special = llm_tokenizer.decode(input_ids[0], skip_special_tokens=False)
+        raw_response = full_response[len(input_text_with_special):].strip()
+        return clean_response("qwen", raw_response, llm_tokenizer)
+    return clean_response("llama", full_response, llm_tokenizer)
+
+_ROLE_PREFIX = re.compile(r'^\s*(assistant|model|solver|response)\s*(:\s*|\n)', re.IGNORECASE)
+ROLE_PREFIX_HOLDBACK = 12  # characters held back until a leading role label can be recognized
+
+def visible_partial_response(raw_text: str) -> str:
+    """Best-effort cleaned text of a generation in progress (special tokens already skipped)"""
+    text = raw_text.lstrip()
+    if len(text) < ROLE_PREFIX_HOLDBACK and "\n" not in text:
+        return ""
+    return _ROLE_PREFIX.sub('', text, count=1)
+
+def visible_deltas(raw_texts):
+    """Yield the newly visible cleaned text for each successive raw text of a generation in progress"""
+    emitted = ""
+    for raw_text in raw_texts:
+        visible = visible_partial_response(raw_text)
+        # Only extend what was already shown; a cleaning change mid-stream waits for the final text
+        if len(visible) > len(emitted) and visible.startswith(emitted):
+            yield visible[len(emitted):]
+            emitted = visible
+
+def stream_llm_response(model_name: str, llm_model, llm_tokenizer, prompt, generation_params: Dict[str, Any],
+                        conversation_id: Optional[str] = None, followup: Optional[str] = None):
+    """Run ``generate`` on a background thread and yield cleaned text deltas as tokens arrive.
+
+    Returns (as the generator's return value) the final response, decoded and
+    cleaned from the full output exactly like a blocking call. The streamed
+    deltas are provisional: the final text may still drop an unfinished last sentence.
+    With ``USE_GENERATION_SERVICE`` the prompt is decoded by the model's shared
+    continuous-batching worker instead of a ``generate`` call of its own.
+    With ``PREFIX_CACHE`` only the prompt tokens after the cached static prefix are prefilled.
+    With a ``conversation_id`` the prompt and answer are kept in the conversation
+    KV cache; if the conversation is already cached, the ``followup`` turn is
+    appended to it instead of sending ``prompt``, so only the new turn is prefilled
+    (see ``build_turn_prompt`` for how that prompt differs from ``prompt``).
+    """
+    model_inputs = prepare_model_inputs(model_name, llm_model, llm_tokenizer, prompt, generation_params["max_new_tokens"])
+    past, reused = None, 0
+    if GENERATION_CONFIG["PREFIX_CACHE"]:
+        past, reused = reusable_prompt_past(model_name, llm_model, llm_tokenizer, model_inputs["input_ids"])
+    continued = None
+    if conversation_id is not None and followup is not None:
+        continued = continue_conversation(
+            model_name, llm_model, llm_tokenizer, conversation_id, followup, generation_params["max_new_tokens"]
+        )
+    if continued is not None:
+        model_inputs["input_ids"], past, reused = continued
+    logger.info(f"Reusing cached past key/values for {reused}/{model_inputs['input_ids'].shape[1]} prompt tokens"
+                f"{' (continued conversation)' if continued is not None else ''}.")
+
+    if GENERATION_CONFIG["USE_GENERATION_SERVICE"]:
+        return (yield from _stream_from_service(
+            model_name, llm_model, llm_tokenizer, model_inputs, generation_params, past, conversation_id
+        ))
+    streamer = TextIteratorStreamer(llm_tokenizer, skip_prompt=True, skip_special_tokens=True)
+    result = {}
+
+    def run_generation():
+        try:
+            cache_inputs = {}
+            if past is not None:
+                # Cover all but the last prompt token, so generate() only has that one left to run
+                prompt_past = extend_past(llm_model, model_inputs["input_ids"][0, reused:-1].tolist(), past)
+                cache_inputs = {
+                    "past_key_values": to_model_cache(prompt_past),
+                    "attention_mask": torch.ones_like(model_inputs["input_ids"])
+                }
+            if conversation_id is not None:
+                cache_inputs["return_dict_in_generate"] = True
+            outputs = llm_model.generate(
+                **model_inputs,
+                **cache_inputs,
+                pad_token_id=llm_tokenizer.pad_token_id,
+                eos_token_id=llm_tokenizer.eos_token_id,
+                streamer=streamer,
+                **generation_params
+            )
+            if conversation_id is not None:
+                result["outputs"] = outputs.sequences
+                # Older transformers releases do not return the cache from generate()
+                if getattr(outputs, "past_key_values", None) is not None:
+                    result["past"] = to_legacy(outputs.past_key_values)
+            else:
+                result["outputs"] = outputs
+        except Exception as e:
+            result["error"] = e
+            streamer.end()
+
+    thread = Thread(target=run_generation, daemon=True)
+    thread.start()
+
+    def raw_texts():
+        raw_text = ""
+        for new_text in streamer:
+            raw_text += new_text
+            yield raw_text
+
+    yield from visible_deltas(raw_texts())
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    if "past" in result:
+        conversation_cache.put(conversation_id, get_llm_model_id(llm_model), result["outputs"][0].tolist(), result["past"])
+    return decode_response(model_name, result["outputs"], model_inputs["input_ids"], llm_tokenizer)
+
+def _stream_from_service(model_name: str, llm_model, llm_tokenizer, model_inputs, generation_params: Dict[str, Any],
+                         past=None, conversation_id: Optional[str] = None):
+    prompt_ids = model_inputs["input_ids"][0].tolist()
+    request = get_generation_service(llm_model).submit(
+        prompt_ids,
+        past_key_values=past,
+        keep_past=conversation_id is not None,
+        eos_token_id=llm_tokenizer.eos_token_id,
+        stopping_criteria=model_inputs.get("stopping_criteria"),
+        **generation_params
+    )
+
+    def raw_texts():
+        token_ids = []
+        for token_id in request.stream():
+            token_ids.append(token_id)
+            yield llm_tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    yield from visible_deltas(raw_texts())
+    sequence = prompt_ids + request.result()
+    if conversation_id is not None:
+        conversation_cache.put(conversation_id, get_llm_model_id(llm_model), sequence, request.past_key_values)
+    return decode_response(model_name, [sequence], model_inputs["input_ids"], llm_tokenizer)
+
 # ========== Main Answer Generation ==========
-def generate_answer(
+class AnswerStream:
+    """Iterator over the text deltas of an answer.
+
+    Once exhausted, ``answer`` holds the final response (with sources and
+    suggestions) that was saved to the conversation history.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.answer = None
+
+    def __iter__(self):
+        self.answer = yield from self._chunks
+
+def generate_answer(*args, **kwargs) -> str:
+    """Generate an answer for the given query using the LLM and context (blocking)."""
+    stream = generate_answer_stream(*args, **kwargs)
+    for _ in stream:
+        pass
+    return stream.answer
+
+def generate_answer_stream(
     conversation_id: str,
     query: str,
     llm_model,
@@ -171,70 +506,28 @@ def generate_answer(
     k_initial: int = 5,
     k_final: int = 3,
     max_history: int = 5
-) -> str:
-    """Generate an answer for the given query using the LLM and context."""
-    logger.info(f"New Query | Conversation ID: {conversation_id} | Query: {query}")
-
-    # Identity question shortcut
-    if is_identity_question(query):
-        identity_response = get_identity_response()
-        save_message(conversation_id, "user", query)
-        save_message(conversation_id, "chatbot", identity_response)
-        return identity_response
-
-    # Hybrid Search and Rerank
-    logger.info("Performing Hybrid Search (BGE+BM25) & Rerank...")
-    search_results = hybrid_search_and_rerank(
-        query, collection_embeddings, bge_model, bge_tokenizer, reranker_model, reranker_tokenizer, bm25,
-        alpha=alpha, k_embed_retrieval=k_embed, top_k_initial=k_initial, top_k_final=k_final
-    )
-    context_texts = [res['text'] for res in search_results] if search_results else []
-    sources = [res['source'] for res in search_results] if search_results else []
-    source_list = list(dict.fromkeys(s for s in sources if s and s != "Không có nguồn"))[:3]
-    avg_rerank_score = sum(res['rerank_score'] for res in search_results) / len(search_results) if search_results else 0.0
-    logger.info(f"Retrieved {len(context_texts)} context passages. Average rerank score: {avg_rerank_score:.2f}")
-    if source_list:
-        logger.info(f"Sources found: {source_list}")
-
-    # Conversation History
-    logger.info(f"Retrieving conversation history (max {max_history})...")
-    history = get_conversation_history(conversation_id, max_history=max_history)
-    history_prompt = "\n".join(
-        f"{'Người dùng' if msg['role'] == 'user' else 'Trợ lý AI'}: {msg['text']}"
-        for msg in history
-    ) if history else ""
-    if history:
-        logger.info(f"History found ({len(history)} turns).")
-    else:
-        logger.info("No previous history found for this conversation.")
+) -> AnswerStream:
+    """Like ``generate_answer``, but yields text as the LLM produces it.
 
-    # Build Prompt
-    logger.info("Building prioritized prompt for LLM...")
-    system_message = (
-        "Bạn là một bác sĩ tâm lý chuyên về lĩnh vực sức khỏe tinh thần. Nhiệm vụ của bạn là trả lời câu hỏi của bệnh nhân bằng Tiếng Việt một cách rõ ràng, đồng cảm và chính xác đồng thời đưa ra những lời khuyên chân thành cho họ. Nếu người hỏi có ý định tự hại bản thân thì hãy ngăn họ lại và đưa ra những lời khuyên."
-    )
-    prompt_sections = [
-        "QUAN TRỌNG: Hãy tuân thủ các quy tắc ưu tiên sau khi trả lời:",
-        "1. ƯU TIÊN SỐ 1: Xem xét kỹ Lịch sử hội thoại gần đây. Nếu câu hỏi hiện tại của người dùng có liên quan trực tiếp hoặc có thể được trả lời dựa trên thông tin đã trao đổi trong lịch sử, hãy trả lời dựa CHỦ YẾU vào lịch sử đó.",
-        "2. ƯU TIÊN SỐ 2: CHỈ KHI Lịch sử hội thoại không đủ thông tin, không liên quan đến câu hỏi hiện tại, hoặc không tồn tại, thì bạn MỚI được phép sử dụng Thông tin tham khảo được cung cấp dưới đây.",
-        "3. Khi sử dụng Thông tin tham khảo, hãy tích hợp nó một cách tự nhiên vào câu trả lời, không chỉ liệt kê. Luôn giữ giọng văn thân thiện và hỗ trợ.",
-        "4. Tuyệt đối không được bịa đặt thông tin không có trong lịch sử hoặc thông tin tham khảo.",
-        "--- LỊCH SỬ HỘI THOẠI GẦN ĐÂY (Ưu tiên 1) ---",
-        history_prompt or "--- Không có Lịch sử hội thoại ---",
-        "--- Kết thúc Lịch sử hội thoại ---",
-        "--- THÔNG TIN THAM KHẢO (Ưu tiên 2 - Chỉ dùng khi lịch sử không đủ) ---",
-        "\n\n".join(f"- {ctx}" for ctx in context_texts) if context_texts else "--- Không tìm thấy Thông tin tham khảo ---",
-        "--- Kết thúc Thông tin tham khảo ---",
-        "--- CÂU HỎI HIỆN TẠI CỦA NGƯỜI DÙNG ---",
-        query,
-        "--- CÂU TRẢ LỜI CỦA BẠN (Hãy nhớ quy tắc ưu tiên ở trên) ---"
-    ]
-    user_message = "\n\n".join(prompt_sections).strip()
+    Retrieval runs when iteration starts; history persistence and question
+    suggestions happen once the generation has finished.
+    """
+    return AnswerStream(_answer_chunks(
+        conversation_id, query, llm_model, llm_tokenizer, collection_embeddings, bge_model, bge_tokenizer,
+        reranker_model, reranker_tokenizer, bm25, alpha, k_embed, k_initial, k_final, max_history
+    ))
 
-    # Generate Answer with LLM
+def _generated_answer_chunks(conversation_id, query, llm_model, llm_tokenizer, history, history_prompt, context_texts):
+    """Yield the LLM's answer text as it is generated; returns the complete answer (or an apology)"""
     logger.info("Generating answer with LLM model...")
     llm_response = ""
+    streamed = ""
     try:
+        # Build Prompt
+        model_name = str(llm_model.__class__).lower()
+        prompt, followup = build_turn_prompt(model_name, query, history_prompt, context_texts)
+
+        # Generate Answer with LLM
         generation_params = {
             "max_new_tokens": MAX_NEW_TOKENS,
             "temperature": TEMPERATURE,
@@ -242,72 +535,25 @@ def generate_answer(
             "do_sample": True,
             "repetition_penalty": REPETITION_PENALTY
         }
-        model_name = str(llm_model.__class__).lower()
-        context_window = getattr(getattr(llm_model, 'config', None), 'max_position_embeddings', DEFAULT_CONTEXT_WINDOW)
-        prompt = generate_prompt_for_model(model_name, system_message, user_message, history_prompt, context_texts)
-
-        if "gemma" in model_name:
-            model_input = llm_tokenizer(
-                prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=context_window - generation_params["max_new_tokens"],
-                padding=True
-            ).to(llm_model.device)
-            outputs = llm_model.generate(
-                model_input['input_ids'],
-                pad_token_id=llm_tokenizer.pad_token_id,
-                eos_token_id=llm_tokenizer.eos_token_id,
-                **generation_params
-            )
-            full_response = llm_tokenizer.decode(outputs[0], skip_special_tokens=False)
-            llm_response = clean_response("gemma", full_response, llm_tokenizer)
-
-        elif "qwen" in model_name:
-            if hasattr(llm_tokenizer, 'apply_chat_template'):
-                input_text = llm_tokenizer.apply_chat_template(prompt, tokenize=False)
-                model_inputs = llm_tokenizer(
-                    input_text,
-                    return_tensors="pt",
-                    truncation=True,
-                    max_length=context_window - generation_params["max_new_tokens"],
-                    add_special_tokens=True
-                ).to(llm_model.device)
-                outputs = llm_model.generate(
-                    model_inputs.input_ids,
-                    pad_token_id=llm_tokenizer.pad_token_id,
-                    eos_token_id=llm_tokenizer.eos_token_id,
-                    **generation_params
-                )
-                full_response = llm_tokenizer.decode(outputs[0], skip_special_tokens=False)
-                input_text_with_special = llm_tokenizer.decode(model_inputs.input_ids[0], skip_special_tokens=False)
-                raw_response = full_response[len(input_text_with_special):].strip()
-                llm_response = clean_response("qwen", raw_response, llm_tokenizer)
-            else:
-                raise ValueError("Qwen model requires apply_chat_template method in tokenizer")
-
-        elif "llama" in model_name:
-            model_input = llm_tokenizer(
-                prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=context_window - generation_params["max_new_tokens"],
-                add_special_tokens=False
-            ).to(llm_model.device)
-            stopping_criteria = StoppingCriteriaList([
-                SentenceEndingCriteria(llm_tokenizer, min_length=MIN_SENTENCE_LENGTH)
-            ])
-            outputs = llm_model.generate(
-                model_input['input_ids'],
-                pad_token_id=llm_tokenizer.pad_token_id,
-                eos_token_id=llm_tokenizer.eos_token_id,
-                stopping_criteria=stopping_criteria,
-                **generation_params
-            )
-            full_response = llm_tokenizer.decode(outputs[0], skip_special_tokens=False)
-            llm_response = clean_response("llama", full_response, llm_tokenizer)
-        else:
-            raise ValueError(f"Unsupported model: {model_name}")
+        first_token_time = None
+        generation_start = time.perf_counter()
+        chunks = stream_llm_response(
+            model_name, llm_model, llm_tokenizer, prompt, generation_params,
+            conversation_id=conversation_id if GENERATION_CONFIG["CONVERSATION_KV_CACHE"] else None,
+            followup=followup if history else None
+        )
+        while True:
+            try:
+                delta = next(chunks)
+            except StopIteration as stop:
+                llm_response = stop.value
+                break
+            if first_token_time is None:
+                first_token_time = time.perf_counter() - generation_start
+                logger.info(f"First streamed text after {first_token_time:.2f}s.")
+            streamed += delta
+            yield delta
+        logger.info(f"Generation finished in {time.perf_counter() - generation_start:.2f}s.")
 
         # Ensure complete response
         llm_response = ensure_complete_response(llm_response)
@@ -316,6 +562,71 @@ def generate_answer(
     except Exception as e:
         logger.error(f"Error during LLM generation: {str(e)}")
         llm_response = "Xin lỗi, tôi gặp sự cố khi tạo câu trả lời. Vui lòng thử lại."
+        yield ("\n\n" if streamed else "") + llm_response
+    return llm_response
+
+def _answer_chunks(conversation_id, query, llm_model, llm_tokenizer, collection_embeddings, bge_model, bge_tokenizer,
+                   reranker_model, reranker_tokenizer, bm25, alpha, k_embed, k_initial, k_final, max_history):
+    logger.info(f"New Query | Conversation ID: {conversation_id} | Query: {query}")
+
+    # Identity question shortcut
+    if is_identity_question(query):
+        identity_response = get_identity_response()
+        conversation_cache.discard(conversation_id)
+        save_message(conversation_id, "user", query)
+        save_message(conversation_id, "chatbot", identity_response)
+        yield identity_response
+        return identity_response
+
+    # Conversation History (first: only turns without history may use the answer cache)
+    logger.info(f"Retrieving conversation history (max {max_history})...")
+    history = get_conversation_history(conversation_id, max_history=max_history)
+    history_prompt = format_history(history)
+    if history:
+        logger.info(f"History found ({len(history)} turns).")
+    else:
+        logger.info("No previous history found for this conversation.")
+
+    # Encoded once: the same embedding drives the answer cache, retrieval and question suggestion
+    query_embedding = embed_queries([query], bge_model, bge_tokenizer)[0]
+    llm_model_id = get_llm_model_id(llm_model)
+    use_answer_cache = CACHE_CONFIG["ANSWER_CACHE_ENABLED"] and not history
+    if CACHE_CONFIG["ANSWER_CACHE_ENABLED"] and history:
+        answer_cache.record_bypass()
+
+    # Hybrid Search and Rerank
+    logger.info("Performing Hybrid Search (BGE+BM25) & Rerank...")
+    retrieval_stats = {}
+    search_results = hybrid_search_and_rerank(
+        query, collection_embeddings, bge_model, bge_tokenizer, reranker_model, reranker_tokenizer, bm25,
+        alpha=alpha, k_embed_retrieval=k_embed, top_k_initial=k_initial, top_k_final=k_final, stats=retrieval_stats,
+        query_embedding=query_embedding
+    )
+    if retrieval_stats:
+        logger.info(f"Reranked {retrieval_stats['rerank_pairs_scored']}/{retrieval_stats['rerank_pairs_available']} pairs "
+                    f"({retrieval_stats['rerank_model_pairs']} through the cross-encoder).")
+    doc_ids = [res['id'] for res in search_results] if search_results else []
+    # Only a question answered from exactly the same passages may reuse an answer
+    cached = answer_cache.lookup(llm_model_id, query_embedding, doc_ids=doc_ids) if use_answer_cache else None
+    context_texts = [res['text'] for res in search_results] if search_results else []
+    # Canonical passages also list the sources of the near-duplicates collapsed into them
+    sources = [source for res in search_results for source in res.get('sources', [res['source']])] if search_results else []
+    source_list = list(dict.fromkeys(s for s in sources if s and s != "Không có nguồn"))[:3]
+    # Only cross-encoder scores are calibrated for the source threshold; skipped or failed reranking shows no sources
+    rerank_scores = [res['rerank_score'] for res in search_results if math.isfinite(res['rerank_score'])] if search_results else []
+    avg_rerank_score = sum(rerank_scores) / len(rerank_scores) if rerank_scores else 0.0
+    logger.info(f"Retrieved {len(context_texts)} context passages. Average rerank score: {avg_rerank_score:.2f} "
+                f"({len(rerank_scores)} reranked)")
+    if source_list:
+        logger.info(f"Sources found: {source_list}")
+
+    if cached is not None:
+        llm_response = serve_cached_answer(conversation_id, *cached)
+        yield llm_response
+    else:
+        llm_response = yield from _generated_answer_chunks(
+            conversation_id, query, llm_model, llm_tokenizer, history, history_prompt, context_texts
+        )
 
     # Add Sources and Suggestions
     final_response = llm_response
@@ -323,7 +634,7 @@ def generate_answer(
         if "Nguồn tham khảo:" not in final_response:
             final_response += f"\n\nNguồn tham khảo:\n\n {', '.join(source_list)}"
     logger.info("Suggesting related questions...")
-    related_questions = suggest_questions(query, history)
+    related_questions = suggest_questions(query, history, query_embedding=query_embedding, results=search_results)
     if related_questions:
         if "Bạn có thể quan tâm:" not in final_response:
             suggestions = "\n\nBạn có thể quan tâm:\n"
@@ -336,6 +647,14 @@ def generate_answer(
     if llm_response and "Xin lỗi" not in llm_response:
         save_message(conversation_id, "user", query)
         save_message(conversation_id, "chatbot", final_response)
+        if use_answer_cache and cached is None:
+            # Only the LLM answer: sources and suggestions are built from each turn's own query
+            answer_cache.store(llm_model_id, query, query_embedding, doc_ids, llm_response)
+    else:
+        # The turn is not in the history, so the model must not continue from it either
+        conversation_cache.discard(conversation_id)
     logger.info(f"Final Response:\n{final_response}")
     logger.info("--- End Query ---")
+    if final_response.startswith(llm_response) and len(final_response) > len(llm_response):
+        yield final_response[len(llm_response):]
     return final_response
\ No newline at end of file
@@ -2,10 +2,11 @@ import streamlit as st
 import time
 import logging
 from model_loader import load_models, unload_model
-from data_processor import initialize_data
+from data_processor import initialize_data, knowledge_base_version
+from question_suggester import setup_question_suggestion
 from mongo_manager import connect_to_mongodb, get_conversation_history, collection_history
 from configuration import AVAILABLE_MODELS  # Add this import
-from answer_generator import generate_answer
+from answer_generator import generate_answer_stream, answer_cache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -679,6 +680,8 @@ def initialize_system(model_name):
                 return None
             system_data["bm25"] = bm25
             system_data["collection_embeddings"] = collection_embeddings
+            setup_question_suggestion(system_data["bge"][0], system_data["bge"][1], dense_index=collection_embeddings)
+            answer_cache.set_knowledge_base_version(knowledge_base_version())
             st.success("✅ Đã xử lý xong dữ liệu!")
         except Exception as e:
             st.error(f"❌ Lỗi khi xử lý dữ liệu: {str(e)}")
@@ -764,9 +767,10 @@ with chat_placeholder.container():
                 </div>
                 ''', unsafe_allow_html=True)
 
-    # Display typing indicator if the bot is processing
+    # Display typing indicator if the bot is processing; streamed text replaces it
     if st.session_state.is_typing:
-        st.markdown('''
+        streaming_placeholder = st.empty()
+        streaming_placeholder.markdown('''
         <div class="message-container bot-message-container">
             <div class="avatar bot-avatar">🤖</div>
             <div class="chat-message bot-message">
@@ -855,15 +859,25 @@ if st.session_state.is_typing and st.session_state.messages and st.session_state
         user_query = st.session_state.messages[-1]["text"]
         llm_model, llm_tokenizer = system["llm"]
         
-        answer = generate_answer(
+        answer_stream = generate_answer_stream(
             st.session_state.conversation_id, user_query,
             llm_model, llm_tokenizer,
             system["collection_embeddings"], system["bge"][0], system["bge"][1],
             system["reranker"][0], system["reranker"][1], system["bm25"],
             alpha=0.5, k_embed=50, k_initial=20, k_final=3, max_history=5
         )
+        # Render the answer as it is generated; the final text (with sources and suggestions) replaces it on rerun
+        partial_answer = ""
+        for delta in answer_stream:
+            partial_answer += delta
+            streaming_placeholder.markdown(f'''
+            <div class="message-container bot-message-container">
+                <div class="avatar bot-avatar">🤖</div>
+                <div class="chat-message bot-message">{partial_answer}</div>
+            </div>
+            ''', unsafe_allow_html=True)
 
-        st.session_state.messages.append({"role": "chatbot", "text": answer})
+        st.session_state.messages.append({"role": "chatbot", "text": answer_stream.answer})
     except Exception as e:
         logger.error(f"Error generating answer: {str(e)}", exc_info=True)
         st.session_state.messages.append({
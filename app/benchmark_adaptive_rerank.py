@@ -0,0 +1,91 @@
+"""Cross-encoder work and result agreement of adaptive reranking versus full-depth reranking.
+
+Runs the real user questions in data/question.txt through hybrid retrieval
+(BGE, BM25 and the reranker; no LLM) against the configured knowledge base.
+Every query is reranked at full depth once; each adaptive setting is then
+compared with it on the pairs it scored, the queries it skipped and how often
+its final top ``k_final`` ids agree with the full-depth ones. The rerank score
+cache is cleared before every run, so each one pays for its own pairs:
+
+    python benchmark_adaptive_rerank.py --decisive-gap 0.4 0.6 0.8 --window 0.3 0.5
+    python benchmark_adaptive_rerank.py --queries 100 --top-k-initial 10 --top-k-final 3
+"""
+import argparse
+import itertools
+import time
+import numpy as np
+from configuration import RETRIEVAL_CONFIG
+from model_loader import load_bge_model, load_reranker_model
+from data_processor import initialize_data
+from benchmark_ann import load_questions
+from search_engine import search_many, rerank_score_cache
+
+def timed_search(queries, retrieval, adaptive_rerank, query_batch_size, **search_kwargs):
+    """(results per query, summed rerank stats, wall seconds) of one pass over ``queries``"""
+    rerank_score_cache.clear()
+    results = []
+    totals = {}
+    start = time.perf_counter()
+    for offset in range(0, len(queries), query_batch_size):
+        stats = {}
+        results.extend(search_many(
+            queries[offset:offset + query_batch_size], *retrieval,
+            adaptive_rerank=adaptive_rerank, stats=stats, **search_kwargs
+        ))
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return results, totals, time.perf_counter() - start
+
+def agreement(results, reference):
+    """(mean overlap of the top-k id sets, share of identical ordered lists, share of identical top-1)"""
+    overlap, same_order, same_top = [], [], []
+    for found, expected in zip(results, reference):
+        found_ids = [res["id"] for res in found]
+        expected_ids = [res["id"] for res in expected]
+        overlap.append(len(set(found_ids) & set(expected_ids)) / max(len(expected_ids), 1))
+        same_order.append(found_ids == expected_ids)
+        same_top.append(found_ids[:1] == expected_ids[:1])
+    return float(np.mean(overlap)), float(np.mean(same_order)), float(np.mean(same_top))
+
+def report(label, totals, wall, n_queries, scores=(1.0, 1.0, 1.0)):
+    print(f"{label:>22} {totals.get('rerank_pairs_scored', 0):>8} {totals.get('rerank_pairs_available', 0):>9} "
+          f"{totals.get('rerank_skipped_queries', 0):>8} {scores[0]:>9.3f} {scores[1]:>8.3f} {scores[2]:>7.3f} "
+          f"{wall * 1000 / n_queries:>9.1f}")
+
+def run(n_queries, question_file, gaps, windows, step, query_batch_size, **search_kwargs):
+    bge_model, bge_tokenizer = load_bge_model()
+    reranker_model, reranker_tokenizer = load_reranker_model()
+    _, bm25, collection_embeddings = initialize_data(bge_model, bge_tokenizer)
+    retrieval = (collection_embeddings, bge_model, bge_tokenizer, reranker_model, reranker_tokenizer, bm25)
+    queries = load_questions(n_queries, question_file)
+
+    full, full_totals, full_wall = timed_search(queries, retrieval, False, query_batch_size, **search_kwargs)
+    rows = []
+    for gap, window in itertools.product(gaps, windows):
+        RETRIEVAL_CONFIG.update(ADAPTIVE_DECISIVE_GAP=gap, ADAPTIVE_SCORE_WINDOW=window, ADAPTIVE_RERANK_STEP=step)
+        adaptive, totals, wall = timed_search(queries, retrieval, True, query_batch_size, **search_kwargs)
+        rows.append((f"gap={gap}/window={window}", totals, wall, agreement(adaptive, full)))
+
+    print(f"\n{len(queries)} questions, top_k_final={search_kwargs['top_k_final']}, rerank step {step}")
+    print(f"{'reranking':>22} {'pairs':>8} {'available':>9} {'skipped':>8} {'top-k set':>9} {'order':>8} {'top-1':>7} {'ms/query':>9}")
+    report("full depth", full_totals, full_wall, len(queries))
+    for label, totals, wall, scores in rows:
+        report(label, totals, wall, len(queries), scores)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=None, help="first N questions (default: all)")
+    parser.add_argument("--questions", default=None, help="question file (default: data/question.txt)")
+    parser.add_argument("--decisive-gap", type=float, nargs="+", default=[RETRIEVAL_CONFIG["ADAPTIVE_DECISIVE_GAP"]])
+    parser.add_argument("--window", type=float, nargs="+", default=[RETRIEVAL_CONFIG["ADAPTIVE_SCORE_WINDOW"]])
+    parser.add_argument("--step", type=int, default=RETRIEVAL_CONFIG["ADAPTIVE_RERANK_STEP"])
+    parser.add_argument("--alpha", type=float, default=0.5)
+    parser.add_argument("--k-embed", type=int, default=50)
+    parser.add_argument("--top-k-initial", type=int, default=5)
+    parser.add_argument("--top-k-final", type=int, default=3)
+    parser.add_argument("--query-batch-size", type=int, default=32)
+    args = parser.parse_args()
+    run(
+        args.queries, args.questions, args.decisive_gap, args.window, args.step, args.query_batch_size,
+        alpha=args.alpha, k_embed_retrieval=args.k_embed, top_k_initial=args.top_k_initial, top_k_final=args.top_k_final
+    )
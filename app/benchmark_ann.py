@@ -0,0 +1,80 @@
+"""Recall/latency benchmark of the IVF index against exact dense search.
+
+Uses synthetic clustered embeddings so it runs without the BGE model:
+
+    python benchmark_ann.py --sizes 10000 100000 1000000 --dim 1024 --n-probe 4 8 16 32
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+from dense_index import DenseIndex
+from ann_index import IVFIndex
+
+def synthetic_embeddings(count, dim, n_clusters=256, noise=0.35, seed=0):
+    """Gaussian-mixture vectors; real sentence embeddings are similarly clustered by topic"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, count)
+    vectors = centers[labels] + noise * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors
+
+def synthetic_queries(corpus, count, noise=0.5, seed=1):
+    """Corpus rows plus Gaussian noise whose norm is ``noise`` times the row's (whatever the rows are scaled to)"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, corpus.shape[0], count)
+    rows = corpus[picks]
+    scale = noise * np.linalg.norm(rows, axis=1, keepdims=True) / np.sqrt(corpus.shape[1])
+    return rows + scale * rng.standard_normal((count, corpus.shape[1])).astype(np.float32)
+
+def load_questions(count=None, question_file=None):
+    """The first ``count`` user questions of data/question.txt, without their "Câu N:" labels"""
+    from configuration import DATA_CONFIG
+    from question_suggester import clean_question
+    with open(question_file or DATA_CONFIG["QUESTIONS"], "r", encoding="utf-8") as f:
+        return [clean_question(line) for line in f if line.strip()][:count]
+
+def timed_search(index, queries, k, **search_kwargs):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = index.search(query, k, **search_kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(rows)
+    return results, np.array(latencies)
+
+def recall_at_k(approx_ids, exact_ids):
+    hits = [len(set(a.tolist()) & set(e.tolist())) / max(len(e), 1) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits))
+
+def run(sizes, dim, k, n_probes, n_queries, n_lists):
+    print(f"{'size':>10} {'index':>14} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for size in sizes:
+        corpus = synthetic_embeddings(size, dim)
+        queries = synthetic_queries(corpus, n_queries)
+        documents = [{"id": str(i), "text": "", "source": ""} for i in range(size)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            exact = DenseIndex.build(f"{tmp}/exact", corpus, documents)
+            exact_rows, exact_latency = timed_search(exact, queries, k)
+            exact_ids = [np.array([int(exact.ids[r]) for r in rows]) for rows in exact_rows]
+            print(f"{size:>10} {'exact':>14} {1.0:>9.3f} {np.percentile(exact_latency, 50):>8.2f} {np.percentile(exact_latency, 99):>8.2f}")
+
+            ivf = IVFIndex.build(f"{tmp}/ivf", corpus, documents, n_lists=n_lists)
+            for n_probe in n_probes:
+                ivf_rows, ivf_latency = timed_search(ivf, queries, k, n_probe=n_probe)
+                ivf_ids = [np.array([int(ivf.ids[r]) for r in rows]) for rows in ivf_rows]
+                label = f"ivf/probe={n_probe}"
+                print(f"{size:>10} {label:>14} {recall_at_k(ivf_ids, exact_ids):>9.3f} {np.percentile(ivf_latency, 50):>8.2f} {np.percentile(ivf_latency, 99):>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--n-lists", type=int, default=None, help="default: 4 * sqrt(size)")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.k, args.n_probe, args.queries, args.n_lists)
@@ -0,0 +1,90 @@
+"""Answers and latency of follow-up turns with and without the conversation KV cache.
+
+A continued conversation appends each follow-up as a new chat turn holding
+only the retrieved context and the query; a fresh prompt repeats the rules and
+rebuilds the recent-history section instead (see ``build_turn_prompt``). This
+replays scripted conversations (consecutive questions of data/question.txt)
+through both paths with greedy decoding and reports, per follow-up turn, how
+often the two answers are identical, their token F1 and the time to first
+text. Retrieval and MongoDB are left out: turns carry no context passages and
+the history is kept in memory, in the format ``_answer_chunks`` builds it:
+
+    python benchmark_conversation_cache.py --model ../models/qwen_finetune --conversations 20 --turns 3
+"""
+import argparse
+import time
+from collections import Counter
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from answer_generator import MAX_NEW_TOKENS, REPETITION_PENALTY, build_turn_prompt, format_history, stream_llm_response
+from benchmark_ann import load_questions
+
+def token_f1(first, second):
+    first, second = first.split(), second.split()
+    common = sum((Counter(first) & Counter(second)).values())
+    if not first or not second or not common:
+        return float(first == second)
+    precision, recall = common / len(first), common / len(second)
+    return 2 * precision * recall / (precision + recall)
+
+def run_conversation(model, tokenizer, questions, conversation_id, max_new_tokens, max_history):
+    """(answers, seconds to first text) of each turn; ``conversation_id`` None sends fresh prompts"""
+    model_name = str(model.__class__).lower()
+    generation_params = {"max_new_tokens": max_new_tokens, "do_sample": False, "repetition_penalty": REPETITION_PENALTY}
+    history, answers, first_text = [], [], []
+    for question in questions:
+        prompt, followup = build_turn_prompt(model_name, question, format_history(history[-max_history:]), [])
+        chunks = stream_llm_response(
+            model_name, model, tokenizer, prompt, generation_params,
+            conversation_id=conversation_id, followup=followup if history else None
+        )
+        start, first = time.perf_counter(), None
+        while True:
+            try:
+                next(chunks)
+            except StopIteration as stop:
+                answer = stop.value
+                break
+            if first is None:
+                first = time.perf_counter() - start
+        answers.append(answer)
+        first_text.append(first if first is not None else time.perf_counter() - start)
+        history += [{"role": "user", "text": question}, {"role": "chatbot", "text": answer}]
+    return answers, first_text
+
+def run(model_path, n_conversations, turns, max_new_tokens, max_history, question_file):
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path, torch_dtype="auto", device_map="auto" if torch.cuda.is_available() else None
+    ).eval()
+    questions = load_questions(n_conversations * turns, question_file)
+    rows = []  # (turn, identical, token F1, fresh first-text s, continued first-text s)
+    for c in range(0, len(questions) - turns + 1, turns):
+        conversation = questions[c:c + turns]
+        fresh, fresh_first = run_conversation(model, tokenizer, conversation, None, max_new_tokens, max_history)
+        continued, continued_first = run_conversation(
+            model, tokenizer, conversation, f"benchmark-{c}-{time.time()}", max_new_tokens, max_history
+        )
+        for turn in range(1, turns):
+            rows.append((turn, fresh[turn] == continued[turn], token_f1(fresh[turn], continued[turn]),
+                         fresh_first[turn], continued_first[turn]))
+
+    print(f"{'turn':>5} {'pairs':>6} {'identical':>10} {'token F1':>9} {'fresh s':>8} {'cached s':>9}")
+    for turn in range(1, turns):
+        selected = np.array([row[1:] for row in rows if row[0] == turn], dtype=np.float64)
+        print(f"{turn + 1:>5} {len(selected):>6} {selected[:, 0].mean():>10.2f} {selected[:, 1].mean():>9.3f} "
+              f"{np.median(selected[:, 2]):>8.2f} {np.median(selected[:, 3]):>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="checkpoint directory with its tokenizer (Qwen, Gemma or Llama)")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3, help="questions per conversation (at least 2)")
+    parser.add_argument("--new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--max-history", type=int, default=5, help="history messages in a fresh prompt")
+    parser.add_argument("--questions", default=None, help="question file (default: data/question.txt)")
+    args = parser.parse_args()
+    if args.turns < 2:
+        parser.error("--turns must be at least 2")
+    run(args.model, args.conversations, args.turns, args.new_tokens, args.max_history, args.questions)
@@ -0,0 +1,104 @@
+"""Decode throughput and resident memory of an LLM per CPU loading mode.
+
+Every mode loads the checkpoint with ``from_pretrained`` in a fresh process,
+so resident memory is not carried over between modes:
+
+    fp32  float32 weights
+    bf16  bfloat16 weights (fast only where the CPU has native bf16 kernels)
+    int8  float32 load, then dynamic int8 quantization of every Linear layer
+
+Without ``--model``, a randomly initialized Llama-style checkpoint is
+written to a temporary directory first:
+
+    python benchmark_cpu_loading.py --modes fp32 bf16 int8 --new-tokens 64
+    python benchmark_cpu_loading.py --model ../models/qwen_finetune --prompt-tokens 512
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+
+MODES = ("fp32", "bf16", "int8")
+
+def resident_mb():
+    """(current, peak) resident set size of this process in MB"""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":")
+                values[key] = int(value.split()[0]) / 1024
+    return values["VmRSS"], values["VmHWM"]
+
+def measure_mode(mode, model_path, prompt_tokens, new_tokens, threads, results):
+    import torch
+    from transformers import AutoModelForCausalLM
+    from cpu_inference import configure_cpu_threads, cpu_supports_bf16, finish_model
+
+    configure_cpu_threads(threads)
+    baseline_mb, _ = resident_mb()
+    start = time.perf_counter()
+    dtype = torch.bfloat16 if mode == "bf16" else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=dtype, low_cpu_mem_usage=True)
+    model = finish_model(model, quantize=mode == "int8")
+    load_s = time.perf_counter() - start
+
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(3, model.config.vocab_size, (1, prompt_tokens), generator=generator)
+    with torch.no_grad():
+        model.generate(input_ids[:, :8], max_new_tokens=2, do_sample=False)  # warm-up
+        start = time.perf_counter()
+        model(input_ids=input_ids)
+        prefill_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        outputs = model.generate(input_ids, max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False)
+        generate_s = time.perf_counter() - start
+    # Measured after generating: memory-mapped safetensors weights are only resident once used
+    resident_after_mb, peak_mb = resident_mb()
+    results.put({
+        "mode": mode,
+        "native_bf16": cpu_supports_bf16(),
+        "load_s": load_s,
+        "model_mb": resident_after_mb - baseline_mb,
+        "peak_mb": peak_mb,
+        "prefill_ms": prefill_ms,
+        "tokens_per_s": (outputs.shape[1] - prompt_tokens) / generate_s,
+    })
+
+def write_random_checkpoint(path, vocab_size, hidden_size, layers):
+    from benchmark_generation import tiny_causal_lm
+    model = tiny_causal_lm(vocab_size=vocab_size, hidden_size=hidden_size, layers=layers, heads=max(hidden_size // 64, 1))
+    model.save_pretrained(path)
+    n_params = sum(p.numel() for p in model.parameters())
+    print(f"Random checkpoint: {n_params / 1e6:.0f}M parameters, hidden {hidden_size}, {layers} layers")
+
+def run(model_path, modes, prompt_tokens, new_tokens, threads):
+    context = multiprocessing.get_context("spawn")
+    print(f"{'mode':>6} {'load s':>7} {'model MB':>9} {'peak MB':>8} {'prefill ms':>11} {'tokens/s':>9}")
+    for mode in modes:
+        results = context.Queue()
+        process = context.Process(target=measure_mode, args=(mode, model_path, prompt_tokens, new_tokens, threads, results))
+        process.start()
+        result = results.get()
+        process.join()
+        note = "  (no native bf16 on this CPU)" if mode == "bf16" and not result["native_bf16"] else ""
+        print(f"{mode:>6} {result['load_s']:>7.1f} {result['model_mb']:>9.0f} {result['peak_mb']:>8.0f} "
+              f"{result['prefill_ms']:>11.1f} {result['tokens_per_s']:>9.1f}{note}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="checkpoint directory (default: a random Llama-style model)")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--prompt-tokens", type=int, default=256)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--vocab-size", type=int, default=32000, help="random checkpoint only")
+    parser.add_argument("--hidden-size", type=int, default=1024, help="random checkpoint only")
+    parser.add_argument("--layers", type=int, default=8, help="random checkpoint only")
+    parser.add_argument("--threads", type=int, default=None, help="default: every CPU this process may run on")
+    args = parser.parse_args()
+    if args.model:
+        run(args.model, args.modes, args.prompt_tokens, args.new_tokens, args.threads)
+    else:
+        with tempfile.TemporaryDirectory() as checkpoint:
+            write_random_checkpoint(checkpoint, args.vocab_size, args.hidden_size, args.layers)
+            run(checkpoint, args.modes, args.prompt_tokens, args.new_tokens, args.threads)
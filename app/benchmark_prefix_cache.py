@@ -0,0 +1,57 @@
+"""Prefill time of a prompt with and without reusing the cached static-prefix past key/values.
+
+Uses the tiny randomly initialized causal LM of benchmark_generation on CPU.
+The static prefix stands for the system message and rule block (about 400
+tokens with the Qwen tokenizer); the suffix for the history, retrieved
+context and query of one turn:
+
+    python benchmark_prefix_cache.py --prefix-tokens 400 --suffix-tokens 100 400 1200
+"""
+import argparse
+import time
+import numpy as np
+import torch
+from benchmark_generation import tiny_causal_lm
+from kv_cache import to_model_cache
+from prompt_cache import extend_past
+
+@torch.no_grad()
+def timed_prefill(model, token_ids, past=None, repeats=5):
+    """Last-token logits of the prompt and the median prefill time in ms"""
+    start_position = 0 if past is None else past[0][0].shape[-2]
+    input_ids = torch.tensor([token_ids[start_position:]])
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        outputs = model(input_ids=input_ids, past_key_values=to_model_cache(past) if past is not None else None, use_cache=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return outputs.logits[0, -1], float(np.median(latencies))
+
+def run(prefix_tokens, suffix_lengths, layers, hidden_size, repeats, threads):
+    if threads:
+        torch.set_num_threads(threads)
+    model = tiny_causal_lm(hidden_size=hidden_size, layers=layers)
+    rng = np.random.default_rng(0)
+    prefix = rng.integers(3, model.config.vocab_size, prefix_tokens).tolist()
+
+    start = time.perf_counter()
+    prefix_past = extend_past(model, prefix)
+    print(f"Prefilled the {prefix_tokens}-token static prefix once in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"{'suffix':>7} {'full ms':>9} {'reuse ms':>9} {'speedup':>8} {'max |dlogit|':>13}")
+    for suffix_tokens in suffix_lengths:
+        prompt = prefix + rng.integers(3, model.config.vocab_size, suffix_tokens).tolist()
+        full_logits, full_ms = timed_prefill(model, prompt, repeats=repeats)
+        reuse_logits, reuse_ms = timed_prefill(model, prompt, prefix_past, repeats=repeats)
+        diff = float((full_logits - reuse_logits).abs().max())
+        print(f"{suffix_tokens:>7} {full_ms:>9.1f} {reuse_ms:>9.1f} {full_ms / reuse_ms:>7.2f}x {diff:>13.2e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prefix-tokens", type=int, default=400)
+    parser.add_argument("--suffix-tokens", type=int, nargs="+", default=[100, 400, 1200])
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads (default: torch's choice)")
+    args = parser.parse_args()
+    run(args.prefix_tokens, args.suffix_tokens, args.layers, args.hidden_size, args.repeats, args.threads)
@@ -0,0 +1,55 @@
+"""Recall@k and scan latency of PCA/truncation-projected dense search versus full dimensions.
+
+Runs on the dense vectors of an existing retrieval bundle (our corpus), queried
+with the BGE embeddings of the real user questions in data/question.txt, or on
+synthetic clustered embeddings and perturbed corpus rows when no bundle is
+given. ``--rescore 0`` ranks
+by projected scores only; larger values rescore that many times k candidates
+against the full float rows:
+
+    python benchmark_projection.py --bundle ../cache/retrieval_bundle --dims 256 384
+    python benchmark_projection.py --sizes 100000 --dim 1024 --dims 128 256 384 --rescore 0 4
+"""
+import argparse
+import tempfile
+from dense_index import DenseIndex
+from projection import ProjectedIndex, SUPPORTED_PROJECTIONS
+from benchmark_ann import synthetic_embeddings, synthetic_queries, timed_search, recall_at_k
+from benchmark_quantization import report, load_bundle_vectors, load_question_queries
+
+def run_corpus(name, corpus, queries, k, dims, rescore_multipliers):
+    documents = [{"id": str(i), "text": "", "source": ""} for i in range(corpus.shape[0])]
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = DenseIndex.build(f"{tmp}/float", corpus, documents)
+        exact_rows, exact_latency = timed_search(exact, queries, k)
+        report(f"full/{corpus.shape[1]}", name, corpus.shape[0] * corpus.shape[1] * 4, 1.0, exact_latency)
+
+        for method in SUPPORTED_PROJECTIONS:
+            for dim in dims:
+                index = ProjectedIndex.build(f"{tmp}/{method}-{dim}", corpus, documents, method=method, dim=dim)
+                for multiplier in rescore_multipliers:
+                    rows, latency = timed_search(index, queries, k, rescore_multiplier=multiplier)
+                    report(f"{method}/{dim}/rescore={multiplier}", name, index.scan_bytes(), recall_at_k(rows, exact_rows), latency)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bundle", default=None, help="retrieval bundle whose dense vectors to benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--dims", type=int, nargs="+", default=[128, 256, 384], help="projected dimensions")
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[0, 4], help="rescore multipliers (0 = projected scores only)")
+    parser.add_argument("--queries", type=int, default=200, help="synthetic queries, or questions used with --bundle")
+    parser.add_argument("--questions", default=None, help="question file of --bundle (default: data/question.txt)")
+    args = parser.parse_args()
+
+    if args.bundle:
+        corpus = load_bundle_vectors(args.bundle)
+        queries = load_question_queries(args.queries, args.questions)
+        print(f"{'size':>10} {'storage':>22} {'scan MiB':>10} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        run_corpus(corpus.shape[0], corpus, queries, args.k, args.dims, args.rescore)
+    else:
+        print(f"{'size':>10} {'storage':>22} {'scan MiB':>10} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for size in args.sizes:
+            corpus = synthetic_embeddings(size, args.dim)
+            run_corpus(size, corpus, synthetic_queries(corpus, args.queries), args.k, args.dims, args.rescore)
@@ -0,0 +1,69 @@
+"""Memory, scan speed and recall@k of int8/binary code scans versus float storage.
+
+Runs on the dense vectors of an existing retrieval bundle (our corpus), queried
+with the BGE embeddings of the real user questions in data/question.txt, or on
+synthetic clustered embeddings and perturbed corpus rows when no bundle is given:
+
+    python benchmark_quantization.py --bundle ../cache/retrieval_bundle
+    python benchmark_quantization.py --sizes 100000 500000 --dim 1024 --rescore 2 4 8
+"""
+import argparse
+import os
+import tempfile
+import numpy as np
+from dense_index import DenseIndex
+from quantized_index import QuantizedIndex
+from benchmark_ann import synthetic_embeddings, synthetic_queries, load_questions, timed_search, recall_at_k
+from retrieval_bundle import DENSE_DIR
+
+def report(label, size, scan_bytes, recall, latency):
+    print(f"{size:>10} {label:>22} {scan_bytes / 2**20:>10.1f} {recall:>9.3f} "
+          f"{np.percentile(latency, 50):>8.2f} {np.percentile(latency, 99):>8.2f}")
+
+def run_corpus(name, corpus, queries, k, rescore_multipliers):
+    documents = [{"id": str(i), "text": "", "source": ""} for i in range(corpus.shape[0])]
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = DenseIndex.build(f"{tmp}/float", corpus, documents)
+        exact_rows, exact_latency = timed_search(exact, queries, k)
+        report("float32", name, corpus.shape[0] * corpus.shape[1] * 4, 1.0, exact_latency)
+
+        for quantization in ("int8", "binary"):
+            index = QuantizedIndex.build(f"{tmp}/{quantization}", corpus, documents, quantization=quantization)
+            for multiplier in rescore_multipliers:
+                rows, latency = timed_search(index, queries, k, rescore_multiplier=multiplier)
+                report(f"{quantization}/rescore={multiplier}", name, index.scan_bytes(), recall_at_k(rows, exact_rows), latency)
+
+def load_bundle_vectors(bundle_path):
+    index = DenseIndex.load(os.path.join(bundle_path, DENSE_DIR))
+    return np.asarray(index.embeddings, dtype=np.float32)
+
+def load_question_queries(count=None, question_file=None):
+    """BGE embeddings of the real user questions, the queries a bundle is searched with (loads BGE)"""
+    from model_loader import load_bge_model
+    from embedding_utils import generate_embeddings
+    questions = load_questions(count, question_file)
+    bge_model, bge_tokenizer = load_bge_model()
+    print(f"Embedding {len(questions)} questions as queries...")
+    return generate_embeddings(questions, bge_model, bge_tokenizer).float().numpy()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bundle", default=None, help="retrieval bundle whose dense vectors to benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[2, 4, 8], help="rescore multipliers")
+    parser.add_argument("--queries", type=int, default=200, help="synthetic queries, or questions used with --bundle")
+    parser.add_argument("--questions", default=None, help="question file of --bundle (default: data/question.txt)")
+    args = parser.parse_args()
+
+    if args.bundle:
+        corpus = load_bundle_vectors(args.bundle)
+        queries = load_question_queries(args.queries, args.questions)
+        print(f"{'size':>10} {'storage':>22} {'scan MiB':>10} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        run_corpus(corpus.shape[0], corpus, queries, args.k, args.rescore)
+    else:
+        print(f"{'size':>10} {'storage':>22} {'scan MiB':>10} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for size in args.sizes:
+            corpus = synthetic_embeddings(size, args.dim)
+            run_corpus(size, corpus, synthetic_queries(corpus, args.queries), args.k, args.rescore)
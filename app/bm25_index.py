@@ -0,0 +1,257 @@
+import json
+import os
+from array import array
+from collections import Counter
+import numpy as np
+
+# ========== Constants ==========
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+DEFAULT_EPSILON = 0.25
+BM25_META_FILE = "bm25.json"
+BM25_ARRAYS = ("indptr", "doc_ids", "term_freqs", "weights", "idf", "doc_lengths")
+
+def tokenize(text):
+    """Tokenizer shared by indexing and querying"""
+    return text.lower().split()
+
+class BM25Index:
+    """Okapi BM25 over an inverted index.
+
+    Postings are stored CSR-style per term (``indptr``/``doc_ids``/``weights``),
+    where each weight is the precomputed length-normalized term-frequency part
+    of the BM25 formula. A query therefore only touches the postings of its own
+    terms. IDF follows ``rank_bm25.BM25Okapi`` (negative IDFs are floored to
+    ``epsilon * average_idf``), so scores match the previous implementation.
+    """
+
+    def __init__(self, tokenized_corpus, k1=DEFAULT_K1, b=DEFAULT_B, epsilon=DEFAULT_EPSILON, ids=None):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocabulary = {}
+        term_ids, doc_ids, term_freqs, doc_lengths = self._collect_postings(tokenized_corpus, doc_offset=0)
+        self._set_ids(ids if ids is not None else [str(i) for i in range(len(doc_lengths))])
+        self._set_postings(term_ids, doc_ids, term_freqs, doc_lengths)
+
+    @classmethod
+    def from_documents(cls, documents, k1=DEFAULT_K1, b=DEFAULT_B, epsilon=DEFAULT_EPSILON):
+        """Build in a single pass from an iterable of (id, tokens) pairs, e.g. a generator"""
+        ids = []
+        def tokens():
+            for doc_id, doc_tokens in documents:
+                ids.append(doc_id)
+                yield doc_tokens
+        return cls(tokens(), k1=k1, b=b, epsilon=epsilon, ids=ids)
+
+    def _set_ids(self, ids):
+        self.ids = list(ids)
+        self.id_to_row = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+    def _collect_postings(self, tokenized_corpus, doc_offset):
+        """Raw postings of any iterable of token lists; buffered in compact typed arrays"""
+        term_ids = array("q")
+        doc_ids = array("i")
+        term_freqs = array("f")
+        doc_lengths = array("f")
+        for doc_index, tokens in enumerate(tokenized_corpus, start=doc_offset):
+            doc_lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                doc_ids.append(doc_index)
+                term_freqs.append(freq)
+        return (
+            np.asarray(term_ids, dtype=np.int64),
+            np.asarray(doc_ids, dtype=np.int32),
+            np.asarray(term_freqs, dtype=np.float32),
+            np.asarray(doc_lengths, dtype=np.float32)
+        )
+
+    def _set_postings(self, term_ids, doc_ids, term_freqs, doc_lengths):
+        """(Re)build the CSR arrays, IDF and per-posting weights from raw postings"""
+        order = np.argsort(term_ids, kind="stable")
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)[order]
+        self.term_freqs = np.asarray(term_freqs, dtype=np.float32)[order]
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        self.corpus_size = int(self.doc_lengths.shape[0])
+        self.avgdl = float(self.doc_lengths.mean()) if self.corpus_size else 0.0
+
+        doc_freqs = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.indptr = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=self.indptr[1:])
+
+        # Length normalization folded into each posting once, at build time
+        tf = self.term_freqs
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(self.avgdl, 1e-9))
+        self.weights = (tf * (self.k1 + 1) / (tf + length_norm[self.doc_ids])).astype(np.float32)
+        self.idf = self._compute_idf(doc_freqs)
+
+    def _posting_term_ids(self):
+        return np.repeat(np.arange(len(self.vocabulary), dtype=np.int64), np.diff(self.indptr))
+
+    def _compute_idf(self, doc_freqs):
+        idf = np.log(self.corpus_size - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        if idf.size:
+            eps = self.epsilon * float(idf.mean())
+            idf[idf < 0] = eps
+        return idf.astype(np.float32)
+
+    # ========== Incremental updates ==========
+    def remove_documents(self, ids):
+        """Drop documents by id; postings, IDF and length norms are recomputed from stored term frequencies"""
+        rows = [self.id_to_row[doc_id] for doc_id in ids if doc_id in self.id_to_row]
+        if not rows:
+            return 0
+        keep_docs = np.ones(self.corpus_size, dtype=bool)
+        keep_docs[rows] = False
+        new_rows = np.cumsum(keep_docs) - 1
+
+        keep_postings = keep_docs[self.doc_ids]
+        term_ids = self._posting_term_ids()[keep_postings]
+        doc_ids = new_rows[self.doc_ids[keep_postings]]
+        term_freqs = self.term_freqs[keep_postings]
+
+        # Forget terms that no longer occur anywhere so IDF matches a fresh build
+        doc_freqs = np.bincount(term_ids, minlength=len(self.vocabulary))
+        live_terms = doc_freqs > 0
+        new_term_ids = np.cumsum(live_terms) - 1
+        self.vocabulary = {term: int(new_term_ids[term_id]) for term, term_id in self.vocabulary.items() if live_terms[term_id]}
+
+        self._set_ids([doc_id for doc_id, keep in zip(self.ids, keep_docs.tolist()) if keep])
+        self._set_postings(new_term_ids[term_ids], doc_ids, term_freqs, np.asarray(self.doc_lengths)[keep_docs])
+        return len(rows)
+
+    def add_documents(self, ids, tokenized_corpus):
+        """Append documents; only the new documents are tokenized and counted"""
+        if not ids:
+            return 0
+        old_term_ids = self._posting_term_ids()
+        term_ids, doc_ids, term_freqs, new_lengths = self._collect_postings(tokenized_corpus, doc_offset=self.corpus_size)
+        doc_lengths = np.concatenate([np.asarray(self.doc_lengths), new_lengths])
+        self._set_ids(self.ids + list(ids))
+        self._set_postings(
+            np.concatenate([old_term_ids, term_ids]),
+            np.concatenate([self.doc_ids, doc_ids]),
+            np.concatenate([self.term_freqs, term_freqs]),
+            doc_lengths
+        )
+        return len(ids)
+
+    def rows_for(self, ids):
+        """BM25 row of each document id (-1 when the id is unknown)"""
+        return np.array([self.id_to_row.get(doc_id, -1) for doc_id in ids], dtype=np.int64)
+
+    def __len__(self):
+        return self.corpus_size
+
+    # ========== Persistence ==========
+    def save(self, path):
+        """Write postings, IDF and document lengths as .npy files plus a small JSON header"""
+        os.makedirs(path, exist_ok=True)
+        for name in BM25_ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {"k1": self.k1, "b": self.b, "epsilon": self.epsilon, "corpus_size": self.corpus_size, "avgdl": self.avgdl}
+        with open(os.path.join(path, BM25_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "vocabulary": self.vocabulary, "ids": self.ids}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a saved index; arrays are memory-mapped unless ``mmap`` is False"""
+        with open(os.path.join(path, BM25_META_FILE), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        index = cls.__new__(cls)
+        for key, value in header["meta"].items():
+            setattr(index, key, value)
+        index.vocabulary = header["vocabulary"]
+        index._set_ids(header["ids"])
+        for name in BM25_ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None))
+        return index
+
+    # ========== Scoring ==========
+    def _matching_postings(self, query_tokens):
+        """Concatenate (doc id, contribution) for every posting of the query terms"""
+        docs = []
+        contributions = []
+        for term, count in Counter(query_tokens).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs.append(self.doc_ids[start:end])
+            contributions.append(self.weights[start:end] * (self.idf[term_id] * count))
+        if not docs:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        return np.concatenate(docs), np.concatenate(contributions)
+
+    def _accumulate(self, query_tokens):
+        """Sum contributions per matching document; returns (sorted doc ids, scores)"""
+        docs, contributions = self._matching_postings(query_tokens)
+        if docs.size == 0:
+            return docs, contributions
+        matched, inverse = np.unique(docs, return_inverse=True)
+        return matched, np.bincount(inverse, weights=contributions).astype(np.float32)
+
+    def score_candidates(self, query_tokens, doc_indices):
+        """BM25 scores for the given document rows, aligned with ``doc_indices`` (-1 scores 0)"""
+        return self.score_candidates_many([query_tokens], [doc_indices])[0]
+
+    def score_candidates_many(self, query_token_lists, doc_indices_lists):
+        """``score_candidates`` for several queries at once.
+
+        The postings of every query term are gathered in one pass, keyed by
+        (query, document), and summed onto the (query, candidate) pairs they
+        hit with a single ``bincount``; only the term lookup loops in Python.
+        """
+        doc_indices_lists = [np.asarray(doc_indices, dtype=np.int64) for doc_indices in doc_indices_lists]
+        sizes = [doc_indices.shape[0] for doc_indices in doc_indices_lists]
+        candidate_docs = np.concatenate(doc_indices_lists) if doc_indices_lists else np.empty(0, dtype=np.int64)
+        scores = np.zeros(candidate_docs.shape[0], dtype=np.float32)
+
+        query_rows, term_ids, counts = [], [], []
+        for q, query_tokens in enumerate(query_token_lists):
+            for term, count in Counter(query_tokens).items():
+                term_id = self.vocabulary.get(term)
+                if term_id is not None:
+                    query_rows.append(q)
+                    term_ids.append(term_id)
+                    counts.append(count)
+        if term_ids and scores.size:
+            term_ids = np.asarray(term_ids, dtype=np.int64)
+            starts = np.asarray(self.indptr[term_ids], dtype=np.int64)
+            lengths = np.asarray(self.indptr[term_ids + 1], dtype=np.int64) - starts
+            # Index of every posting of every (query, term), in query-term order
+            postings = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(int(lengths.sum()))
+            term_weights = np.asarray(self.idf, dtype=np.float32)[term_ids] * np.asarray(counts, dtype=np.float32)
+            contributions = np.asarray(self.weights)[postings] * np.repeat(term_weights, lengths)
+
+            # (query, document) keys; unknown candidate rows (-1) get a key no posting has
+            posting_keys = np.repeat(np.asarray(query_rows, dtype=np.int64), lengths) * self.corpus_size + self.doc_ids[postings]
+            candidate_keys = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes) * self.corpus_size + candidate_docs
+            candidate_keys[candidate_docs < 0] = -1
+            unique_keys, inverse = np.unique(candidate_keys, return_inverse=True)
+            positions = np.minimum(np.searchsorted(unique_keys, posting_keys), unique_keys.size - 1)
+            hits = unique_keys[positions] == posting_keys
+            totals = np.bincount(positions[hits], weights=contributions[hits], minlength=unique_keys.size)
+            scores = totals[inverse].astype(np.float32)
+        return np.split(scores, np.cumsum(sizes)[:-1]) if sizes else []
+
+    def top_k(self, query_tokens, k):
+        """Global top-k as (doc indices, scores), best first"""
+        matched, matched_scores = self._accumulate(query_tokens)
+        k = min(k, matched.size)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if k < matched.size:
+            best = np.argpartition(-matched_scores, k - 1)[:k]
+        else:
+            best = np.arange(matched.size)
+        best = best[np.argsort(-matched_scores[best], kind="stable")]
+        return matched[best].astype(np.int64), matched_scores[best]
+
+    def get_scores(self, query_tokens):
+        """Dense score vector over the whole corpus (``BM25Okapi.get_scores`` compatible)"""
+        scores = np.zeros(self.corpus_size, dtype=np.float32)
+        matched, matched_scores = self._accumulate(query_tokens)
+        scores[matched] = matched_scores
+        return scores
@@ -0,0 +1,257 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+class LRUCache:
+    """Bounded, thread-safe LRU cache with an optional TTL and hit/miss counters"""
+
+    def __init__(self, max_size=1024, ttl_seconds=None):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds
+
+    def _released(self, key, value):
+        """Called with the lock held whenever an entry leaves the cache"""
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1]):
+                if entry is not None:
+                    del self._entries[key]
+                    self._released(key, entry[0])
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._released(key, previous[0])
+            self._entries[key] = (value, time.monotonic())
+            self._evict_over(self.max_size)
+
+    def _evict_over(self, size):
+        while len(self._entries) > size:
+            key, (value, _) = self._entries.popitem(last=False)
+            self._released(key, value)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self._released(key, entry[0])
+            return entry[0]
+
+    def discard_where(self, predicate):
+        """Drop every entry whose key satisfies ``predicate``; returns how many were dropped"""
+        with self._lock:
+            doomed = [key for key in self._entries if predicate(key)]
+            for key in doomed:
+                self._released(key, self._entries.pop(key)[0])
+            return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                key, (value, _) = self._entries.popitem()
+                self._released(key, value)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+def normalize_query_text(text):
+    """Canonical form used as a cache key: NFC, case-folded, single-spaced"""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+def text_fingerprint(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class QueryEmbeddingCache(LRUCache):
+    """Query embeddings keyed by (model id, normalized query text)"""
+
+    def get_or_compute(self, model_id, texts, compute_fn):
+        """Return one embedding per text, calling ``compute_fn`` once on the distinct misses"""
+        keys = [(model_id, normalize_query_text(text)) for text in texts]
+        results = [self.get(key) for key in keys]
+
+        missing = {}
+        for i, (key, result) in enumerate(zip(keys, results)):
+            if result is None and key not in missing:
+                missing[key] = texts[i]
+        if missing:
+            computed = compute_fn(list(missing.values()))
+            fresh = dict(zip(missing.keys(), computed))
+            for key, embedding in fresh.items():
+                self.put(key, embedding)
+            results = [fresh[key] if result is None else result for key, result in zip(keys, results)]
+        return results
+
+class RerankScoreCache(LRUCache):
+    """Cross-encoder scores keyed by (model id, query fingerprint, document id).
+
+    Each entry also remembers a fingerprint of the passage text it was scored
+    against, so a document whose text changed never serves a stale score even
+    before ``invalidate_documents`` is called.
+    """
+
+    def _key(self, model_id, query, doc_id):
+        return (model_id, text_fingerprint(normalize_query_text(query)), doc_id)
+
+    def lookup(self, model_id, query, doc_id, text):
+        entry = self.get(self._key(model_id, query, doc_id))
+        if entry is None or entry[0] != text_fingerprint(text):
+            return None
+        return entry[1]
+
+    def store(self, model_id, query, doc_id, text, score):
+        self.put(self._key(model_id, query, doc_id), (text_fingerprint(text), score))
+
+    def invalidate_documents(self, doc_ids):
+        doc_ids = set(doc_ids)
+        if not doc_ids:
+            return 0
+        return self.discard_where(lambda key: key[2] in doc_ids)
+
+class SemanticAnswerCache(LRUCache):
+    """LLM answers of history-free turns, matched by query-embedding similarity.
+
+    Entries are keyed by (LLM model id, knowledge-base version, normalized
+    query fingerprint, retrieved document ids). Their L2-normalized query
+    embeddings are rows of one preallocated matrix, so a lookup is a single
+    matrix-vector product masked to the rows of the same model, knowledge base
+    and retrieved documents. The most similar of those rows wins if its cosine
+    similarity reaches ``threshold``: paraphrases of a cached question hit, but
+    a similar-looking question that retrieved other passages never does.
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=None, threshold=0.95):
+        super().__init__(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.threshold = threshold
+        self.knowledge_base_version = None
+        self.bypassed = 0
+        self._embeddings = None  # [max_size, dim] float32, allocated by the first store
+        self._row_groups = np.zeros(max_size, dtype=np.int64)  # hash of (model, version, doc ids) per row
+        self._row_used = np.zeros(max_size, dtype=bool)
+        self._row_stored_at = np.zeros(max_size, dtype=np.float64)
+        self._row_keys = [None] * max_size
+        self._free_rows = list(range(max_size - 1, -1, -1))
+
+    @staticmethod
+    def _group(model_id, version, doc_ids):
+        return hash((model_id, version, doc_ids))
+
+    @staticmethod
+    def _normalized(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def _released(self, key, value):
+        row = value["row"]
+        self._row_used[row] = False
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def set_knowledge_base_version(self, version):
+        """Invalidation hook: drop every answer generated against another knowledge-base version"""
+        self.knowledge_base_version = version
+        dropped = self.discard_where(lambda key: key[1] != version)
+        if dropped:
+            print(f"Dropped {dropped} cached answers from an older knowledge base.")
+        return dropped
+
+    def record_bypass(self):
+        """Count a turn that could not use the cache (it had conversation history)"""
+        with self._lock:
+            self.bypassed += 1
+
+    def lookup(self, model_id, query_embedding, doc_ids):
+        """(answer, similarity) of the closest cached query above the threshold, or None"""
+        query = self._normalized(query_embedding)
+        group = self._group(model_id, self.knowledge_base_version, tuple(doc_ids))
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            candidates = self._row_used & (self._row_groups == group)
+            if self.ttl_seconds is not None:
+                expired = self._row_used & (time.monotonic() - self._row_stored_at > self.ttl_seconds)
+                for row in np.flatnonzero(expired):
+                    key = self._row_keys[row]
+                    self._released(key, self._entries.pop(key)[0])
+                candidates &= ~expired
+            similarities = np.where(candidates, self._embeddings @ query, -np.inf)
+            row = int(np.argmax(similarities))
+            similarity = float(similarities[row])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+            key = self._row_keys[row]
+            if (key[0], key[1], key[3]) != (model_id, self.knowledge_base_version, tuple(doc_ids)):
+                self.misses += 1  # a hash collision between groups
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]["answer"], similarity
+
+    def store(self, model_id, query, query_embedding, doc_ids, answer):
+        embedding = self._normalized(query_embedding)
+        doc_ids = tuple(doc_ids)
+        key = (model_id, self.knowledge_base_version, text_fingerprint(normalize_query_text(query)), doc_ids)
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != embedding.shape[0]:
+                # First store, or another encoder: earlier rows are not comparable any more
+                while self._entries:
+                    old_key, (value, _) = self._entries.popitem()
+                    self._released(old_key, value)
+                self._embeddings = np.zeros((self.max_size, embedding.shape[0]), dtype=np.float32)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._released(key, previous[0])
+            self._evict_over(self.max_size - 1)
+            row = self._free_rows.pop()
+            now = time.monotonic()
+            self._entries[key] = ({"row": row, "answer": answer}, now)
+            self._embeddings[row] = embedding
+            self._row_groups[row] = self._group(model_id, self.knowledge_base_version, doc_ids)
+            self._row_used[row] = True
+            self._row_stored_at[row] = now
+            self._row_keys[row] = key
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats["bypassed"] = self.bypassed
+        return stats
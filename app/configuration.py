@@ -40,12 +40,15 @@ DATA_CONFIG = {
     "KNOWLEDGE_BASE": str(DATA_DIR / "data.txt"),
     "QUESTIONS": str(DATA_DIR / "question.txt"),
 }
+# Files and/or directories of .txt files ingested into the knowledge base (os.pathsep-separated)
+DATA_CONFIG["KNOWLEDGE_BASE_PATHS"] = [
+    path for path in os.getenv("KNOWLEDGE_BASE_PATHS", DATA_CONFIG["KNOWLEDGE_BASE"]).split(os.pathsep) if path
+]
 
 # Database Configuration
 DB_CONFIG = {
     # ChromaDB
     "CHROMA_DB_PATH": str(CACHE_DIR / "chroma_db_bge"),
-    "CHROMA_QUESTION_DB_PATH": str(CACHE_DIR / "chroma_question_db"),
     
     # MongoDB
     "MONGO_URI": os.getenv("MONGO_URI", "mongodb://localhost:27017"),
@@ -53,6 +56,103 @@ DB_CONFIG = {
     "MONGO_COLLECTION": os.getenv("MONGO_COLLECTION", "chat_history")
 }
 
+# Retrieval Configuration
+RETRIEVAL_CONFIG = {
+    # Dense backend returned by initialize_data: "numpy" (in-process exact index),
+    # "ivf" (approximate inverted-file index for very large corpora) or "chroma"
+    "DENSE_BACKEND": os.getenv("DENSE_BACKEND", "numpy"),
+    # Versioned artifact with documents, BM25 arrays and the dense index ("numpy"/"ivf" backends)
+    "BUNDLE_PATH": str(CACHE_DIR / "retrieval_bundle"),
+    "DENSE_INDEX_DTYPE": os.getenv("DENSE_INDEX_DTYPE", "float32"),  # "float32" or "float16"
+    # First-pass scan over compact codes ("numpy" backend): "none", "int8" or "binary";
+    # the best k * DENSE_RESCORE_MULTIPLIER rows are rescored against the float vectors
+    "DENSE_QUANTIZATION": os.getenv("DENSE_QUANTIZATION", "none"),
+    "DENSE_RESCORE_MULTIPLIER": int(os.getenv("DENSE_RESCORE_MULTIPLIER", "4")),
+    # Lower-dimensional first-pass scan ("numpy" backend, not combined with quantization):
+    # "none", "pca" (fitted at ingestion) or "truncate"; rescoring as above, 0 = projected scores only
+    "DENSE_PROJECTION": os.getenv("DENSE_PROJECTION", "none"),
+    "DENSE_PROJECTION_DIM": int(os.getenv("DENSE_PROJECTION_DIM", "256")),
+    "IVF_N_LISTS": int(os.getenv("IVF_N_LISTS", "0")),  # 0 = 4 * sqrt(corpus size)
+    "IVF_N_PROBE": int(os.getenv("IVF_N_PROBE", "8")),
+    # Sections longer than WINDOW_TOKENS BGE tokens are split into overlapping windows
+    # (kept below the 512-token encoder limit, leaving room for the query in the reranker)
+    "WINDOW_TOKENS": int(os.getenv("WINDOW_TOKENS", "384")),
+    "WINDOW_OVERLAP": int(os.getenv("WINDOW_OVERLAP", "64")),
+    # Search results: "window" (best matching spans) or "parent" (whole sections, best window score)
+    "RESULT_GRANULARITY": os.getenv("RESULT_GRANULARITY", "window"),
+    # Near-duplicate sections (MinHash estimate of word-3-gram Jaccard >= DEDUP_THRESHOLD) are
+    # collapsed into their first occurrence, which keeps the sources of all of them
+    "DEDUP": os.getenv("DEDUP", "1") == "1",
+    "DEDUP_THRESHOLD": float(os.getenv("DEDUP_THRESHOLD", "0.8")),
+    "INGEST_BATCH_SIZE": int(os.getenv("INGEST_BATCH_SIZE", "256")),  # documents embedded and written per step
+    # The bundle is built offline by ingest.py; set to embed missing/stale bundles inline at startup instead
+    "INGEST_ON_STARTUP": os.getenv("INGEST_ON_STARTUP", "0") == "1",
+    "INGEST_WORK_DIR": str(CACHE_DIR / "ingest_shards"),  # checkpointed shards of interrupted ingest.py runs
+    # Score fusion in hybrid search: "linear" (alpha-weighted min-max) or "rrf"
+    "FUSION": os.getenv("RETRIEVAL_FUSION", "linear"),
+    "RRF_K": 60,
+    # Adaptive reranking: choose the cross-encoder depth per query from the fused scores.
+    # Off until benchmark_adaptive_rerank.py shows its top-k agreement on the deployed encoders.
+    "ADAPTIVE_RERANK": os.getenv("ADAPTIVE_RERANK", "0") == "1",
+    "ADAPTIVE_RERANK_STEP": 4,        # pairs added per query per round
+    "ADAPTIVE_SCORE_WINDOW": 0.5,     # rerank candidates within this (min-max normalized) fused score of the best
+    "ADAPTIVE_DECISIVE_GAP": 0.6,     # skip reranking when the best fused score leads the runner-up by this much
+}
+
+# Cache Configuration
+CACHE_CONFIG = {
+    # Query embeddings shared by the search and question-suggestion paths
+    "QUERY_EMBEDDING_CACHE_SIZE": int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048")),
+    "QUERY_EMBEDDING_CACHE_TTL": float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400")),  # seconds
+    # Cross-encoder scores keyed by (query, document id)
+    "RERANK_SCORE_CACHE_SIZE": int(os.getenv("RERANK_SCORE_CACHE_SIZE", "20000")),
+    # Answers of history-free turns, reused for queries whose BGE embedding is within
+    # ANSWER_CACHE_THRESHOLD cosine similarity and that retrieved exactly the same passages
+    # (retrieval runs on every turn); cleared whenever the knowledge base is re-ingested
+    "ANSWER_CACHE_ENABLED": os.getenv("ANSWER_CACHE_ENABLED", "1") == "1",
+    "ANSWER_CACHE_SIZE": int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+    "ANSWER_CACHE_TTL": float(os.getenv("ANSWER_CACHE_TTL", "86400")),  # seconds
+    "ANSWER_CACHE_THRESHOLD": float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    # BGE embeddings of the suggestion questions, rebuilt when question.txt or the encoder changes
+    "QUESTION_INDEX_PATH": str(CACHE_DIR / "question_index.npz"),
+    # Precomputed related questions of every question and knowledge-base chunk
+    "QUESTION_GRAPH_PATH": str(CACHE_DIR / "question_graph.npz"),
+    "QUESTION_NEIGHBOURS": int(os.getenv("QUESTION_NEIGHBOURS", "10")),
+}
+
+# Model Loading Configuration
+LOADING_CONFIG = {
+    # "gpu": 4-bit LLM and float16 encoders on CUDA; "cpu": see below; "auto": "gpu" when CUDA is available
+    "MODE": os.getenv("MODEL_LOADING_MODE", "auto"),
+    # Weight dtype on CPU: "auto" picks bfloat16 when the CPU has native bf16 kernels, float32 otherwise
+    "CPU_DTYPE": os.getenv("CPU_DTYPE", "auto"),
+    # Dynamic int8 quantization of Linear layers on CPU: "llm", "all" (LLM, BGE and reranker) or "none".
+    # Quantized models are loaded in float32 first; "all" shifts query embeddings slightly from the stored ones
+    "CPU_INT8": os.getenv("CPU_INT8", "llm"),
+    "CPU_THREADS": int(os.getenv("CPU_THREADS", "0")),  # 0: every CPU this process may run on
+}
+
+# LLM Generation Configuration
+GENERATION_CONFIG = {
+    # Route answer generation through one shared continuous-batching worker per loaded LLM,
+    # so concurrent conversations on the same model are decoded in one batch instead of in turn
+    "USE_GENERATION_SERVICE": os.getenv("USE_GENERATION_SERVICE", "0") == "1",
+    "MAX_BATCH_SIZE": int(os.getenv("GENERATION_MAX_BATCH_SIZE", "8")),
+    # Prefill the static prompt prefix (system message and rule block) once per loaded model
+    # and start every generation from its past key/values
+    "PREFIX_CACHE": os.getenv("PREFIX_CACHE", "1") == "1",
+    # Keep each conversation's prompt and answer past key/values so a follow-up turn is appended to
+    # them as a new chat turn and only its own tokens are prefilled. The model then reads the earlier
+    # turns verbatim instead of the recent-history section of a fresh prompt, so answers can differ
+    # from the uncached path (see benchmark_conversation_cache.py). Least recently used conversations
+    # beyond CONVERSATION_KV_MAX_BYTES move to host RAM ("cpu") or CONVERSATION_KV_SPILL_DIR ("disk"), or are dropped ("none")
+    "CONVERSATION_KV_CACHE": os.getenv("CONVERSATION_KV_CACHE", "0") == "1",
+    "CONVERSATION_KV_MAX_BYTES": int(float(os.getenv("CONVERSATION_KV_MAX_GB", "1")) * 2**30),
+    "CONVERSATION_KV_SPILL": os.getenv("CONVERSATION_KV_SPILL", "disk"),
+    "CONVERSATION_KV_SPILL_MAX_BYTES": int(float(os.getenv("CONVERSATION_KV_SPILL_MAX_GB", "8")) * 2**30),
+    "CONVERSATION_KV_SPILL_DIR": str(CACHE_DIR / "conversation_kv"),
+}
+
 # API Keys and Tokens
 API_KEYS = {
     "HUGGINGFACE_TOKEN": os.getenv("HUGGINGFACE_TOKEN", "")
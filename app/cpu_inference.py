@@ -0,0 +1,83 @@
+import gc
+import itertools
+import logging
+import os
+import torch
+from configuration import LOADING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_threads_configured = False
+
+def resolve_loading_mode():
+    """"gpu" or "cpu": ``LOADING_CONFIG["MODE"]``, with "auto" following CUDA availability"""
+    mode = LOADING_CONFIG["MODE"]
+    if mode == "auto":
+        return "gpu" if torch.cuda.is_available() else "cpu"
+    if mode not in ("gpu", "cpu"):
+        raise ValueError(f"Unsupported MODEL_LOADING_MODE: {mode}")
+    return mode
+
+def cpu_supports_bf16():
+    """Whether oneDNN has native bfloat16 kernels on this CPU (AVX512-BF16 / AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def cpu_dtype():
+    """Weight dtype on CPU: bfloat16 where the CPU computes it natively, else float32 (never float16)"""
+    choice = LOADING_CONFIG["CPU_DTYPE"]
+    if choice == "auto":
+        return torch.bfloat16 if cpu_supports_bf16() else torch.float32
+    dtypes = {"bfloat16": torch.bfloat16, "float32": torch.float32}
+    if choice not in dtypes:
+        raise ValueError(f"Unsupported CPU_DTYPE: {choice}")
+    return dtypes[choice]
+
+def configure_cpu_threads(threads=None):
+    """Size torch's intra-op pool to the CPUs this process may run on (once per process).
+
+    torch defaults to the host's core count, which oversubscribes containers
+    limited to a CPU set. Inter-op parallelism is left to a single thread:
+    inference runs one graph at a time per request.
+    """
+    global _threads_configured
+    if _threads_configured:
+        return torch.get_num_threads()
+    threads = threads or LOADING_CONFIG["CPU_THREADS"] or min(torch.get_num_threads(), len(os.sched_getaffinity(0)))
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # only settable before the first parallel operation
+    _threads_configured = True
+    logger.info(f"CPU inference with {threads} threads")
+    return threads
+
+def quantizes_on_cpu(role):
+    """Whether ``LOADING_CONFIG["CPU_INT8"]`` covers ``role`` ("llm" or "encoder")"""
+    setting = LOADING_CONFIG["CPU_INT8"]
+    if setting not in ("none", "llm", "all"):
+        raise ValueError(f"Unsupported CPU_INT8: {setting}")
+    return setting == "all" or setting == role
+
+def cpu_load_kwargs(quantize):
+    """``from_pretrained`` arguments of the CPU path; dynamic int8 quantization needs float32 weights"""
+    return {"torch_dtype": torch.float32 if quantize else cpu_dtype(), "low_cpu_mem_usage": True}
+
+def quantize_linear_int8(model):
+    """Dynamic int8 quantization of every nn.Linear (int8 weights, activations quantized on the fly)"""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def finish_model(model, quantize):
+    """Inference mode, plus int8 Linear layers when ``quantize`` (CPU only)"""
+    model = model.eval()
+    if quantize:
+        model = quantize_linear_int8(model)
+        # The float tensors left (embeddings, norms) can be views of the memory-mapped checkpoint, which
+        # would keep every page read while quantizing resident; give them their own memory instead
+        for tensor in itertools.chain(model.parameters(), model.buffers()):
+            tensor.data = tensor.data.clone()
+        gc.collect()  # the replaced float Linear modules sit in reference cycles
+    return model
@@ -1,87 +1,239 @@
 import chromadb
-from rank_bm25 import BM25Okapi
-from configuration import DATA_FILE_PATH, CHROMA_DB_PATH
-from utils import chunk_text_by_hash
-from embedding_utils import generate_embeddings
-
-def initialize_data(bge_model, bge_tokenizer):
-    # Chunk text
-    chunks = chunk_text_by_hash(DATA_FILE_PATH)
-    if not chunks:
-        print("No data chunks found. Exiting.")
-        exit()
-    
-    # Process documents
-    documents_data = []
-    corpus_texts = []
-    for i, chunk in enumerate(chunks):
-        parts = chunk.split("\nNguồn: ")
-        text = parts[0].strip()
-        if text.startswith("# "):
-            text = text[2:]
-        source = parts[1].strip() if len(parts) > 1 else "Không có nguồn"
-        documents_data.append({"id": str(i), "text": text, "source": source})
-        corpus_texts.append(text)
-    
-    # Initialize BM25
+import numpy as np
+from configuration import DB_CONFIG, DATA_CONFIG, RETRIEVAL_CONFIG
+from utils import iter_input_files, section_heading
+from embedding_utils import generate_embeddings, EMBEDDING_VERSION
+from dense_index import DenseIndex
+from ann_index import IVFIndex
+from quantized_index import QuantizedIndex
+from projection import ProjectedIndex
+from bm25_index import BM25Index, tokenize
+from retrieval_bundle import compute_input_hash, load_bundle, read_manifest, write_bundle
+from search_engine import rerank_score_cache
+from ingestion import iter_documents, detect_near_duplicates, batched, build_bundle, bundle_settings, dense_quantization, dense_projection
+
+def load_documents(data_paths=None, tokenizer=None):
+    """Chunk the knowledge base and split each chunk into text and source.
+
+    Document ids are content hashes of (text, source), so editing or inserting
+    one entry leaves every other id untouched. Exact repeats get a ``-n`` suffix.
+    Near-duplicate sections are collapsed into one canonical section.
+    With a ``tokenizer``, long sections are split into token windows.
+    """
+    data_paths = data_paths or DATA_CONFIG["KNOWLEDGE_BASE_PATHS"]
+    return list(iter_documents(data_paths, tokenizer, detect_near_duplicates(data_paths)))
+
+def diff_documents(previous_documents, documents_data):
+    """Split a re-ingestion into (added ids, removed ids, changed count).
+
+    Ids are content hashes, so an edited entry shows up as one removal plus
+    one addition; pairs sharing the same heading line are reported as changed.
+    """
+    previous_ids = {doc["id"] for doc in previous_documents}
+    current_ids = {doc["id"] for doc in documents_data}
+    added = [doc["id"] for doc in documents_data if doc["id"] not in previous_ids]
+    removed = [doc["id"] for doc in previous_documents if doc["id"] not in current_ids]
+
+    removed_headings = {section_heading(doc["text"]) for doc in previous_documents if doc["id"] not in current_ids}
+    changed = sum(1 for doc in documents_data if doc["id"] not in previous_ids and section_heading(doc["text"]) in removed_headings)
+    return added, removed, changed
+
+def build_bm25(documents_data):
     print("Initializing BM25...")
     try:
-        tokenized_corpus = [doc.lower().split() for doc in corpus_texts]
-        bm25 = BM25Okapi(tokenized_corpus)
+        tokenized_corpus = [tokenize(doc["text"]) for doc in documents_data]
+        bm25 = BM25Index(tokenized_corpus, ids=[doc["id"] for doc in documents_data])
         print("BM25 initialized.")
+        return bm25
     except Exception as e:
         print(f"Error initializing BM25: {e}")
-        bm25 = None
-    
+        return None
+
+def _configure_dense_index(dense_index):
+    if isinstance(dense_index, IVFIndex):
+        dense_index.n_probe = RETRIEVAL_CONFIG["IVF_N_PROBE"]
+    elif isinstance(dense_index, (QuantizedIndex, ProjectedIndex)):
+        dense_index.rescore_multiplier = RETRIEVAL_CONFIG["DENSE_RESCORE_MULTIPLIER"]
+    return dense_index
+
+def initialize_bundle(bge_model, bge_tokenizer, backend="numpy"):
+    """Load the retrieval bundle built by ``ingest.py``.
+
+    Ingestion never runs here unless ``RETRIEVAL_CONFIG["INGEST_ON_STARTUP"]``
+    is set; an out-of-date bundle is served with a warning instead.
+    """
+    bundle_path = RETRIEVAL_CONFIG["BUNDLE_PATH"]
+    data_paths = DATA_CONFIG["KNOWLEDGE_BASE_PATHS"]
+    settings = bundle_settings(backend)
+    input_hash = compute_input_hash(list(iter_input_files(data_paths)), settings)
+
+    bundle = load_bundle(bundle_path, input_hash)
+    if bundle is not None:
+        documents_data, bm25, dense_index = bundle
+        print(f"Loaded retrieval bundle with {len(documents_data)} documents from {bundle_path}.")
+        return documents_data, bm25, _configure_dense_index(dense_index)
+
+    if RETRIEVAL_CONFIG["INGEST_ON_STARTUP"]:
+        return refresh_bundle(bge_model, bge_tokenizer, backend, input_hash, settings)
+
+    bundle = load_bundle(bundle_path)
+    if bundle is None:
+        print(f"No retrieval bundle found at {bundle_path}. Build it first with: python ingest.py --backend {backend}")
+        exit()
+    documents_data, bm25, dense_index = bundle
+    print(f"Warning: retrieval bundle at {bundle_path} is out of date for the current knowledge base or settings. "
+          f"Serving it anyway; run python ingest.py --backend {backend} to rebuild.")
+    return documents_data, bm25, _configure_dense_index(dense_index)
+
+def refresh_bundle(bge_model, bge_tokenizer, backend, input_hash, settings):
+    """Rebuild the bundle in this process: incrementally when the settings are unchanged"""
+    bundle_path = RETRIEVAL_CONFIG["BUNDLE_PATH"]
+    data_paths = DATA_CONFIG["KNOWLEDGE_BASE_PATHS"]
+    previous = load_bundle(bundle_path)
+    previous_manifest = read_manifest(bundle_path)
+    if previous is not None and previous_manifest.get("settings") == settings:
+        print("Knowledge base changed since the last bundle. Updating incrementally...")
+        documents_data = load_documents(data_paths, bge_tokenizer)
+        if not documents_data:
+            print("No data chunks found. Exiting.")
+            exit()
+        documents_data, bm25, dense_index = _update_bundle(
+            bundle_path, input_hash, previous, documents_data, bge_model, bge_tokenizer, backend, settings
+        )
+        return documents_data, bm25, _configure_dense_index(dense_index)
+
+    print("Retrieval bundle is missing or was built with other settings. Rebuilding...")
+    bundle = build_bundle(bundle_path, input_hash, data_paths, bge_model, bge_tokenizer, backend=backend, settings=settings)
+    if bundle is None:
+        print("No data chunks found. Exiting.")
+        exit()
+    documents_data, bm25, dense_index = bundle
+    if previous is not None:
+        new_texts = {doc["id"]: doc["text"] for doc in documents_data}
+        stale_ids = [doc["id"] for doc in previous[0] if new_texts.get(doc["id"]) != doc["text"]]
+        invalidated = rerank_score_cache.invalidate_documents(stale_ids)
+        print(f"Invalidated {invalidated} cached rerank scores for {len(stale_ids)} changed or removed documents.")
+    return documents_data, bm25, _configure_dense_index(dense_index)
+
+def _dense_builder(backend, embeddings, documents, centroids=None):
+    """Callback for write_bundle that builds the configured dense index in a directory"""
+    quantization = dense_quantization(backend)
+    projection = dense_projection(backend)
+    if backend == "ivf":
+        index_cls, build_kwargs = IVFIndex, {"n_lists": RETRIEVAL_CONFIG["IVF_N_LISTS"] or None, "centroids": centroids}
+    elif quantization != "none":
+        index_cls, build_kwargs = QuantizedIndex, {"quantization": quantization}
+    elif projection is not None:
+        index_cls, build_kwargs = ProjectedIndex, projection
+    else:
+        index_cls, build_kwargs = DenseIndex, {}
+    return lambda dense_path: index_cls.build(
+        dense_path, embeddings, documents,
+        dtype=RETRIEVAL_CONFIG["DENSE_INDEX_DTYPE"],
+        extra_meta={"embedding_version": EMBEDDING_VERSION},
+        **build_kwargs
+    )
+
+def _update_bundle(bundle_path, input_hash, previous, documents_data, bge_model, bge_tokenizer, backend, settings):
+    """Apply a content diff to the previous bundle: embed only new chunks, drop removed ones"""
+    previous_documents, bm25, previous_dense = previous
+    added, removed, changed = diff_documents(previous_documents, documents_data)
+    print(f"Ingestion diff: {len(added) - changed} added, {changed} changed, {len(removed) - changed} removed, "
+          f"{len(documents_data) - len(added)} unchanged.")
+
+    invalidated = rerank_score_cache.invalidate_documents(removed)
+    if invalidated:
+        print(f"Invalidated {invalidated} cached rerank scores for removed documents.")
+
+    added_set = set(added)
+    new_documents = [doc for doc in documents_data if doc["id"] in added_set]
+    kept_documents = [doc for doc in documents_data if doc["id"] not in added_set]
+
+    if bm25 is None:
+        bm25 = build_bm25(documents_data)
+    else:
+        bm25.remove_documents(removed)
+        bm25.add_documents([doc["id"] for doc in new_documents], [tokenize(doc["text"]) for doc in new_documents])
+
+    kept_vectors = previous_dense.vectors_for([doc["id"] for doc in kept_documents])
+    if new_documents:
+        print(f"Generating BGE embeddings for {len(new_documents)} new or changed documents...")
+        new_vectors = generate_embeddings([doc["text"] for doc in new_documents], bge_model, bge_tokenizer).float().numpy()
+    else:
+        new_vectors = np.zeros((0, kept_vectors.shape[1]), dtype=np.float32)
+
+    centroids = previous_dense.centroids if isinstance(previous_dense, IVFIndex) else None
+    return write_bundle(
+        bundle_path, input_hash, documents_data, bm25,
+        _dense_builder(backend, np.concatenate([kept_vectors, new_vectors]), kept_documents + new_documents, centroids=centroids),
+        settings=settings
+    )
+
+def _chroma_metadata(doc):
+    """Chroma metadata values must be scalars; the sources of collapsed duplicates are newline-joined"""
+    metadata = {key: doc[key] for key in ("source", "parent_id", "start") if key in doc}
+    if "sources" in doc:
+        metadata["sources"] = "\n".join(doc["sources"])
+    return metadata
+
+def knowledge_base_version(backend=None):
+    """Identifier of the knowledge base being served; changes whenever it is re-ingested"""
+    backend = backend or RETRIEVAL_CONFIG["DENSE_BACKEND"]
+    if backend == "chroma":
+        return compute_input_hash(list(iter_input_files(DATA_CONFIG["KNOWLEDGE_BASE_PATHS"])), {"dense_backend": backend})
+    manifest = read_manifest(RETRIEVAL_CONFIG["BUNDLE_PATH"])
+    return manifest["input_hash"] if manifest else None
+
+def initialize_data(bge_model, bge_tokenizer, backend=None):
+    backend = backend or RETRIEVAL_CONFIG["DENSE_BACKEND"]
+    if backend in ("numpy", "ivf"):
+        print(f"Initializing retrieval bundle (backend={backend})...")
+        return initialize_bundle(bge_model, bge_tokenizer, backend=backend)
+    if backend != "chroma":
+        raise ValueError(f"Unsupported dense backend: {backend}")
+
+    documents_data = load_documents(tokenizer=bge_tokenizer)
+    if not documents_data:
+        print("No data chunks found. Exiting.")
+        exit()
+    bm25 = build_bm25(documents_data)
+
     # Initialize ChromaDB and generate embeddings
     print("Initializing ChromaDB and generating BGE embeddings...")
-    chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    chroma_client = chromadb.PersistentClient(path=DB_CONFIG["CHROMA_DB_PATH"])
     collection_name = "mental_health_bge_only_v1"
     collection_embeddings = chroma_client.get_or_create_collection(name=collection_name)
     
-    existing_ids = collection_embeddings.get(ids=[d["id"] for d in documents_data])['ids']
-    ids_to_add = []
-    docs_to_add = []
-    embeddings_to_add = []
-    metadatas_to_add = []
-    
-    if len(existing_ids) < len(documents_data):
-        print(f"Found {len(existing_ids)} existing BGE embeddings. Generating for missing {len(documents_data) - len(existing_ids)} documents...")
-        
-        docs_map = {doc["id"]: doc for doc in documents_data}
-        texts_to_embed = []
-        ids_to_embed = []
-        
-        for doc_id in [d["id"] for d in documents_data]:
-            if doc_id not in existing_ids:
-                ids_to_embed.append(doc_id)
-                texts_to_embed.append(docs_map[doc_id]["text"])
-        
-        if texts_to_embed:
-            print(f"Generating BGE embeddings for {len(texts_to_embed)} documents...")
-            bge_embs = generate_embeddings(texts_to_embed, bge_model, bge_tokenizer)
-            final_embeddings = bge_embs.numpy()
-            
-            for i, doc_id in enumerate(ids_to_embed):
-                doc = docs_map[doc_id]
-                ids_to_add.append(doc["id"])
-                docs_to_add.append(doc["text"])
-                embeddings_to_add.append(final_embeddings[i].tolist())
-                metadatas_to_add.append({"source": doc["source"]})
-            
-            if ids_to_add:
-                print(f"Adding {len(ids_to_add)} new BGE embeddings to ChromaDB...")
-                try:
-                    collection_embeddings.add(
-                        ids=ids_to_add,
-                        embeddings=embeddings_to_add,
-                        documents=docs_to_add,
-                        metadatas=metadatas_to_add
-                    )
-                    print("BGE Embeddings added successfully.")
-                except Exception as e:
-                    print(f"Error adding BGE embeddings to ChromaDB: {e}")
+    current_ids = {d["id"] for d in documents_data}
+    stale_ids = [doc_id for doc_id in collection_embeddings.get(include=[])['ids'] if doc_id not in current_ids]
+    if stale_ids:
+        print(f"Removing {len(stale_ids)} BGE embeddings of documents no longer in the knowledge base...")
+        collection_embeddings.delete(ids=stale_ids)
+        rerank_score_cache.invalidate_documents(stale_ids)
+
+    # Embed and add missing documents batch by batch, so each batch is persisted as soon as it is ready
+    added = 0
+    for batch in batched(documents_data, RETRIEVAL_CONFIG["INGEST_BATCH_SIZE"]):
+        existing_ids = set(collection_embeddings.get(ids=[d["id"] for d in batch], include=[])['ids'])
+        missing = [doc for doc in batch if doc["id"] not in existing_ids]
+        if not missing:
+            continue
+        print(f"Generating BGE embeddings for {len(missing)} documents...")
+        bge_embs = generate_embeddings([doc["text"] for doc in missing], bge_model, bge_tokenizer)
+        try:
+            collection_embeddings.add(
+                ids=[doc["id"] for doc in missing],
+                embeddings=bge_embs.float().numpy().tolist(),
+                documents=[doc["text"] for doc in missing],
+                metadatas=[_chroma_metadata(doc) for doc in missing]
+            )
+            added += len(missing)
+        except Exception as e:
+            print(f"Error adding BGE embeddings to ChromaDB: {e}")
+
+    if added:
+        print(f"Added {added} new BGE embeddings to ChromaDB.")
     else:
         print("All BGE embeddings already exist in ChromaDB.")
-    
-    return documents_data, bm25, collection_embeddings
\ No newline at end of file
+
+    return documents_data, bm25, collection_embeddings
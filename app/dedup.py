@@ -0,0 +1,106 @@
+import re
+import zlib
+import numpy as np
+from utils import section_heading
+
+# ========== Constants ==========
+NUM_PERM = 128
+LSH_BANDS = 16  # 16 bands x 8 rows: pairs above ~0.7 Jaccard almost always share a band
+SHINGLE_WORDS = 3
+_MERSENNE_PRIME = (1 << 31) - 1
+_WORD_PATTERN = re.compile(r"\w+")
+
+def shingles(text, size=SHINGLE_WORDS):
+    """Set of lowercased word ``size``-grams of ``text`` (the whole text if shorter)"""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+class MinHasher:
+    """MinHash signatures from ``num_perm`` universal hash functions (a * x + b) mod p"""
+
+    def __init__(self, num_perm=NUM_PERM, seed=0):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles(text)], dtype=np.uint64) % _MERSENNE_PRIME
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % _MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+class NearDuplicates:
+    """Result of ``find_near_duplicates``: which sections collapse into which canonical one"""
+
+    def __init__(self):
+        self.canonical_of = {}  # duplicate id -> canonical id
+        self.members = {}       # canonical id -> [{"id", "source", "heading", "similarity"}] of its duplicates
+        self.headings = {}      # canonical id -> heading line, for the report
+
+    def __len__(self):
+        return len(self.canonical_of)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.canonical_of
+
+    def annotate(self, doc):
+        """Attach the ids and sources of the duplicates collapsed into a canonical section"""
+        duplicates = self.members.get(doc["id"])
+        if not duplicates:
+            return doc
+        sources = [doc["source"]] + [dup["source"] for dup in duplicates]
+        return dict(
+            doc,
+            sources=list(dict.fromkeys(sources)),
+            duplicate_ids=[dup["id"] for dup in duplicates]
+        )
+
+    def report(self, max_groups=20):
+        if not self.canonical_of:
+            print("No near-duplicate sections found.")
+            return
+        print(f"Collapsed {len(self.canonical_of)} near-duplicate sections into {len(self.members)} canonical sections:")
+        for canonical_id, duplicates in list(self.members.items())[:max_groups]:
+            print(f"  [{canonical_id[:12]}] {self.headings[canonical_id]}")
+            for dup in duplicates:
+                print(f"      <- [{dup['id'][:12]}] {dup['heading']} (~{dup['similarity']:.2f}, {dup['source']})")
+        if len(self.members) > max_groups:
+            print(f"  ... and {len(self.members) - max_groups} more groups.")
+
+def find_near_duplicates(documents, threshold=0.8, num_perm=NUM_PERM, bands=LSH_BANDS):
+    """Group sections whose estimated word-shingle Jaccard similarity is at least ``threshold``.
+
+    ``documents`` is streamed once; only the MinHash signatures of canonical
+    sections are kept. LSH on ``bands`` signature bands proposes candidates,
+    and the signature agreement confirms them. The first occurrence of each
+    group is its canonical section.
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    buckets = {}
+    signatures = {}
+    result = NearDuplicates()
+
+    for doc in documents:
+        signature = hasher.signature(doc["text"])
+        keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+        candidates = {canonical_id for key in keys for canonical_id in buckets.get(key, ())}
+        best_id, best_similarity = None, threshold
+        for canonical_id in candidates:
+            similarity = float(np.mean(signatures[canonical_id] == signature))
+            if similarity >= best_similarity:
+                best_id, best_similarity = canonical_id, similarity
+
+        if best_id is None:
+            signatures[doc["id"]] = signature
+            result.headings[doc["id"]] = section_heading(doc["text"])
+            for key in keys:
+                buckets.setdefault(key, []).append(doc["id"])
+            continue
+        result.canonical_of[doc["id"]] = best_id
+        result.members.setdefault(best_id, []).append({
+            "id": doc["id"], "source": doc["source"], "heading": section_heading(doc["text"]), "similarity": best_similarity
+        })
+    return result
@@ -0,0 +1,206 @@
+import json
+import os
+import numpy as np
+
+# ========== Constants ==========
+INDEX_META_FILE = "index.json"
+EMBEDDINGS_FILE = "embeddings.bin"
+DOCUMENTS_FILE = "documents.jsonl"
+SUPPORTED_DTYPES = ("float32", "float16")
+SCAN_BLOCK_ROWS = 65536
+
+def normalize_rows(matrix):
+    """L2-normalize every row of a 2D array (zero rows are left as zeros)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_indices(scores, k):
+    """Return the indices of the k largest scores, best first"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+class DenseIndex:
+    """Exact cosine-similarity index over a contiguous, memory-mapped embedding matrix.
+
+    Rows are L2-normalized at build time, so a query is a single matrix-vector
+    product followed by ``argpartition``. Row ``i`` of the matrix belongs to
+    ``documents[i]``.
+    """
+
+    def __init__(self, embeddings, documents, path=None, meta=None):
+        self.embeddings = embeddings
+        self.documents = documents
+        self.ids = [doc["id"] for doc in documents]
+        self.id_to_row = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self._parent_rows = None
+        self.path = path
+        self.meta = meta or {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1]
+
+    def vectors_for(self, ids):
+        """Stored (normalized) vectors of the given document ids, as a float32 matrix"""
+        rows = np.array([self.id_to_row[doc_id] for doc_id in ids], dtype=np.int64)
+        return np.asarray(self.embeddings[rows], dtype=np.float32).reshape(rows.size, self.dim)
+
+    def rows_of_parent(self, parent_id):
+        """Rows of the windows split from section ``parent_id`` (empty if it was not split)"""
+        if self._parent_rows is None:
+            self._parent_rows = {}
+            for row, doc in enumerate(self.documents):
+                if "parent_id" in doc:
+                    self._parent_rows.setdefault(doc["parent_id"], []).append(row)
+        return self._parent_rows.get(parent_id, [])
+
+    # ========== Persistence ==========
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, INDEX_META_FILE))
+
+    @classmethod
+    def build(cls, path, embeddings, documents, dtype="float32", extra_meta=None):
+        """Normalize and write embeddings + documents to ``path``, then load it back memory-mapped.
+
+        ``extra_meta`` is stored in the index metadata (e.g. the embedding version).
+        """
+        writer = DenseIndexWriter(path, dtype=dtype, extra_meta=extra_meta)
+        writer.append(embeddings, documents)
+        return writer.finish(cls)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, INDEX_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, DOCUMENTS_FILE), "r", encoding="utf-8") as f:
+            documents = [json.loads(line) for line in f if line.strip()]
+        if meta["count"] > 0:
+            embeddings = np.memmap(
+                os.path.join(path, EMBEDDINGS_FILE),
+                dtype=meta["dtype"],
+                mode="r",
+                shape=(meta["count"], meta["dim"])
+            )
+        else:
+            embeddings = np.zeros((0, meta["dim"]), dtype=meta["dtype"])
+        return cls(embeddings, documents, path=path, meta=meta)
+
+    # ========== Search ==========
+    def similarities(self, query_embedding):
+        """Cosine similarity of one query against every row"""
+        query = normalize_rows(query_embedding)[0]
+        if self.embeddings.dtype == np.float32:
+            return self.embeddings @ query
+        # float16 has no BLAS path; upcast one block at a time to bound the temporary
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), SCAN_BLOCK_ROWS):
+            block = np.asarray(self.embeddings[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + SCAN_BLOCK_ROWS] = block @ query
+        return scores
+
+    def search(self, query_embedding, k):
+        """Return (row indices, cosine similarities) of the top-k rows, best first"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.similarities(query_embedding)
+        rows = top_k_indices(scores, k)
+        return rows, scores[rows]
+
+    def rescore(self, queries, approximate_scores, k, n_rescore):
+        """Exact top-k per query among the ``n_rescore`` best rows of ``approximate_scores``.
+
+        ``queries`` must be normalized. Only the candidate rows are read from
+        the (memory-mapped) float matrix.
+        """
+        k = min(k, n_rescore)
+        all_rows = np.empty((queries.shape[0], k), dtype=np.int64)
+        all_scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        for q, query in enumerate(queries):
+            candidates = np.sort(top_k_indices(approximate_scores[q], n_rescore))  # sorted rows read the memmap in order
+            exact = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query
+            best = top_k_indices(exact, k)
+            all_rows[q] = candidates[best]
+            all_scores[q] = exact[best]
+        return all_rows, all_scores
+
+    def search_many(self, query_embeddings, k):
+        """Batched ``search``: one matrix-matrix product for all queries.
+
+        Returns (rows, similarities), each of shape (n_queries, min(k, len(self))).
+        """
+        queries = normalize_rows(query_embeddings)
+        k = min(k, len(self))
+        if k <= 0:
+            empty = (queries.shape[0], 0)
+            return np.empty(empty, dtype=np.int64), np.empty(empty, dtype=np.float32)
+        if self.embeddings.dtype == np.float32:
+            scores = queries @ self.embeddings.T
+        else:
+            scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+            for start in range(0, len(self), SCAN_BLOCK_ROWS):
+                block = np.asarray(self.embeddings[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+                scores[:, start:start + SCAN_BLOCK_ROWS] = queries @ block.T
+        if k < len(self):
+            rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            rows = np.tile(np.arange(len(self)), (queries.shape[0], 1))
+        top_scores = np.take_along_axis(scores, rows, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+class DenseIndexWriter:
+    """Append-only writer for a ``DenseIndex`` directory.
+
+    Rows are normalized and flushed to disk batch by batch, so building an
+    index never needs the whole embedding matrix in memory.
+    """
+
+    def __init__(self, path, dtype="float32", extra_meta=None):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dense index dtype: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.extra_meta = dict(extra_meta or {})
+        self.count = 0
+        self.dim = None
+        os.makedirs(path, exist_ok=True)
+        self._embeddings_file = open(os.path.join(path, EMBEDDINGS_FILE), "wb")
+        self._documents_file = open(os.path.join(path, DOCUMENTS_FILE), "w", encoding="utf-8")
+
+    def append(self, embeddings, documents):
+        matrix = normalize_rows(embeddings).astype(self.dtype)
+        if matrix.shape[0] != len(documents):
+            raise ValueError(f"Got {matrix.shape[0]} embeddings for {len(documents)} documents")
+        if self.dim is None:
+            self.dim = int(matrix.shape[1])
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {matrix.shape[1]}")
+        matrix.tofile(self._embeddings_file)
+        for doc in documents:
+            self._documents_file.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        self.count += matrix.shape[0]
+
+    def finish(self, index_cls=DenseIndex):
+        """Close the files, write the metadata and load the finished index memory-mapped"""
+        self._embeddings_file.close()
+        self._documents_file.close()
+        meta = dict(self.extra_meta)
+        meta.update({"count": self.count, "dim": self.dim or 0, "dtype": self.dtype})
+        with open(os.path.join(self.path, INDEX_META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        print(f"Dense index written to {self.path} ({meta['count']} x {meta['dim']}, {self.dtype}).")
+        return index_cls.load(self.path)
@@ -1,4 +1,7 @@
 import torch
+import numpy as np
+from configuration import CACHE_CONFIG
+from cache_utils import QueryEmbeddingCache
 
 # Device configuration
 if torch.cuda.is_available():
@@ -8,14 +11,77 @@ else:
     device = torch.device("cpu")
     print("Using CPU")
 
-def generate_embeddings(texts, model, tokenizer, batch_size=16):
-    all_embeddings = []
+MAX_LENGTH = 512
+DEFAULT_MAX_BATCH_TOKENS = 8192
+# Bump when the pooling/tokenization changes so persisted document embeddings get rebuilt
+EMBEDDING_VERSION = 2
+
+# Shared by hybrid search and question suggestion
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=CACHE_CONFIG["QUERY_EMBEDDING_CACHE_SIZE"],
+    ttl_seconds=CACHE_CONFIG["QUERY_EMBEDDING_CACHE_TTL"]
+)
+
+def pack_batches(lengths, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS, max_batch_size=None):
+    """Group text indices into batches of similar length under a padded-token budget.
+
+    Indices are visited longest first, so each batch pads to its first member
+    and the largest (most memory-hungry) batch runs first. A batch holds as
+    many texts as fit in ``max_batch_tokens`` (rows x padded length), with at
+    least one text per batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    current = []
+    for i in order:
+        padded_length = lengths[current[0]] if current else lengths[i]
+        too_many_tokens = (len(current) + 1) * padded_length > max_batch_tokens
+        too_many_rows = max_batch_size is not None and len(current) >= max_batch_size
+        if current and (too_many_tokens or too_many_rows):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+def generate_embeddings(texts, model, tokenizer, batch_size=None, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS):
+    """Mean-pooled embeddings for ``texts``, returned in input order.
+
+    Texts are tokenized once, sorted by token length and packed into batches
+    under ``max_batch_tokens`` padded tokens (``batch_size`` optionally caps
+    the rows per batch). Pooling ignores padding, so an embedding does not
+    depend on which texts it was batched with.
+    """
+    texts = list(texts)
+    if not texts:
+        return torch.empty((0, model.config.hidden_size))
+    encoded = tokenizer(texts, truncation=True, padding=False, max_length=MAX_LENGTH)
+    lengths = [len(ids) for ids in encoded["input_ids"]]
+
+    all_embeddings = [None] * len(texts)
     model.eval()
     with torch.no_grad():
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
-            inputs = tokenizer(batch_texts, return_tensors="pt", truncation=True, padding=True, max_length=512).to(device)
+        for batch_indices in pack_batches(lengths, max_batch_tokens=max_batch_tokens, max_batch_size=batch_size):
+            features = [{key: encoded[key][i] for key in encoded.keys()} for i in batch_indices]
+            inputs = tokenizer.pad(features, padding=True, return_tensors="pt").to(device)
             outputs = model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)
-            all_embeddings.append(embeddings.cpu())
-    return torch.cat(all_embeddings)
\ No newline at end of file
+            mask = inputs["attention_mask"].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+            embeddings = (outputs.last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            for i, embedding in zip(batch_indices, embeddings.cpu()):
+                all_embeddings[i] = embedding
+    return torch.stack(all_embeddings)
+
+def get_model_id(model):
+    """Stable identifier of an encoder, used to key cached embeddings"""
+    name = getattr(getattr(model, "config", None), "_name_or_path", None) or model.__class__.__name__
+    return f"mean-pool-v{EMBEDDING_VERSION}:{name}"
+
+def embed_queries(queries, model, tokenizer, cache=query_embedding_cache):
+    """Query embeddings as a float32 matrix, served from the shared cache where possible"""
+    def compute(texts):
+        return [row.copy() for row in generate_embeddings(texts, model, tokenizer).float().numpy()]
+
+    if cache is None:
+        return np.stack(compute(list(queries)))
+    return np.stack(cache.get_or_compute(get_model_id(model), list(queries), compute))
@@ -0,0 +1,285 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import torch
+from configuration import GENERATION_CONFIG
+from kv_cache import to_legacy, to_model_cache, cache_length, pad_left, concat_rows, select_rows, slice_positions, compact
+
+logger = logging.getLogger(__name__)
+
+# ========== Constants ==========
+IDLE_POLL_SECONDS = 0.1
+_STREAM_END = object()
+
+class GenerationRequest:
+    """One prompt submitted to a ``GenerationService``.
+
+    ``future`` resolves to the list of generated token ids; ``stream()``
+    yields them one by one as they are decoded. ``past_key_values`` (legacy
+    layout) may cover the first prompt tokens, which are then not prefilled again.
+    With ``keep_past``, ``past_key_values`` holds the sequence's own past once
+    it is finished (every position but the last generated token).
+    """
+
+    def __init__(self, input_ids, max_new_tokens=200, temperature=1.0, top_p=1.0, do_sample=False,
+                 repetition_penalty=1.0, eos_token_id=None, stopping_criteria=None, past_key_values=None,
+                 keep_past=False):
+        self.input_ids = [int(token_id) for token_id in input_ids]
+        self.past_key_values = past_key_values
+        self.keep_past = keep_past
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.do_sample = do_sample
+        self.repetition_penalty = repetition_penalty
+        if eos_token_id is None:
+            eos_token_id = []
+        self.eos_token_ids = set(eos_token_id) if isinstance(eos_token_id, (list, tuple, set)) else {eos_token_id}
+        self.stopping_criteria = stopping_criteria
+        self.generated = []
+        self.future = Future()
+        self._tokens = queue.Queue()
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+
+    def stream(self):
+        while True:
+            token_id = self._tokens.get()
+            if token_id is _STREAM_END:
+                break
+            yield token_id
+        self.future.result()  # re-raise a generation error after the tokens that did arrive
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    # ========== Called by the worker thread ==========
+    def _emit(self, token_id):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.generated.append(token_id)
+        self._tokens.put(token_id)
+
+    def _finished(self, token_id):
+        if token_id in self.eos_token_ids or len(self.generated) >= self.max_new_tokens:
+            return True
+        if self.stopping_criteria:
+            sequence = torch.tensor([self.input_ids + self.generated])
+            for criterion in self.stopping_criteria:
+                stop = criterion(sequence, None)
+                if bool(stop.all()) if torch.is_tensor(stop) else bool(stop):
+                    return True
+        return False
+
+    def _complete(self, error=None):
+        self._tokens.put(_STREAM_END)
+        if error is None:
+            self.future.set_result(self.generated)
+        else:
+            self.future.set_exception(error)
+
+def sample_next_token(logits, request):
+    """Pick the next token from one row of logits with the request's decoding settings"""
+    logits = logits.float().clone()
+    if request.repetition_penalty != 1.0:
+        seen = torch.tensor(sorted(set(request.input_ids + request.generated)), dtype=torch.long, device=logits.device)
+        scores = logits[seen]
+        logits[seen] = torch.where(scores < 0, scores * request.repetition_penalty, scores / request.repetition_penalty)
+    if not request.do_sample:
+        return int(torch.argmax(logits))
+    probs = torch.softmax(logits / max(request.temperature, 1e-5), dim=-1)
+    if request.top_p < 1.0:
+        sorted_probs, order = torch.sort(probs, descending=True)
+        sorted_probs[torch.cumsum(sorted_probs, dim=-1) - sorted_probs > request.top_p] = 0
+        probs = torch.zeros_like(probs).scatter(0, order, sorted_probs)
+    return int(torch.multinomial(probs / probs.sum(), 1))
+
+class GenerationService:
+    """Shares one causal LM between concurrent conversations with continuous batching.
+
+    Requests wait in a queue. A worker thread keeps one left-padded batch of
+    in-flight sequences with their stacked past key/values and advances all of
+    them by one token per forward pass. Between steps it admits queued
+    requests (each is prefilled on its own and merged into the batch) and
+    retires finished ones, so a long answer never blocks a short one and the
+    model runs on up to ``max_batch_size`` sequences at once.
+    """
+
+    def __init__(self, model, max_batch_size=None):
+        self.model = model
+        self.max_batch_size = max_batch_size or GENERATION_CONFIG["MAX_BATCH_SIZE"]
+        self.device = getattr(model, "device", torch.device("cpu"))
+        self.steps = 0
+        self.batched_rows = 0
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._active = []
+        self._past = None
+        self._attention_mask = None
+        self._thread = threading.Thread(target=self._run, name="generation-service", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_ids, **decoding):
+        """Queue a prompt (a list of token ids); returns its ``GenerationRequest``"""
+        if self._closed.is_set():
+            raise RuntimeError("Generation service is closed")
+        request = GenerationRequest(input_ids, **decoding)
+        self._queue.put(request)
+        return request
+
+    def generate(self, input_ids, **decoding):
+        """Blocking helper: the generated token ids of one prompt"""
+        return self.submit(input_ids, **decoding).result()
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "steps": self.steps,
+            "mean_batch_size": self.batched_rows / self.steps if self.steps else 0.0,
+            "active": len(self._active),
+            "queued": self._queue.qsize()
+        }
+
+    # ========== Worker ==========
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                self._admit()
+                if self._active:
+                    self._step()
+            except Exception as e:
+                logger.error(f"Generation step failed: {e}")
+                for request in self._active:
+                    request._complete(e)
+                self._active, self._past, self._attention_mask = [], None, None
+        for request in self._active:
+            request._complete(RuntimeError("Generation service closed"))
+        while not self._queue.empty():
+            self._queue.get_nowait()._complete(RuntimeError("Generation service closed"))
+        # Nothing on the worker side keeps the batch (or, once dropped by its owner, the model) alive
+        self._active, self._past, self._attention_mask = [], None, None
+
+    def _admit(self):
+        while len(self._active) < self.max_batch_size:
+            try:
+                # Sleep on the queue only when there is nothing to decode
+                request = self._queue.get(timeout=IDLE_POLL_SECONDS) if not self._active else self._queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self._prefill(request)
+            except Exception as e:
+                request._complete(e)
+
+    @torch.no_grad()
+    def _prefill(self, request):
+        cached, request.past_key_values = request.past_key_values, None
+        start = cache_length(cached) if cached is not None else 0
+        input_ids = torch.tensor([request.input_ids[start:]], dtype=torch.long, device=self.device)
+        outputs = self.model(
+            input_ids=input_ids,
+            past_key_values=to_model_cache(cached) if cached is not None else None,
+            use_cache=True
+        )
+        token_id = sample_next_token(outputs.logits[0, -1], request)
+        request._emit(token_id)
+        past = to_legacy(outputs.past_key_values)
+        if request._finished(token_id):
+            if request.keep_past:
+                request.past_key_values = past
+            request._complete()
+            return
+
+        mask = torch.ones((1, len(request.input_ids)), dtype=torch.long, device=self.device)
+        request.next_token = token_id
+        if not self._active:
+            self._active, self._past, self._attention_mask = [request], past, mask
+            return
+        length = max(cache_length(self._past), cache_length(past))
+        self._past = concat_rows(pad_left(self._past, length), pad_left(past, length))
+        self._attention_mask = torch.cat([self._pad_mask(self._attention_mask, length), self._pad_mask(mask, length)], dim=0)
+        self._active.append(request)
+
+    @staticmethod
+    def _pad_mask(mask, length):
+        missing = length - mask.shape[1]
+        if missing <= 0:
+            return mask
+        return torch.cat([mask.new_zeros((mask.shape[0], missing)), mask], dim=1)
+
+    @torch.no_grad()
+    def _step(self):
+        batch_size = len(self._active)
+        input_ids = torch.tensor([[request.next_token] for request in self._active], dtype=torch.long, device=self.device)
+        # Each row continues from its own number of real (unpadded) tokens
+        position_ids = self._attention_mask.sum(dim=1, keepdim=True)
+        attention_mask = torch.cat([self._attention_mask, self._attention_mask.new_ones((batch_size, 1))], dim=1)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=to_model_cache(self._past),
+            use_cache=True
+        )
+        self.steps += 1
+        self.batched_rows += batch_size
+        self._past = to_legacy(outputs.past_key_values)
+        self._attention_mask = attention_mask
+
+        keep = []
+        for row, request in enumerate(self._active):
+            token_id = sample_next_token(outputs.logits[row, -1], request)
+            request._emit(token_id)
+            if request._finished(token_id):
+                if request.keep_past:
+                    padding = self._attention_mask.shape[1] - int(self._attention_mask[row].sum())
+                    request.past_key_values = compact(slice_positions(select_rows(self._past, [row]), padding))
+                request._complete()
+            else:
+                request.next_token = token_id
+                keep.append(row)
+        if len(keep) < batch_size:
+            self._retire(keep)
+
+    def _retire(self, keep):
+        """Drop finished rows and the left padding no remaining row needs"""
+        self._active = [self._active[row] for row in keep]
+        if not keep:
+            self._past, self._attention_mask = None, None
+            return
+        self._past = select_rows(self._past, keep)
+        self._attention_mask = self._attention_mask[keep]
+        unused = int((self._attention_mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+        if unused:
+            self._past = slice_positions(self._past, unused)
+            self._attention_mask = self._attention_mask[:, unused:]
+
+_services = {}
+_services_lock = threading.Lock()
+
+def get_generation_service(model):
+    """The shared service of ``model``, started on first use"""
+    with _services_lock:
+        service = _services.get(id(model))
+        if service is not None and service.model is not model:
+            # A model that was never closed and whose id was reused: stop its worker
+            service.close()
+            service = None
+        if service is None:
+            service = GenerationService(model)
+            _services[id(model)] = service
+        return service
+
+def close_generation_service(model):
+    """Stop the worker of ``model``'s service and forget it, so the model can be freed"""
+    with _services_lock:
+        service = _services.get(id(model))
+        if service is None or service.model is not model:
+            return
+        del _services[id(model)]
+    service.close()
@@ -0,0 +1,170 @@
+"""Build the retrieval bundle offline with a pool of CPU embedding worker processes.
+
+The document stream is cut into fixed-size shards. Every finished shard is
+checkpointed to disk, so an interrupted run resumes with the first unfinished
+shard. Documents whose content-hash id is already in the previous bundle (built
+with the same settings) reuse their stored vectors instead of being re-embedded.
+
+    python ingest.py --backend numpy --workers 4 --threads-per-worker 2
+    python ingest.py --inputs data/ extra/faq.txt --backend ivf
+"""
+import argparse
+import os
+import shutil
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from configuration import DATA_CONFIG, RETRIEVAL_CONFIG
+from utils import iter_input_files
+from retrieval_bundle import compute_input_hash, load_bundle, read_manifest
+from ingestion import iter_documents, detect_near_duplicates, batched, bundle_settings, write_streamed_bundle
+
+# ========== Constants ==========
+DEFAULT_SHARD_SIZE = 512
+SUBMITTED_SHARDS_PER_WORKER = 2  # bounds how many shards of text are queued at once
+
+# ========== Worker process ==========
+_worker_model = None
+
+def _init_worker(threads):
+    """Load one float32 BGE copy per worker process, pinned to ``threads`` intra-op threads"""
+    global _worker_model
+    import torch
+    from model_loader import load_bge_model
+    torch.set_num_threads(threads)
+    _worker_model = load_bge_model(torch_dtype=torch.float32, device_map=None)
+
+def _embed_shard(path, ids, texts):
+    """Embed one shard and checkpoint it atomically; returns the number of chunks embedded"""
+    from embedding_utils import generate_embeddings
+    model, tokenizer = _worker_model
+    embeddings = generate_embeddings(texts, model, tokenizer).float().numpy()
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, ids=np.array(ids), embeddings=embeddings)
+    os.replace(tmp_path, path)
+    return len(ids)
+
+# ========== Shards ==========
+def shard_path(work_dir, index):
+    return os.path.join(work_dir, f"shard-{index:06d}.npz")
+
+def read_shard(path, expected_ids):
+    """Checkpointed embeddings of a shard, or None when missing or built from other documents"""
+    try:
+        with np.load(path) as shard:
+            if shard["ids"].tolist() == expected_ids:
+                return shard["embeddings"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def iter_shards(data_paths, tokenizer, duplicates, shard_size, reusable_ids):
+    """Yield (shard index, documents, ids that need embedding) over the deduplicated, windowed document stream"""
+    for index, documents in enumerate(batched(iter_documents(data_paths, tokenizer, duplicates), shard_size)):
+        yield index, documents, [doc["id"] for doc in documents if doc["id"] not in reusable_ids]
+
+def embed_shards(data_paths, tokenizer, duplicates, work_dir, shard_size, reusable_ids, workers, threads):
+    """Embed every shard that is not checkpointed yet; returns the number of chunks embedded"""
+    os.makedirs(work_dir, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    embedded = 0
+    resumed = 0
+    pending = set()
+    start = time.perf_counter()
+
+    def collect(done):
+        nonlocal embedded
+        for future in done:
+            embedded += future.result()
+        elapsed = time.perf_counter() - start
+        print(f"Embedded {embedded} chunks in {elapsed:.1f}s ({embedded / elapsed:.1f} chunks/s)")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool:
+        for index, documents, missing_ids in iter_shards(data_paths, tokenizer, duplicates, shard_size, reusable_ids):
+            path = shard_path(work_dir, index)
+            if not missing_ids:
+                continue
+            if read_shard(path, missing_ids) is not None:
+                resumed += 1
+                continue
+            if len(pending) >= workers * SUBMITTED_SHARDS_PER_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            missing = set(missing_ids)
+            texts = [doc["text"] for doc in documents if doc["id"] in missing]
+            pending.add(pool.submit(_embed_shard, path, missing_ids, texts))
+        if pending:
+            collect(wait(pending)[0])
+    if resumed:
+        print(f"Resumed {resumed} shards checkpointed by an earlier run.")
+    return embedded
+
+def assembled_batches(data_paths, tokenizer, duplicates, work_dir, shard_size, reusable_ids, previous_dense):
+    """Yield (documents, embeddings) per shard from checkpoints and reused vectors, in corpus order"""
+    for index, documents, missing_ids in iter_shards(data_paths, tokenizer, duplicates, shard_size, reusable_ids):
+        vectors = {}
+        if missing_ids:
+            fresh = read_shard(shard_path(work_dir, index), missing_ids)
+            if fresh is None:
+                raise RuntimeError(f"Shard {index} was not embedded; rerun ingest.py to resume")
+            vectors.update(zip(missing_ids, fresh))
+        reused_ids = [doc["id"] for doc in documents if doc["id"] not in vectors]
+        if reused_ids:
+            vectors.update(zip(reused_ids, previous_dense.vectors_for(reused_ids)))
+        yield documents, np.stack([vectors[doc["id"]] for doc in documents])
+
+def ingest(data_paths, backend, workers, threads, shard_size, force=False, full=False):
+    bundle_path = RETRIEVAL_CONFIG["BUNDLE_PATH"]
+    settings = bundle_settings(backend)
+    input_hash = compute_input_hash(list(iter_input_files(data_paths)), settings)
+    if not force and load_bundle(bundle_path, input_hash) is not None:
+        print(f"Retrieval bundle at {bundle_path} is up to date.")
+        return True
+
+    reusable_ids = set()
+    previous_dense = None
+    previous = None if full else load_bundle(bundle_path)
+    if previous is not None and read_manifest(bundle_path).get("settings") == settings:
+        previous_dense = previous[2]
+        reusable_ids = set(previous_dense.ids)
+        print(f"Reusing vectors of unchanged documents from the previous bundle ({len(reusable_ids)} documents).")
+
+    from model_loader import load_bge_tokenizer
+    tokenizer = load_bge_tokenizer()  # only for splitting sections into windows; workers hold the model
+    duplicates = detect_near_duplicates(data_paths)
+    work_dir = os.path.join(RETRIEVAL_CONFIG["INGEST_WORK_DIR"], input_hash[:16])
+    print(f"Embedding with {workers} worker processes x {threads} threads, {shard_size} chunks per shard...")
+    start = time.perf_counter()
+    embedded = embed_shards(data_paths, tokenizer, duplicates, work_dir, shard_size, reusable_ids, workers, threads)
+
+    bundle = write_streamed_bundle(
+        bundle_path, input_hash,
+        assembled_batches(data_paths, tokenizer, duplicates, work_dir, shard_size, reusable_ids, previous_dense),
+        backend=backend, settings=settings
+    )
+    if bundle is None:
+        print("No data chunks found.")
+        return False
+    shutil.rmtree(work_dir, ignore_errors=True)
+    elapsed = time.perf_counter() - start
+    print(f"Ingested {len(bundle[0])} chunks ({embedded} embedded in this run) in {elapsed:.1f}s "
+          f"({len(bundle[0]) / elapsed:.1f} chunks/s overall).")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", nargs="+", default=DATA_CONFIG["KNOWLEDGE_BASE_PATHS"], help="knowledge-base files or directories")
+    parser.add_argument("--backend", choices=["numpy", "ivf"], default=RETRIEVAL_CONFIG["DENSE_BACKEND"] if RETRIEVAL_CONFIG["DENSE_BACKEND"] != "chroma" else "numpy")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="default: CPU count / workers")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--force", action="store_true", help="rebuild even if the bundle is up to date")
+    parser.add_argument("--full", action="store_true", help="re-embed every chunk instead of reusing the previous bundle")
+    args = parser.parse_args()
+
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    # Workers are CPU-only; keep them off any GPU the serving process may be using
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    ok = ingest(args.inputs, args.backend, args.workers, threads, args.shard_size, force=args.force, full=args.full)
+    raise SystemExit(0 if ok else 1)
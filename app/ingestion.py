@@ -0,0 +1,206 @@
+import json
+import os
+import shutil
+from itertools import islice
+from configuration import RETRIEVAL_CONFIG, MODEL_CONFIG
+from utils import iter_input_files, iter_chunks, content_hash
+from embedding_utils import generate_embeddings, EMBEDDING_VERSION
+from bm25_index import BM25Index, tokenize, DEFAULT_K1, DEFAULT_B, DEFAULT_EPSILON
+from dense_index import DenseIndexWriter
+from ann_index import IVFIndex
+from quantized_index import QuantizedIndex
+from projection import ProjectedIndex
+from dedup import find_near_duplicates
+from retrieval_bundle import begin_bundle, commit_bundle, DOCUMENTS_FILE, BM25_DIR, DENSE_DIR
+
+# ========== Constants ==========
+FLAT_DENSE_DIR = "dense_flat"
+
+def dense_quantization(backend):
+    """Code quantization applied to the dense index of ``backend`` ("none" for IVF)"""
+    return RETRIEVAL_CONFIG["DENSE_QUANTIZATION"] if backend == "numpy" else "none"
+
+def dense_projection(backend):
+    """``{"method", "dim"}`` of the projection applied to the dense index of ``backend``, or None"""
+    method = RETRIEVAL_CONFIG["DENSE_PROJECTION"]
+    if backend != "numpy" or method == "none":
+        return None
+    if dense_quantization(backend) != "none":
+        raise ValueError("DENSE_PROJECTION cannot be combined with DENSE_QUANTIZATION")
+    return {"method": method, "dim": RETRIEVAL_CONFIG["DENSE_PROJECTION_DIM"]}
+
+def bundle_settings(backend):
+    """Everything besides the input text that changes what the bundle contains"""
+    return {
+        "dense_backend": backend,
+        "dense_dtype": RETRIEVAL_CONFIG["DENSE_INDEX_DTYPE"],
+        "dense_quantization": dense_quantization(backend),
+        "dense_projection": dense_projection(backend),
+        "ivf_n_lists": RETRIEVAL_CONFIG["IVF_N_LISTS"] if backend == "ivf" else None,
+        "bge_model": MODEL_CONFIG["BGE_MODEL_NAME"],
+        "embedding_version": EMBEDDING_VERSION,
+        "bm25": [DEFAULT_K1, DEFAULT_B, DEFAULT_EPSILON],
+        "window": [RETRIEVAL_CONFIG["WINDOW_TOKENS"], RETRIEVAL_CONFIG["WINDOW_OVERLAP"]],
+        "dedup_threshold": RETRIEVAL_CONFIG["DEDUP_THRESHOLD"] if RETRIEVAL_CONFIG["DEDUP"] else None,
+    }
+
+def parse_chunk(chunk):
+    """Split a raw chunk into (text, source)"""
+    parts = chunk.split("\nNguồn: ")
+    text = parts[0].strip()
+    if text.startswith("# "):
+        text = text[2:]
+    source = parts[1].strip() if len(parts) > 1 else "Không có nguồn"
+    return text, source
+
+def split_into_windows(doc, tokenizer, window_tokens=None, overlap=None):
+    """Split one section into overlapping token windows that link back to it.
+
+    A section that fits in ``window_tokens`` is returned unchanged. Otherwise
+    each window is an exact character span of the section, with id
+    ``<section id>:<n>``, ``parent_id`` set to the section id and ``start``
+    holding its character offset, so the section can be rebuilt from its windows.
+    """
+    window_tokens = window_tokens or RETRIEVAL_CONFIG["WINDOW_TOKENS"]
+    overlap = RETRIEVAL_CONFIG["WINDOW_OVERLAP"] if overlap is None else overlap
+    if not 0 <= overlap < window_tokens:
+        raise ValueError(f"Window overlap must be in [0, {window_tokens}), got {overlap}")
+    offsets = tokenizer(doc["text"], add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    if len(offsets) <= window_tokens:
+        return [doc]
+
+    windows = []
+    stride = window_tokens - overlap
+    for n, first in enumerate(range(0, len(offsets) - overlap, stride)):
+        last = min(first + window_tokens, len(offsets)) - 1
+        start, end = offsets[first][0], offsets[last][1]
+        windows.append(dict(
+            doc,
+            id=f"{doc['id']}:{n}",
+            text=doc["text"][start:end],
+            parent_id=doc["id"],
+            start=start
+        ))
+    return windows
+
+def iter_sections(data_paths):
+    """Yield one document dict per knowledge-base section, read line by line.
+
+    Document ids are content hashes of (text, source); exact repeats get a ``-n`` suffix.
+    """
+    seen = {}
+    for file_path in iter_input_files(data_paths):
+        count = 0
+        for chunk in iter_chunks(file_path):
+            text, source = parse_chunk(chunk)
+            doc_id = content_hash(text, source)
+            seen[doc_id] = seen.get(doc_id, -1) + 1
+            if seen[doc_id]:
+                doc_id = f"{doc_id}-{seen[doc_id]}"
+            count += 1
+            yield {"id": doc_id, "text": text, "source": source}
+        print(f"Successfully chunked {count} documents from {file_path}")
+
+def detect_near_duplicates(data_paths):
+    """Near-duplicate sections of the knowledge base, or None when ``RETRIEVAL_CONFIG["DEDUP"]`` is off"""
+    if not RETRIEVAL_CONFIG["DEDUP"]:
+        return None
+    duplicates = find_near_duplicates(iter_sections(data_paths), threshold=RETRIEVAL_CONFIG["DEDUP_THRESHOLD"])
+    duplicates.report()
+    return duplicates
+
+def iter_documents(data_paths, tokenizer=None, duplicates=None):
+    """Yield document dicts from one or more knowledge-base files or directories.
+
+    Files are read line by line, so only the current chunk is held in memory.
+    Sections listed in ``duplicates`` (see ``detect_near_duplicates``) are
+    dropped; their canonical section carries their ids and sources instead.
+    With a ``tokenizer``, sections longer than the embedding window are split
+    by ``split_into_windows``.
+    """
+    for doc in iter_sections(data_paths):
+        if duplicates is not None:
+            if doc["id"] in duplicates:
+                continue
+            doc = duplicates.annotate(doc)
+        if tokenizer is None:
+            yield doc
+        else:
+            yield from split_into_windows(doc, tokenizer)
+
+def batched(iterable, size):
+    """Yield lists of up to ``size`` consecutive items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def embed_batches(document_batches, model, tokenizer):
+    """Yield (documents, float32 embedding matrix) for every batch of documents"""
+    for documents in document_batches:
+        embeddings = generate_embeddings([doc["text"] for doc in documents], model, tokenizer)
+        yield documents, embeddings.float().numpy()
+
+def build_bundle(path, input_hash, data_paths, model, tokenizer, backend="numpy", settings=None, batch_size=None):
+    """Stream the knowledge base into a new retrieval bundle, embedding it in this process.
+
+    Returns the loaded bundle, or None when the inputs hold no documents.
+    """
+    batch_size = batch_size or RETRIEVAL_CONFIG["INGEST_BATCH_SIZE"]
+    documents = iter_documents(data_paths, tokenizer, detect_near_duplicates(data_paths))
+    embedded = embed_batches(batched(documents, batch_size), model, tokenizer)
+    return write_streamed_bundle(path, input_hash, embedded, backend=backend, settings=settings)
+
+def write_streamed_bundle(path, input_hash, embedded_batches, backend="numpy", settings=None):
+    """Write a bundle from an iterable of (documents, embedding matrix) batches.
+
+    Each batch is appended to the dense index and documents file as it
+    arrives; BM25 keeps only its compact postings. Peak memory is therefore
+    bounded by one batch plus the index structures, not by the size of the
+    input files. For the IVF backend the flat index is written first and then
+    clustered block by block; quantized codes and projected rows are added the
+    same way. Returns the loaded bundle, or None when no documents were produced.
+    """
+    dtype = RETRIEVAL_CONFIG["DENSE_INDEX_DTYPE"]
+    extra_meta = {"embedding_version": EMBEDDING_VERSION}
+    staging = begin_bundle(path)
+    flat_path = os.path.join(staging, FLAT_DENSE_DIR if backend == "ivf" else DENSE_DIR)
+    writer = DenseIndexWriter(flat_path, dtype=dtype, extra_meta=extra_meta)
+
+    with open(os.path.join(staging, DOCUMENTS_FILE), "w", encoding="utf-8") as documents_file:
+        def indexed_documents():
+            # BM25 pulls documents through the pipeline; each batch is written on the way
+            for documents, embeddings in embedded_batches:
+                writer.append(embeddings, documents)
+                for doc in documents:
+                    documents_file.write(json.dumps(doc, ensure_ascii=False) + "\n")
+                    yield doc["id"], tokenize(doc["text"])
+                print(f"Indexed {writer.count} documents...")
+
+        print("Initializing BM25...")
+        bm25 = BM25Index.from_documents(indexed_documents())
+    dense_index = writer.finish()
+
+    if len(bm25) == 0:
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
+    if backend == "ivf":
+        IVFIndex.build(
+            os.path.join(staging, DENSE_DIR), dense_index.embeddings, dense_index.documents,
+            dtype=dtype, extra_meta=extra_meta, n_lists=RETRIEVAL_CONFIG["IVF_N_LISTS"] or None
+        )
+        del dense_index
+        shutil.rmtree(flat_path)
+    quantization = dense_quantization(backend)
+    projection = dense_projection(backend)
+    if quantization != "none":
+        QuantizedIndex.quantize(flat_path, quantization)
+    elif projection is not None:
+        ProjectedIndex.project(flat_path, **projection)
+    bm25.save(os.path.join(staging, BM25_DIR))
+    return commit_bundle(
+        path, staging, input_hash, len(bm25), has_bm25=True, dense_backend=backend,
+        dense_quantization=quantization, dense_projection=projection, settings=settings
+    )
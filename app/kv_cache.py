@@ -0,0 +1,74 @@
+import torch
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # transformers releases before the Cache classes only use tuples
+    DynamicCache = None
+
+# Past key/values are handled here in the legacy layout: one (key, value) pair
+# per layer, each of shape [batch, kv heads, positions, head dim].
+
+def to_legacy(past_key_values):
+    """Legacy tuple layout of whatever ``model(...)`` returned as past_key_values"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    if hasattr(past_key_values, "layers"):  # transformers 5 Cache objects
+        return tuple((layer.keys, layer.values) for layer in past_key_values.layers)
+    return tuple((key, value) for key, value in past_key_values)
+
+def to_model_cache(legacy):
+    """A fresh cache object for ``model(past_key_values=...)``; ``legacy`` itself is never mutated"""
+    if DynamicCache is None:
+        return legacy
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy)
+    return DynamicCache(legacy)
+
+def cache_length(legacy):
+    return legacy[0][0].shape[-2]
+
+def cache_nbytes(legacy):
+    return sum(key.numel() * key.element_size() + value.numel() * value.element_size() for key, value in legacy)
+
+def pad_left(legacy, length):
+    """Zero-pad every layer on the left of the position axis up to ``length`` positions"""
+    missing = length - cache_length(legacy)
+    if missing <= 0:
+        return legacy
+    def pad(tensor):
+        shape = list(tensor.shape)
+        shape[-2] = missing
+        return torch.cat([tensor.new_zeros(shape), tensor], dim=-2)
+    return tuple((pad(key), pad(value)) for key, value in legacy)
+
+def concat_rows(first, second):
+    return tuple(
+        (torch.cat([k1, k2], dim=0), torch.cat([v1, v2], dim=0))
+        for (k1, v1), (k2, v2) in zip(first, second)
+    )
+
+def select_rows(legacy, rows):
+    index = torch.as_tensor(rows, dtype=torch.long, device=legacy[0][0].device)
+    return tuple((key.index_select(0, index), value.index_select(0, index)) for key, value in legacy)
+
+def expand_rows(legacy, batch_size):
+    """Repeat a single-row cache ``batch_size`` times (a view, no copy)"""
+    return tuple((key.expand(batch_size, -1, -1, -1), value.expand(batch_size, -1, -1, -1)) for key, value in legacy)
+
+def slice_positions(legacy, start=0, end=None):
+    return tuple((key[:, :, start:end], value[:, :, start:end]) for key, value in legacy)
+
+def layer_devices(legacy):
+    return [key.device for key, _ in legacy]
+
+def compact(legacy):
+    """Copies that own exactly their positions, so slices stop holding on to larger buffers"""
+    return tuple(
+        (key.clone(memory_format=torch.contiguous_format), value.clone(memory_format=torch.contiguous_format))
+        for key, value in legacy
+    )
+
+def to_device(legacy, device):
+    """Move every layer to ``device``, or layer i to ``device[i]`` for a list (models split across devices)"""
+    devices = device if isinstance(device, (list, tuple)) else [device] * len(legacy)
+    return tuple((key.to(d), value.to(d)) for (key, value), d in zip(legacy, devices))
@@ -1,10 +1,10 @@
 import time
 from configuration import DEVICE
 from model_loader import load_models
-from data_processor import initialize_data
+from data_processor import initialize_data, knowledge_base_version
 from mongo_manager import connect_to_mongodb
 from question_suggester import setup_question_suggestion
-from answer_generator import generate_answer
+from answer_generator import generate_answer, answer_cache
 
 def main():
     # Load models
@@ -15,10 +15,11 @@ def main():
 
     # Initialize data
     documents_data, bm25, collection_embeddings = initialize_data(bge_model, bge_tokenizer)
+    answer_cache.set_knowledge_base_version(knowledge_base_version())
 
     # Setup MongoDB and question suggestion
     connect_to_mongodb()
-    setup_question_suggestion()
+    setup_question_suggestion(bge_model, bge_tokenizer, dense_index=collection_embeddings)
 
     # Test queries
     conversation_id = f"test_priority_{int(time.time())}"
@@ -42,4 +43,4 @@ def main():
     time.sleep(1)
 
 if __name__ == "__main__":
-    main()s
\ No newline at end of file
+    main()
\ No newline at end of file
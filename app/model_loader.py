@@ -8,20 +8,19 @@ from transformers import (
     AutoModelForCausalLM, 
     BitsAndBytesConfig
 )
-from configuration import (
-    BGE_MODEL_NAME, 
-    RERANKER_MODEL_NAME, 
-    QWEN_MODEL_NAME, 
-    LLAMA_MODEL_NAME, 
-    GEMMA_MODEL_NAME, 
-    AVAILABLE_MODELS, 
-    HUGGINGFACE_TOKEN
-)
+from configuration import MODEL_CONFIG, API_KEYS
+from cpu_inference import resolve_loading_mode, configure_cpu_threads, quantizes_on_cpu, cpu_load_kwargs, finish_model
+from generation_service import close_generation_service
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BGE_MODEL_NAME = MODEL_CONFIG["BGE_MODEL_NAME"]
+RERANKER_MODEL_NAME = MODEL_CONFIG["RERANKER_MODEL_NAME"]
+QWEN_MODEL_NAME = MODEL_CONFIG["QWEN_MODEL_NAME"]
+HUGGINGFACE_TOKEN = API_KEYS["HUGGINGFACE_TOKEN"] or None
+
 # Device configuration
 if torch.cuda.is_available():
     device = torch.device("cuda")
@@ -33,15 +32,57 @@ else:
 def unload_model(model):
     """Unload model from GPU memory"""
     if model is not None:
+        close_generation_service(model)
         del model
         gc.collect()
         torch.cuda.empty_cache()
 
+def encoder_load_kwargs(torch_dtype=None, device_map='auto'):
+    """(``from_pretrained`` arguments, quantize) for the BGE and reranker models.
+
+    An explicit ``torch_dtype`` is always honoured; otherwise the loading mode
+    decides: float16 on GPU, the CPU dtype (or float32 plus int8) on CPU.
+    """
+    if resolve_loading_mode() == "gpu":
+        return {"torch_dtype": torch_dtype or torch.float16, "device_map": device_map}, False
+    configure_cpu_threads()
+    if torch_dtype is not None:
+        return {"torch_dtype": torch_dtype}, False
+    quantize = quantizes_on_cpu("encoder")
+    return cpu_load_kwargs(quantize), quantize
+
+def load_llm_model_cpu(model_name):
+    """Load an LLM for CPU inference: bf16/fp32 weights, optionally int8 Linear layers, no bitsandbytes"""
+    configure_cpu_threads()
+    quantize = quantizes_on_cpu("llm")
+    model_kwargs = dict(cpu_load_kwargs(quantize), trust_remote_code=True, local_files_only=True)
+    logger.info(f"Loading LLM model on CPU ({model_kwargs['torch_dtype']}{', int8 Linear' if quantize else ''}): {model_name}")
+    model = AutoModelForCausalLM.from_pretrained(model_name, **model_kwargs)
+    return finish_model(model, quantize)
+
+def load_llm_tokenizer(model_name):
+    """The LLM tokenizer; Gemma gets its EOS token as padding"""
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name,
+        trust_remote_code=True,
+        use_fast=False
+    )
+
+    # Ensure padding token for Gemma
+    if "gemma" in model_name.lower():
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
 def load_llm_model(model_name):
     """Load specific LLM model"""
     logger.info(f"Loading LLM model: {model_name}")
     try:
-        # Configure model loading
+        tokenizer = load_llm_tokenizer(model_name)
+        if resolve_loading_mode() == "cpu":
+            return load_llm_model_cpu(model_name), tokenizer
+
+        # Configure model loading (4-bit bitsandbytes needs CUDA)
         bnb_config = BitsAndBytesConfig(
             load_in_4bit=True,
             bnb_4bit_use_double_quant=True,
@@ -59,19 +100,7 @@ def load_llm_model(model_name):
         # Special handling for Gemma
         if "gemma" in model_name.lower():
             model_kwargs["torch_dtype"] = torch.float16
-            
-        # Load tokenizer
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_name,
-            trust_remote_code=True,
-            use_fast=False
-        )
-        
-        # Ensure padding token for Gemma
-        if "gemma" in model_name.lower():
-            if tokenizer.pad_token is None:
-                tokenizer.pad_token = tokenizer.eos_token
-                
+
         # Load model with appropriate configuration
         model = AutoModelForCausalLM.from_pretrained(
             model_name,
@@ -84,32 +113,45 @@ def load_llm_model(model_name):
         logger.error(f"Error loading LLM model {model_name}: {str(e)}")
         raise
 
+def load_bge_tokenizer():
+    logger.info(f"Loading BGE tokenizer: {BGE_MODEL_NAME}")
+    return AutoTokenizer.from_pretrained(BGE_MODEL_NAME, token=HUGGINGFACE_TOKEN)
+
+def load_bge_model(torch_dtype=None, device_map='auto'):
+    """Load the BGE embedding model and tokenizer (``torch_dtype=None``: chosen by the loading mode)"""
+    bge_tokenizer = load_bge_tokenizer()
+
+    logger.info(f"Loading BGE model: {BGE_MODEL_NAME}")
+    model_kwargs, quantize = encoder_load_kwargs(torch_dtype, device_map)
+    bge_model = AutoModel.from_pretrained(
+        BGE_MODEL_NAME,
+        token=HUGGINGFACE_TOKEN,
+        **model_kwargs
+    )
+    return finish_model(bge_model, quantize), bge_tokenizer
+
+def load_reranker_model():
+    """Load the cross-encoder reranker and its tokenizer"""
+    logger.info(f"Loading Reranker tokenizer: {RERANKER_MODEL_NAME}")
+    reranker_tokenizer = AutoTokenizer.from_pretrained(RERANKER_MODEL_NAME, token=HUGGINGFACE_TOKEN)
+
+    logger.info(f"Loading Reranker model: {RERANKER_MODEL_NAME}")
+    model_kwargs, quantize = encoder_load_kwargs()
+    reranker_model = AutoModelForSequenceClassification.from_pretrained(
+        RERANKER_MODEL_NAME,
+        token=HUGGINGFACE_TOKEN,
+        **model_kwargs
+    )
+    return finish_model(reranker_model, quantize), reranker_tokenizer
+
 def load_models(selected_model_name=QWEN_MODEL_NAME):
     logger.info("Loading models...")
     try:
         # Load BGE model
-        logger.info(f"Loading BGE tokenizer: {BGE_MODEL_NAME}")
-        bge_tokenizer = AutoTokenizer.from_pretrained(BGE_MODEL_NAME, token=HUGGINGFACE_TOKEN)
-        
-        logger.info(f"Loading BGE model: {BGE_MODEL_NAME}")
-        bge_model = AutoModel.from_pretrained(
-            BGE_MODEL_NAME,
-            token=HUGGINGFACE_TOKEN,
-            torch_dtype=torch.float16,  # Changed from bfloat16 to float16
-            device_map='auto'
-        ).eval()
+        bge_model, bge_tokenizer = load_bge_model()
         
         # Load Reranker model
-        logger.info(f"Loading Reranker tokenizer: {RERANKER_MODEL_NAME}")
-        reranker_tokenizer = AutoTokenizer.from_pretrained(RERANKER_MODEL_NAME, token=HUGGINGFACE_TOKEN)
-        
-        logger.info(f"Loading Reranker model: {RERANKER_MODEL_NAME}")
-        reranker_model = AutoModelForSequenceClassification.from_pretrained(
-            RERANKER_MODEL_NAME,
-            token=HUGGINGFACE_TOKEN,
-            torch_dtype=torch.float16,  # Changed from bfloat16 to float16
-            device_map='auto'
-        ).eval()
+        reranker_model, reranker_tokenizer = load_reranker_model()
         
         # Load LLM model
         llm_model, llm_tokenizer = load_llm_model(selected_model_name)
@@ -1,16 +1,16 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from datetime import datetime
-from configuration import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_NAME
+from configuration import DB_CONFIG
 
 def connect_to_mongodb():
     print("Connecting to MongoDB...")
     try:
-        mongo_client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
+        mongo_client = MongoClient(DB_CONFIG["MONGO_URI"], server_api=ServerApi('1'))
         mongo_client.admin.command('ping')
         print("Pinged MongoDB deployment. Successfully connected!")
-        db = mongo_client[MONGO_DB_NAME]
-        collection_history = db[MONGO_COLLECTION_NAME]
+        db = mongo_client[DB_CONFIG["MONGO_DB_NAME"]]
+        collection_history = db[DB_CONFIG["MONGO_COLLECTION"]]
         return collection_history
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
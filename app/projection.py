@@ -0,0 +1,148 @@
+import json
+import os
+import numpy as np
+from dense_index import DenseIndex, INDEX_META_FILE, normalize_rows, top_k_indices
+
+# ========== Constants ==========
+PROJECTION_FILE = "projection.npz"
+PROJECTED_FILE = "projected.bin"
+DEFAULT_RESCORE_MULTIPLIER = 4
+SUPPORTED_PROJECTIONS = ("pca", "truncate")
+PCA_SAMPLE_ROWS = 50000
+FIT_BLOCK_ROWS = 16384
+
+class Projection:
+    """Linear map from full embeddings to ``dim`` dimensions: ``(x - mean) @ components``.
+
+    Fitted once at ingestion time and stored next to the index, so corpus and
+    query embeddings always go through the same map. Outputs are L2-normalized.
+    """
+
+    def __init__(self, method, mean, components):
+        self.method = method
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+
+    @property
+    def dim(self):
+        return self.components.shape[1]
+
+    @classmethod
+    def truncate(cls, source_dim, dim):
+        """Keep the leading ``dim`` dimensions"""
+        return cls("truncate", np.zeros(source_dim, dtype=np.float32), np.eye(source_dim, dim, dtype=np.float32))
+
+    @classmethod
+    def fit_pca(cls, vectors, dim, sample_rows=PCA_SAMPLE_ROWS, seed=0):
+        """Principal components of a row sample of ``vectors`` (may be memory-mapped)"""
+        count, source_dim = vectors.shape
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(count, min(count, sample_rows), replace=False))
+        mean = np.zeros(source_dim, dtype=np.float64)
+        for start in range(0, rows.size, FIT_BLOCK_ROWS):
+            mean += normalize_rows(vectors[rows[start:start + FIT_BLOCK_ROWS]]).sum(axis=0)
+        mean /= max(rows.size, 1)
+        covariance = np.zeros((source_dim, source_dim), dtype=np.float64)
+        for start in range(0, rows.size, FIT_BLOCK_ROWS):
+            block = normalize_rows(vectors[rows[start:start + FIT_BLOCK_ROWS]]) - mean
+            covariance += block.T @ block
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        top = np.argsort(eigenvalues)[::-1][:dim]
+        return cls("pca", mean, eigenvectors[:, top])
+
+    @classmethod
+    def fit(cls, method, vectors, dim):
+        if method not in SUPPORTED_PROJECTIONS:
+            raise ValueError(f"Unsupported projection: {method}")
+        if not 0 < dim <= vectors.shape[1]:
+            raise ValueError(f"Projection dimension must be in [1, {vectors.shape[1]}], got {dim}")
+        if method == "truncate" or vectors.shape[0] == 0:
+            return cls.truncate(vectors.shape[1], dim)
+        return cls.fit_pca(vectors, dim)
+
+    def apply(self, vectors):
+        return normalize_rows((normalize_rows(vectors) - self.mean) @ self.components)
+
+    def save(self, path):
+        np.savez(os.path.join(path, PROJECTION_FILE), method=self.method, mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(os.path.join(path, PROJECTION_FILE)) as stored:
+            return cls(str(stored["method"]), stored["mean"], stored["components"])
+
+class ProjectedIndex(DenseIndex):
+    """``DenseIndex`` whose first-pass scan runs over projected, lower-dimensional rows.
+
+    ``projected.bin`` holds every row mapped through the stored ``Projection``;
+    queries go through the same map, so a scan moves ``dim / source dim`` of
+    the bytes of a full scan. With ``rescore_multiplier`` > 0 the best
+    ``k * rescore_multiplier`` rows are rescored against the full float rows
+    (exact scores); with 0 the projected cosine similarities are returned as-is.
+    """
+
+    def __init__(self, embeddings, documents, path=None, meta=None, projected=None, projection=None, rescore_multiplier=DEFAULT_RESCORE_MULTIPLIER):
+        super().__init__(embeddings, documents, path=path, meta=meta)
+        self.projected = projected
+        self.projection = projection
+        self.rescore_multiplier = rescore_multiplier
+
+    # ========== Persistence ==========
+    @staticmethod
+    def exists(path):
+        return DenseIndex.exists(path) and os.path.exists(os.path.join(path, PROJECTION_FILE))
+
+    @classmethod
+    def build(cls, path, embeddings, documents, dtype="float32", extra_meta=None, method="pca", dim=256):
+        DenseIndex.build(path, embeddings, documents, dtype=dtype, extra_meta=extra_meta)
+        return cls.project(path, method, dim)
+
+    @classmethod
+    def project(cls, path, method="pca", dim=256):
+        """Fit a projection on an index already written at ``path`` and store the projected rows"""
+        flat = DenseIndex.load(path)
+        projection = Projection.fit(method, flat.embeddings, dim)
+        projection.save(path)
+        with open(os.path.join(path, PROJECTED_FILE), "wb") as f:
+            for start in range(0, len(flat), FIT_BLOCK_ROWS):
+                projection.apply(flat.embeddings[start:start + FIT_BLOCK_ROWS]).astype(np.float32).tofile(f)
+
+        meta = dict(flat.meta, projection={"method": method, "dim": dim})
+        with open(os.path.join(path, INDEX_META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        print(f"Projected dense index at {path} to {dim} dimensions ({method}).")
+        del flat
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        index = super().load(path)
+        index.projection = Projection.load(path)
+        shape = (len(index), index.projection.dim)
+        if len(index):
+            index.projected = np.memmap(os.path.join(path, PROJECTED_FILE), dtype=np.float32, mode="r", shape=shape)
+        else:
+            index.projected = np.zeros(shape, dtype=np.float32)
+        return index
+
+    def scan_bytes(self):
+        """Bytes scanned by the first pass over the whole corpus"""
+        return int(self.projected.size * self.projected.itemsize)
+
+    # ========== Search ==========
+    def search(self, query_embedding, k, rescore_multiplier=None):
+        rows, scores = self.search_many(query_embedding, k, rescore_multiplier=rescore_multiplier)
+        return rows[0], scores[0]
+
+    def search_many(self, query_embeddings, k, rescore_multiplier=None):
+        queries = normalize_rows(query_embeddings)
+        k = min(k, len(self))
+        if k <= 0:
+            empty = (queries.shape[0], 0)
+            return np.empty(empty, dtype=np.int64), np.empty(empty, dtype=np.float32)
+        approximate = self.projection.apply(queries) @ self.projected.T
+        multiplier = self.rescore_multiplier if rescore_multiplier is None else rescore_multiplier
+        if multiplier > 0:
+            return self.rescore(queries, approximate, k, min(len(self), k * multiplier))
+        rows = np.stack([top_k_indices(scores, k) for scores in approximate])
+        return rows, np.take_along_axis(approximate, rows, axis=1)
@@ -0,0 +1,196 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+import torch
+from kv_cache import to_legacy, to_model_cache, slice_positions, cache_length, cache_nbytes, layer_devices, to_device
+
+def common_prefix_length(first, second):
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return length
+
+@torch.no_grad()
+def extend_past(model, token_ids, past=None):
+    """Past key/values after running ``token_ids`` through ``model`` on top of ``past`` (legacy layout)"""
+    if not token_ids:
+        return past
+    input_ids = torch.tensor([token_ids], dtype=torch.long, device=getattr(model, "device", None))
+    outputs = model(
+        input_ids=input_ids,
+        past_key_values=to_model_cache(past) if past is not None else None,
+        use_cache=True
+    )
+    return to_legacy(outputs.past_key_values)
+
+def reuse_past(token_ids, cached_ids, cached_past):
+    """(past, n): the first n positions of ``cached_past`` that ``token_ids`` shares.
+
+    At least the last prompt token is always left to run, since its logits
+    start the generation. Returns (None, 0) when nothing is shared.
+    """
+    if cached_past is None:
+        return None, 0
+    length = min(common_prefix_length(cached_ids, token_ids), len(token_ids) - 1, cache_length(cached_past))
+    if length <= 0:
+        return None, 0
+    return slice_positions(cached_past, 0, length), length
+
+class StaticPrefixCache:
+    """Past key/values of each loaded model's static prompt prefix.
+
+    Computed on first use and kept for as long as the model is loaded; a
+    different prefix (e.g. after a prompt change) replaces the entry.
+    """
+
+    def __init__(self):
+        self._entries = weakref.WeakKeyDictionary()  # model -> (prefix token ids, past)
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+
+    def get(self, model, prefix_ids):
+        """(prefix token ids, past key/values) for ``model``"""
+        prefix_ids = list(prefix_ids)
+        with self._lock:
+            entry = self._entries.get(model)
+            if entry is not None and entry[0] == prefix_ids:
+                self.hits += 1
+                return entry
+            entry = (prefix_ids, extend_past(model, prefix_ids))
+            self._entries[model] = entry
+            self.builds += 1
+            return entry
+
+class ConversationKVCache:
+    """Token ids and past key/values of each conversation's last prompt and answer.
+
+    Entries stay where the model produced them (GPU or host memory) up to
+    ``max_bytes``. Least recently used entries beyond that are moved to the
+    spill tier: host RAM (``"cpu"``), ``torch.save`` files under ``spill_dir``
+    (``"disk"``), or nowhere (``"none"``), holding at most ``spill_max_bytes``.
+    A spilled entry is moved back on its next use.
+    """
+
+    def __init__(self, max_bytes, spill="disk", spill_max_bytes=0, spill_dir=None):
+        if spill not in ("cpu", "disk", "none"):
+            raise ValueError(f"Unsupported spill tier: {spill}")
+        if spill == "disk" and not spill_dir:
+            raise ValueError("spill_dir is required to spill to disk")
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.spill_max_bytes = spill_max_bytes
+        self.spill_dir = spill_dir
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.evictions = 0
+        self._resident = OrderedDict()  # conversation id -> entry dict
+        self._spilled = OrderedDict()
+        self._resident_bytes = 0
+        self._spilled_bytes = 0
+        self._lock = threading.Lock()
+        if spill == "disk" and os.path.isdir(spill_dir):
+            # Spill files of a previous process are unreachable: their index lived in its memory
+            for name in os.listdir(spill_dir):
+                if name.endswith(".pt"):
+                    self._remove_file({"path": os.path.join(spill_dir, name)})
+
+    def get(self, conversation_id, model_id):
+        """(token ids, past) stored for the conversation by the same model, or None"""
+        with self._lock:
+            entry = self._pop(conversation_id)
+            if entry is None or entry["model_id"] != model_id:
+                self.misses += 1
+                return None
+            if "path" in entry:
+                try:
+                    entry["past"] = torch.load(entry["path"], map_location="cpu")["past"]
+                except (OSError, RuntimeError):
+                    self.misses += 1
+                    return None
+                finally:
+                    self._remove_file(entry)
+            entry["past"] = to_device(entry["past"], entry["devices"])
+            self._insert(conversation_id, entry)
+            self.hits += 1
+            return entry["ids"], entry["past"]
+
+    def put(self, conversation_id, model_id, token_ids, past):
+        with self._lock:
+            self._remove_file(self._pop(conversation_id))
+            entry = {
+                "model_id": model_id, "ids": list(token_ids), "past": past,
+                "devices": layer_devices(past), "nbytes": cache_nbytes(past)
+            }
+            self._insert(conversation_id, entry)
+
+    def discard(self, conversation_id):
+        with self._lock:
+            self._remove_file(self._pop(conversation_id))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "resident": len(self._resident),
+                "resident_bytes": self._resident_bytes,
+                "spilled": len(self._spilled),
+                "spilled_bytes": self._spilled_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "spills": self.spills,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    # ========== Tiers (called with the lock held) ==========
+    def _pop(self, conversation_id):
+        entry = self._resident.pop(conversation_id, None)
+        if entry is not None:
+            self._resident_bytes -= entry["nbytes"]
+            return entry
+        entry = self._spilled.pop(conversation_id, None)
+        if entry is not None:
+            self._spilled_bytes -= entry["nbytes"]
+        return entry
+
+    def _insert(self, conversation_id, entry):
+        self._resident[conversation_id] = entry
+        self._resident_bytes += entry["nbytes"]
+        while self._resident_bytes > self.max_bytes:
+            oldest_id, oldest = self._resident.popitem(last=False)
+            self._resident_bytes -= oldest["nbytes"]
+            self._spill(oldest_id, oldest)
+
+    def _spill(self, conversation_id, entry):
+        if self.spill == "none" or entry["nbytes"] > self.spill_max_bytes:
+            self.evictions += 1
+            return
+        if self.spill == "cpu":
+            entry["past"] = to_device(entry["past"], "cpu")
+        else:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, hashlib.sha1(conversation_id.encode("utf-8")).hexdigest() + ".pt")
+            torch.save({"past": to_device(entry.pop("past"), "cpu")}, path)
+            entry["path"] = path
+        self._spilled[conversation_id] = entry
+        self._spilled_bytes += entry["nbytes"]
+        self.spills += 1
+        while self._spilled_bytes > self.spill_max_bytes:
+            _, oldest = self._spilled.popitem(last=False)
+            self._spilled_bytes -= oldest["nbytes"]
+            self._remove_file(oldest)
+            self.evictions += 1
+
+    @staticmethod
+    def _remove_file(entry):
+        if entry is not None and "path" in entry:
+            try:
+                os.remove(entry.pop("path"))
+            except OSError:
+                pass
@@ -0,0 +1,147 @@
+import json
+import os
+import numpy as np
+from dense_index import DenseIndex, INDEX_META_FILE, normalize_rows
+
+# ========== Constants ==========
+CODES_FILE = "codes.bin"
+SCALES_FILE = "scales.npy"
+SUPPORTED_QUANTIZATIONS = ("int8", "binary")
+DEFAULT_RESCORE_MULTIPLIER = 4
+CODE_SCAN_BLOCK_ROWS = 16384
+# int8 blocks are upcast to float32 for BLAS; small blocks keep that temporary in cache
+INT8_SCAN_BLOCK_ROWS = 1024
+# Popcount of every byte value, for numpy builds without np.bitwise_count
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+def _popcount(bits):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits)
+    return _POPCOUNT[bits]
+
+def quantize_int8(vectors, scales):
+    """Symmetric per-dimension int8 codes: round(x / scale) clipped to [-127, 127]"""
+    return np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+
+def quantize_binary(vectors):
+    """One sign bit per dimension, packed 8 dimensions per byte"""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+class QuantizedIndex(DenseIndex):
+    """``DenseIndex`` whose first-pass scan runs over compact codes.
+
+    Every row also has an int8 (1 byte/dim) or binary (1 bit/dim) code. A query
+    scans only the codes, keeps the ``k * rescore_multiplier`` best rows and
+    rescores those against the float rows of the memory-mapped
+    ``embeddings.bin``, which are read lazily. Returned scores are exact cosine
+    similarities; only the candidate set is approximate.
+    """
+
+    def __init__(self, embeddings, documents, path=None, meta=None, codes=None, scales=None, rescore_multiplier=DEFAULT_RESCORE_MULTIPLIER):
+        super().__init__(embeddings, documents, path=path, meta=meta)
+        self.codes = codes
+        self.scales = scales
+        self.rescore_multiplier = rescore_multiplier
+
+    @property
+    def quantization(self):
+        return self.meta.get("quantization")
+
+    # ========== Persistence ==========
+    @staticmethod
+    def exists(path):
+        return DenseIndex.exists(path) and os.path.exists(os.path.join(path, CODES_FILE))
+
+    @classmethod
+    def build(cls, path, embeddings, documents, dtype="float32", extra_meta=None, quantization="int8"):
+        DenseIndex.build(path, embeddings, documents, dtype=dtype, extra_meta=extra_meta)
+        return cls.quantize(path, quantization)
+
+    @classmethod
+    def quantize(cls, path, quantization="int8"):
+        """Add codes to an index already written at ``path`` and load it as a ``QuantizedIndex``.
+
+        The float rows are read in blocks, so this works on indexes larger than memory.
+        """
+        if quantization not in SUPPORTED_QUANTIZATIONS:
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        flat = DenseIndex.load(path)
+        count = len(flat)
+
+        scales = None
+        if quantization == "int8":
+            max_abs = np.zeros(flat.dim, dtype=np.float32)
+            for start in range(0, count, CODE_SCAN_BLOCK_ROWS):
+                block = np.asarray(flat.embeddings[start:start + CODE_SCAN_BLOCK_ROWS], dtype=np.float32)
+                np.maximum(max_abs, np.abs(block).max(axis=0), out=max_abs)
+            scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+            np.save(os.path.join(path, SCALES_FILE), scales)
+
+        with open(os.path.join(path, CODES_FILE), "wb") as f:
+            for start in range(0, count, CODE_SCAN_BLOCK_ROWS):
+                block = np.asarray(flat.embeddings[start:start + CODE_SCAN_BLOCK_ROWS], dtype=np.float32)
+                codes = quantize_int8(block, scales) if quantization == "int8" else quantize_binary(block)
+                codes.tofile(f)
+
+        meta = dict(flat.meta, quantization=quantization)
+        with open(os.path.join(path, INDEX_META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        print(f"Quantized dense index at {path} to {quantization} codes.")
+        del flat
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        index = super().load(path)
+        quantization = index.meta["quantization"]
+        if quantization == "int8":
+            code_shape, code_dtype = (len(index), index.dim), np.int8
+            index.scales = np.load(os.path.join(path, SCALES_FILE))
+        else:
+            code_shape, code_dtype = (len(index), (index.dim + 7) // 8), np.uint8
+        if len(index):
+            index.codes = np.memmap(os.path.join(path, CODES_FILE), dtype=code_dtype, mode="r", shape=code_shape)
+        else:
+            index.codes = np.zeros(code_shape, dtype=code_dtype)
+        return index
+
+    def scan_bytes(self):
+        """Bytes scanned by the first pass over the whole corpus"""
+        return int(self.codes.size * self.codes.itemsize)
+
+    # ========== Search ==========
+    def code_scores(self, query_embeddings):
+        """First-pass scores (higher is better) of every row for every query, from the codes only"""
+        queries = normalize_rows(query_embeddings)
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        if self.quantization == "int8":
+            # Asymmetric: float query against int8 codes, folding the per-dimension scales into the query
+            scaled = (queries * self.scales).T
+            for start in range(0, len(self), INT8_SCAN_BLOCK_ROWS):
+                block = np.asarray(self.codes[start:start + INT8_SCAN_BLOCK_ROWS], dtype=np.float32)
+                scores[:, start:start + INT8_SCAN_BLOCK_ROWS] = (block @ scaled).T
+        else:
+            query_codes = quantize_binary(queries)
+            for start in range(0, len(self), CODE_SCAN_BLOCK_ROWS):
+                block = np.asarray(self.codes[start:start + CODE_SCAN_BLOCK_ROWS])
+                for q, query_code in enumerate(query_codes):
+                    hamming = _popcount(block ^ query_code).sum(axis=1, dtype=np.int32)
+                    scores[q, start:start + CODE_SCAN_BLOCK_ROWS] = -hamming
+        return scores
+
+    def search(self, query_embedding, k, rescore_multiplier=None):
+        rows, scores = self.search_many(query_embedding, k, rescore_multiplier=rescore_multiplier)
+        return rows[0], scores[0]
+
+    def search_many(self, query_embeddings, k, rescore_multiplier=None):
+        """Code scan, then exact float rescoring of the best ``k * rescore_multiplier`` rows per query"""
+        queries = normalize_rows(query_embeddings)
+        k = min(k, len(self))
+        if k <= 0:
+            empty = (queries.shape[0], 0)
+            return np.empty(empty, dtype=np.int64), np.empty(empty, dtype=np.float32)
+        multiplier = self.rescore_multiplier if rescore_multiplier is None else rescore_multiplier
+        if multiplier < 1:
+            raise ValueError(f"rescore_multiplier must be at least 1, got {multiplier}")
+        n_rescore = min(len(self), k * multiplier)
+        return self.rescore(queries, self.code_scores(queries), k, n_rescore)
@@ -1,66 +1,247 @@
-import chromadb
+import hashlib
+import os
 import re
-from chromadb.utils import embedding_functions
-from configuration import CHROMA_QUESTION_DB_PATH, BGE_MODEL_NAME, QUESTION_FILE_PATH
+import numpy as np
+from configuration import DATA_CONFIG, CACHE_CONFIG
+from embedding_utils import generate_embeddings, get_model_id, embed_queries
+from dense_index import DenseIndex, normalize_rows
 
-def setup_question_suggestion():
+# ========== Constants ==========
+GRAPH_BLOCK_ROWS = 16384
+SUGGESTION_SOURCE_RESULTS = 3  # retrieved passages whose related questions are merged
+
+# Set by setup_question_suggestion; nothing is loaded at import time
+question_index = None
+question_graph = None
+_encoder = None
+
+def clean_question(question):
+    return re.sub(r"^Câu \d+: ", "", question).strip()
+
+def _fingerprint(question_file, model):
+    """Changes whenever the question file or the encoder does"""
+    digest = hashlib.sha256(get_model_id(model).encode("utf-8"))
+    with open(question_file, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+class QuestionIndex:
+    """Suggestion questions and their L2-normalized BGE embeddings, held as one matrix"""
+
+    def __init__(self, questions, embeddings, fingerprint=None):
+        self.questions = list(questions)
+        self.embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        self.fingerprint = fingerprint
+        self.position = {question.lower(): i for i, question in enumerate(self.questions)}
+
+    def __len__(self):
+        return len(self.questions)
+
+    @classmethod
+    def build(cls, questions, model, tokenizer, fingerprint=None):
+        print(f"Embedding {len(questions)} suggestion questions...")
+        embeddings = generate_embeddings(questions, model, tokenizer).float().numpy()
+        return cls([clean_question(q) for q in questions], embeddings, fingerprint)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, questions=np.array(self.questions), embeddings=self.embeddings, fingerprint=self.fingerprint)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """The saved index, or None when it is missing or was built from other questions or another encoder"""
+        try:
+            with np.load(path) as stored:
+                if str(stored["fingerprint"]) != fingerprint:
+                    return None
+                return cls(stored["questions"].tolist(), stored["embeddings"], fingerprint)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def similarities(self, query_embedding):
+        return self.embeddings @ normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+
+    def nearest(self, query_embedding, top_k, exclude=()):
+        """The ``top_k`` most similar questions whose lowercased text is not in ``exclude``"""
+        suggestions = []
+        for i in np.argsort(-self.similarities(query_embedding)).tolist():
+            if self.questions[i].lower() not in exclude:
+                suggestions.append(self.questions[i])
+                if len(suggestions) == top_k:
+                    break
+        return suggestions
+
+def _neighbour_table(vectors, question_embeddings, n, skip_self=False):
+    """Indices and similarities of the ``n`` most similar questions for every row of ``vectors``.
+
+    With ``skip_self``, row i of ``vectors`` is question i and is not its own neighbour.
+    """
+    indices = np.empty((len(vectors), n), dtype=np.int32)
+    scores = np.empty((len(vectors), n), dtype=np.float32)
+    for start in range(0, len(vectors), GRAPH_BLOCK_ROWS):
+        block = normalize_rows(vectors[start:start + GRAPH_BLOCK_ROWS]) @ question_embeddings.T
+        if skip_self:
+            block[np.arange(block.shape[0]), start + np.arange(block.shape[0])] = -np.inf
+        top = np.argsort(-block, axis=1, kind="stable")[:, :n]
+        indices[start:start + block.shape[0]] = top
+        scores[start:start + block.shape[0]] = np.take_along_axis(block, top, axis=1)
+    return indices, scores
+
+class QuestionGraph:
+    """Precomputed top-N related questions of every suggestion question and knowledge-base chunk.
+
+    Built once per (questions, encoder, dense index) and persisted, so a turn
+    looks suggestions up by the ids of its retrieved passages instead of
+    running a vector query.
+    """
+
+    def __init__(self, question_neighbours, question_scores, chunk_ids, chunk_neighbours, chunk_scores, fingerprint=None):
+        self.question_neighbours = question_neighbours
+        self.question_scores = question_scores
+        self.chunk_ids = list(chunk_ids)
+        self.chunk_neighbours = chunk_neighbours
+        self.chunk_scores = chunk_scores
+        self.fingerprint = fingerprint
+        self.chunk_row = {doc_id: row for row, doc_id in enumerate(self.chunk_ids)}
+
+    @staticmethod
+    def fingerprint_for(question_index, dense_index, n_neighbours):
+        digest = hashlib.sha256(f"{question_index.fingerprint}:{n_neighbours}".encode("utf-8"))
+        if dense_index is not None:
+            digest.update("\n".join(dense_index.ids).encode("utf-8"))
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, question_index, dense_index=None, n_neighbours=None, fingerprint=None):
+        n_neighbours = n_neighbours or CACHE_CONFIG["QUESTION_NEIGHBOURS"]
+        questions = question_index.embeddings
+        question_neighbours, question_scores = _neighbour_table(
+            questions, questions, min(n_neighbours, len(question_index) - 1), skip_self=True
+        )
+        if dense_index is None:
+            chunk_ids = []
+            chunk_neighbours = np.zeros((0, question_neighbours.shape[1]), dtype=np.int32)
+            chunk_scores = np.zeros((0, question_neighbours.shape[1]), dtype=np.float32)
+        else:
+            print(f"Linking {len(dense_index)} chunks to their {n_neighbours} most related questions...")
+            chunk_ids = dense_index.ids
+            chunk_neighbours, chunk_scores = _neighbour_table(dense_index.embeddings, questions, min(n_neighbours, len(question_index)))
+        return cls(question_neighbours, question_scores, chunk_ids, chunk_neighbours, chunk_scores, fingerprint)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path, question_neighbours=self.question_neighbours, question_scores=self.question_scores,
+            chunk_ids=np.array(self.chunk_ids, dtype=str), chunk_neighbours=self.chunk_neighbours,
+            chunk_scores=self.chunk_scores, fingerprint=self.fingerprint
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """The saved graph, or None when it is missing or stale"""
+        try:
+            with np.load(path) as stored:
+                if str(stored["fingerprint"]) != fingerprint:
+                    return None
+                return cls(
+                    stored["question_neighbours"], stored["question_scores"], stored["chunk_ids"].tolist(),
+                    stored["chunk_neighbours"], stored["chunk_scores"], fingerprint
+                )
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def related(self, question_position=None, results=None):
+        """Related question indices, best first, for a known question or for retrieved passages.
+
+        A passage is looked up by its id, then (for whole-section results) by
+        the ids of its retrieved windows. Returns [] when nothing is in the table.
+        """
+        if question_position is not None:
+            return self.question_neighbours[question_position].tolist()
+        best = {}
+        for res in (results or [])[:SUGGESTION_SOURCE_RESULTS]:
+            for doc_id in [res["id"], *res.get("windows", ())]:
+                row = self.chunk_row.get(doc_id)
+                if row is None:
+                    continue
+                for i, score in zip(self.chunk_neighbours[row].tolist(), self.chunk_scores[row].tolist()):
+                    best[i] = max(best.get(i, -np.inf), score)
+                break
+        return sorted(best, key=best.get, reverse=True)
+
+def _load_question_graph(index, dense_index, graph_path):
+    fingerprint = QuestionGraph.fingerprint_for(index, dense_index, CACHE_CONFIG["QUESTION_NEIGHBOURS"])
+    graph = QuestionGraph.load(graph_path, fingerprint)
+    if graph is None:
+        graph = QuestionGraph.build(index, dense_index, fingerprint=fingerprint)
+        graph.save(graph_path)
+        print(f"Saved related-question table for {len(index)} questions and {len(graph.chunk_ids)} chunks to {graph_path}.")
+    else:
+        print(f"Loaded related-question table from {graph_path}.")
+    return graph
+
+def setup_question_suggestion(bge_model, bge_tokenizer, dense_index=None, question_file=None, index_path=None, graph_path=None):
+    """Load (or embed once with the shared BGE model) the suggestion question index.
+
+    With the in-process ``dense_index`` of the knowledge base, the related
+    questions of every chunk are precomputed as well (not for the chroma backend).
+    """
+    global question_index, question_graph, _encoder
+    question_file = question_file or DATA_CONFIG["QUESTIONS"]
+    index_path = index_path or CACHE_CONFIG["QUESTION_INDEX_PATH"]
+    graph_path = graph_path or CACHE_CONFIG["QUESTION_GRAPH_PATH"]
+    if not isinstance(dense_index, DenseIndex):
+        dense_index = None
     print("Setting up question suggestion...")
     try:
-        chroma_client_q = chromadb.PersistentClient(path=CHROMA_QUESTION_DB_PATH)
-        q_embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=BGE_MODEL_NAME)
-        collection_question = chroma_client_q.get_or_create_collection(
-            name="suggested_questions_bge_v1",
-            embedding_function=q_embedding_function
-        )
-        with open(QUESTION_FILE_PATH, "r", encoding="utf-8") as f:
-            question_list = [line.strip() for line in f if line.strip()]
-        existing_q_ids = collection_question.get(ids=[str(i) for i in range(len(question_list))])['ids']
-        questions_to_add = []
-        q_ids_to_add = []
-        if len(existing_q_ids) < len(question_list):
-            print(f"Adding {len(question_list) - len(existing_q_ids)} missing questions for suggestion...")
-            for i, q in enumerate(question_list):
-                q_id = str(i)
-                if q_id not in existing_q_ids:
-                    q_ids_to_add.append(q_id)
-                    questions_to_add.append(q)
-            if q_ids_to_add:
-                try:
-                    collection_question.add(ids=q_ids_to_add, documents=questions_to_add)
-                    print(f"Added {len(q_ids_to_add)} questions.")
-                except Exception as e:
-                    print(f"Error adding questions: {e}")
+        fingerprint = _fingerprint(question_file, bge_model)
+        index = QuestionIndex.load(index_path, fingerprint)
+        if index is None:
+            with open(question_file, "r", encoding="utf-8") as f:
+                question_list = [line.strip() for line in f if line.strip()]
+            index = QuestionIndex.build(question_list, bge_model, bge_tokenizer, fingerprint)
+            index.save(index_path)
+            print(f"Saved {len(index)} question embeddings to {index_path}.")
         else:
-            print("All suggested questions already exist.")
-        return collection_question
+            print(f"Loaded {len(index)} question embeddings from {index_path}.")
+        question_index, _encoder = index, (bge_model, bge_tokenizer)
+        question_graph = _load_question_graph(index, dense_index, graph_path)
+        return index
     except FileNotFoundError:
-        print(f"Error: Question file not found: {QUESTION_FILE_PATH}")
+        print(f"Error: Question file not found: {question_file}")
         return None
     except Exception as e:
         print(f"Error setting up question suggestion: {e}")
         return None
 
-collection_question = setup_question_suggestion()
+def suggest_questions(query_text, history, top_k=3, query_embedding=None, results=None):
+    """Questions related to the query, skipping ones already asked in this conversation.
 
-def clean_question(question):
-    return re.sub(r"^Câu \d+: ", "", question).strip()
-
-def suggest_questions(query_text, history, top_k=3):
-    if not collection_question:
+    Suggestions are looked up in the precomputed table: by the query itself
+    when it is one of the suggestion questions, else by the retrieved
+    ``results``. Only on a miss does it fall back to a vector query, using the
+    BGE ``query_embedding`` computed for retrieval when given.
+    """
+    if question_index is None:
         return []
     try:
-        results = collection_question.query(query_texts=[query_text], n_results=top_k + 5)
-        suggested_questions_raw = results["documents"][0] if results["documents"] else []
-        asked_questions_texts = {msg["text"].strip().lower() for msg in history if msg["role"] == "user"}
-        asked_questions_texts.add(query_text.strip().lower())
-        filtered_questions = []
-        for q_raw in suggested_questions_raw:
-            q_clean = clean_question(q_raw)
-            if q_clean.strip().lower() not in asked_questions_texts:
-                filtered_questions.append(q_clean)
-                if len(filtered_questions) == top_k:
-                    break
-        return filtered_questions
+        asked_questions_texts = {clean_question(msg["text"]).lower() for msg in history if msg["role"] == "user"}
+        asked_questions_texts.add(clean_question(query_text).lower())
+        suggestions = []
+        if question_graph is not None:
+            position = question_index.position.get(clean_question(query_text).lower())
+            for i in question_graph.related(position, results):
+                if question_index.questions[i].lower() not in asked_questions_texts:
+                    suggestions.append(question_index.questions[i])
+                    if len(suggestions) == top_k:
+                        return suggestions
+
+        if query_embedding is None:
+            query_embedding = embed_queries([query_text], *_encoder)[0]
+        exclude = asked_questions_texts | {q.lower() for q in suggestions}
+        return suggestions + question_index.nearest(query_embedding, top_k - len(suggestions), exclude=exclude)
     except Exception as e:
         print(f"Error suggesting questions: {e}")
-        return []
\ No newline at end of file
+        return []
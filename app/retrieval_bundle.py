@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from bm25_index import BM25Index
+from dense_index import DenseIndex
+from ann_index import IVFIndex
+from quantized_index import QuantizedIndex
+from projection import ProjectedIndex
+
+# ========== Constants ==========
+# Bump whenever the on-disk layout below changes
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+DOCUMENTS_FILE = "documents.jsonl"
+BM25_DIR = "bm25"
+DENSE_DIR = "dense"
+HASH_BLOCK_BYTES = 1 << 20
+
+def compute_input_hash(input_paths, settings):
+    """Hash of the knowledge-base files plus every setting that shapes the bundle"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"format": BUNDLE_FORMAT_VERSION, **settings}, sort_keys=True).encode("utf-8"))
+    for path in sorted(input_paths):
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def load_bundle(path, input_hash=None):
+    """Load (documents_data, bm25, dense_index) from a bundle.
+
+    Returns None when the bundle is missing, was written by another format
+    version, or (if ``input_hash`` is given) was built from different inputs.
+    BM25 arrays and embeddings are memory-mapped.
+    """
+    manifest = read_manifest(path)
+    if manifest is None or manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        return None
+    if input_hash is not None and manifest.get("input_hash") != input_hash:
+        return None
+
+    with open(os.path.join(path, DOCUMENTS_FILE), "r", encoding="utf-8") as f:
+        documents_data = [json.loads(line) for line in f if line.strip()]
+    bm25 = BM25Index.load(os.path.join(path, BM25_DIR)) if manifest.get("has_bm25") else None
+    if manifest.get("dense_backend") == "ivf":
+        index_cls = IVFIndex
+    elif manifest.get("dense_quantization", "none") != "none":
+        index_cls = QuantizedIndex
+    elif manifest.get("dense_projection"):
+        index_cls = ProjectedIndex
+    else:
+        index_cls = DenseIndex
+    dense_index = index_cls.load(os.path.join(path, DENSE_DIR))
+    return documents_data, bm25, dense_index
+
+def begin_bundle(path):
+    """Create an empty staging directory next to ``path`` for a new bundle"""
+    staging = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    return staging
+
+def commit_bundle(path, staging, input_hash, document_count, has_bm25, dense_backend, dense_quantization="none", dense_projection=None, settings=None):
+    """Write the manifest into a filled staging directory and swap it in atomically.
+
+    The manifest is written last, so a bundle interrupted mid-write is never loaded.
+    """
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "input_hash": input_hash,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "document_count": document_count,
+        "has_bm25": has_bm25,
+        "dense_backend": dense_backend,
+        "dense_quantization": dense_quantization,
+        "dense_projection": dense_projection,
+        "settings": settings or {},
+    }
+    with open(os.path.join(staging, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    backup = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.replace(path, backup)
+    os.replace(staging, path)
+    shutil.rmtree(backup, ignore_errors=True)
+    print(f"Retrieval bundle written to {path} ({document_count} documents).")
+    return load_bundle(path)
+
+def write_bundle(path, input_hash, documents_data, bm25, build_dense_index, settings=None):
+    """Write a complete bundle next to ``path`` and swap it in atomically.
+
+    ``build_dense_index(dense_path)`` must build the dense index inside the
+    given directory and return it.
+    """
+    staging = begin_bundle(path)
+    with open(os.path.join(staging, DOCUMENTS_FILE), "w", encoding="utf-8") as f:
+        for doc in documents_data:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+    if bm25 is not None:
+        bm25.save(os.path.join(staging, BM25_DIR))
+    dense_index = build_dense_index(os.path.join(staging, DENSE_DIR))
+    return commit_bundle(
+        path, staging, input_hash, len(documents_data),
+        has_bm25=bm25 is not None,
+        dense_backend="ivf" if isinstance(dense_index, IVFIndex) else "numpy",
+        dense_quantization=dense_index.meta.get("quantization", "none"),
+        dense_projection=dense_index.meta.get("projection"),
+        settings=settings
+    )
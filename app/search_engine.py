@@ -2,117 +2,383 @@ import time
 import torch
 import numpy as np
 from utils import min_max_normalize
-from embedding_utils import generate_embeddings
+from embedding_utils import embed_queries
+from dense_index import DenseIndex, top_k_indices
+from bm25_index import tokenize
+from cache_utils import RerankScoreCache
+from configuration import CACHE_CONFIG, RETRIEVAL_CONFIG
 
-def hybrid_search_and_rerank(query, collection_embeddings, bge_model, bge_tokenizer, reranker_model, reranker_tokenizer, bm25=None, alpha=0.5, k_embed_retrieval=50, top_k_initial=5, top_k_final=3):
+RERANK_BATCH_SIZE = 32
+RERANK_MAX_LENGTH = 512
+
+# Shared across sessions; data_processor invalidates entries of re-ingested documents
+rerank_score_cache = RerankScoreCache(max_size=CACHE_CONFIG["RERANK_SCORE_CACHE_SIZE"])
+
+class CandidateSet:
+    """Retrieval candidates of one query, carried as parallel arrays until fusion.
+
+    ``rows[i]`` indexes ``documents`` (the dense index's document list, or the
+    documents returned by Chroma); result dicts are only built for the
+    candidates that survive fusion.
+    """
+
+    def __init__(self, documents, rows, embedding_scores):
+        self.documents = documents
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.doc_ids = [documents[row]["id"] for row in self.rows.tolist()]
+        self.embedding_scores = np.asarray(embedding_scores, dtype=np.float32)
+        self.bm25_scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        self.combined_scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def to_results(self, positions):
+        """Materialize result dicts for the given candidate positions"""
+        results = []
+        for i in positions:
+            doc = self.documents[self.rows[i]]
+            results.append({
+                "id": doc["id"],
+                "text": doc["text"],
+                "source": doc.get("source", "Không có nguồn"),
+                "sources": doc.get("sources") or [doc.get("source", "Không có nguồn")],
+                "parent_id": doc.get("parent_id", doc["id"]),
+                "embedding_score": float(self.embedding_scores[i]),
+                "bm25_score": float(self.bm25_scores[i]),
+                "combined_score": float(self.combined_scores[i]),
+                "rerank_score": -float('inf'),  # stays -inf unless the cross-encoder scores the pair
+                "proxy_score": None  # set instead when adaptive reranking skips the query
+            })
+        return results
+
+def _dense_search_many(query_embeddings, collection_embeddings, k_embed_retrieval):
+    """Run the embedding stage for every query; returns one CandidateSet per query"""
+    if isinstance(collection_embeddings, DenseIndex):
+        rows, similarities = collection_embeddings.search_many(query_embeddings, k_embed_retrieval)
+        candidate_sets = []
+        for query_rows, query_similarities in zip(rows, similarities):
+            found = query_rows >= 0  # ANN search can return fewer than k rows
+            candidate_sets.append(CandidateSet(collection_embeddings.documents, query_rows[found], query_similarities[found]))
+        return candidate_sets
+
+    embed_results = collection_embeddings.query(
+        query_embeddings=query_embeddings.tolist(),
+        n_results=k_embed_retrieval,
+        include=['metadatas', 'documents', 'distances']
+    )
+    if not embed_results or not embed_results.get("ids"):
+        return [CandidateSet([], [], []) for _ in range(query_embeddings.shape[0])]
+    candidate_sets = []
+    for q in range(query_embeddings.shape[0]):
+        documents = [
+            {
+                "id": doc_id, "text": text, "source": metadata.get("source", "Không có nguồn"),
+                "sources": metadata["sources"].split("\n") if "sources" in metadata else None,
+                "parent_id": metadata.get("parent_id", doc_id)
+            }
+            for doc_id, text, metadata in zip(embed_results["ids"][q], embed_results["documents"][q], embed_results["metadatas"][q])
+        ]
+        similarities = 1.0 - np.asarray(embed_results["distances"][q], dtype=np.float32)
+        candidate_sets.append(CandidateSet(documents, np.arange(len(documents)), similarities))
+    return candidate_sets
+
+def _bm25_score_candidates_many(queries, candidate_sets, bm25):
+    """BM25 stage of every query in one ``score_candidates_many`` call"""
+    scores = bm25.score_candidates_many(
+        [tokenize(query) for query in queries],
+        [bm25.rows_for(candidates.doc_ids) for candidates in candidate_sets]
+    )
+    for candidates, candidate_scores in zip(candidate_sets, scores):
+        candidates.bm25_scores = candidate_scores
+
+def _ranks(scores):
+    """1-based rank of every score (1 = best)"""
+    ranks = np.empty(scores.shape[0], dtype=np.float32)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(1, scores.shape[0] + 1)
+    return ranks
+
+def fuse_scores(embedding_scores, bm25_scores, alpha=0.5, method="linear", use_bm25=True, rrf_k=60):
+    """Blend dense and BM25 scores of one candidate set.
+
+    ``linear``: alpha-weighted sum of min-max normalized scores.
+    ``rrf``: alpha-weighted reciprocal rank fusion, sum of w / (rrf_k + rank).
+    A candidate BM25 did not match (score 0) gets no BM25 term, rather than
+    an arbitrary rank among the other zero scores.
+    """
+    if method == "rrf":
+        fused = alpha / (rrf_k + _ranks(embedding_scores))
+        if use_bm25:
+            bm25_scores = np.asarray(bm25_scores)
+            fused += np.where(bm25_scores > 0, (1 - alpha) / (rrf_k + _ranks(bm25_scores)), 0).astype(np.float32)
+        return fused
+    if method != "linear":
+        raise ValueError(f"Unsupported fusion method: {method}")
+    fused = alpha * min_max_normalize(embedding_scores)
+    if use_bm25:
+        fused += (1 - alpha) * min_max_normalize(bm25_scores)
+    return fused
+
+def _combine_and_select(candidates, use_bm25, alpha, top_k_initial, fusion="linear"):
+    if len(candidates) == 0:
+        return []
+    candidates.combined_scores = fuse_scores(
+        candidates.embedding_scores, candidates.bm25_scores, alpha=alpha, method=fusion,
+        use_bm25=use_bm25, rrf_k=RETRIEVAL_CONFIG["RRF_K"]
+    ).astype(np.float32)
+    return candidates.to_results(top_k_indices(candidates.combined_scores, top_k_initial).tolist())
+
+def rerank_pairs(pairs, reranker_model, reranker_tokenizer, device, batch_size=RERANK_BATCH_SIZE):
+    """Score (query, passage) pairs with the cross-encoder in padded batches.
+
+    Pairs are sorted by length before batching so each batch pads to similar
+    lengths; scores are returned in the original order.
+    """
+    scores = np.zeros(len(pairs), dtype=np.float32)
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start:start + batch_size]
+            batch_pairs = [pairs[i] for i in batch_indices]
+            inputs = reranker_tokenizer(batch_pairs, padding=True, truncation=True, return_tensors='pt', max_length=RERANK_MAX_LENGTH).to(device)
+            logits = reranker_model(**inputs, return_dict=True).logits.view(-1).float()
+            scores[batch_indices] = torch.sigmoid(logits).cpu().numpy()
+    return scores
+
+def rerank_candidates(queries, candidates, reranker_model, reranker_tokenizer, device, batch_size=RERANK_BATCH_SIZE, cache=rerank_score_cache):
+    """Set ``rerank_score`` on each candidate, running the cross-encoder only on cache misses.
+
+    ``queries[i]`` is the query that ``candidates[i]`` was retrieved for.
+    Returns the number of pairs that went through the model.
+    """
+    model_id = getattr(getattr(reranker_model, "config", None), "_name_or_path", None) or reranker_model.__class__.__name__
+    misses = []
+    for query, candidate in zip(queries, candidates):
+        score = cache.lookup(model_id, query, candidate["id"], candidate["text"]) if cache is not None else None
+        if score is None:
+            misses.append((query, candidate))
+        else:
+            candidate["rerank_score"] = score
+
+    if misses:
+        scores = rerank_pairs(
+            [[query, candidate["text"]] for query, candidate in misses],
+            reranker_model, reranker_tokenizer, device, batch_size=batch_size
+        )
+        for (query, candidate), score in zip(misses, scores.tolist()):
+            candidate["rerank_score"] = score
+            if cache is not None:
+                cache.store(model_id, query, candidate["id"], candidate["text"], score)
+    return len(misses)
+
+def _adaptive_plan(initial_top_k, top_k_final):
+    """Pick (rerank depth, skip) for one query from its fused-score distribution"""
+    if len(initial_top_k) <= top_k_final:
+        return len(initial_top_k), False
+    fused = min_max_normalize([c["combined_score"] for c in initial_top_k])
+    if fused[0] - fused[1] >= RETRIEVAL_CONFIG["ADAPTIVE_DECISIVE_GAP"]:
+        return 0, True
+    within_window = int(np.count_nonzero(fused >= fused[0] - RETRIEVAL_CONFIG["ADAPTIVE_SCORE_WINDOW"]))
+    return min(len(initial_top_k), max(top_k_final, within_window)), False
+
+def adaptive_rerank_many(queries, initial_per_query, top_k_final, reranker_model, reranker_tokenizer, device, batch_size=RERANK_BATCH_SIZE, stats=None):
+    """Rerank each query's fused list only as deep as needed.
+
+    Per query: skip the cross-encoder when the top fused result is decisively
+    ahead (fused order is kept, ``rerank_score`` stays -inf and the normalized
+    fused score is recorded as ``proxy_score``); otherwise rerank in increments of
+    ``ADAPTIVE_RERANK_STEP`` up to a depth chosen from the fused-score spread,
+    stopping early once the top ``top_k_final`` ids no longer change.
+    Increments of all active queries share one cross-encoder batch per round.
+    Candidates that were never scored are dropped from the returned lists.
+    """
+    step = RETRIEVAL_CONFIG["ADAPTIVE_RERANK_STEP"]
+    plans = [_adaptive_plan(initial_top_k, top_k_final) for initial_top_k in initial_per_query]
+    scored = [0] * len(queries)
+    previous_top = [None] * len(queries)
+    active = set()
+    for q, (initial_top_k, (depth, skip)) in enumerate(zip(initial_per_query, plans)):
+        if skip:
+            for candidate, proxy in zip(initial_top_k, min_max_normalize([c["combined_score"] for c in initial_top_k])):
+                candidate["proxy_score"] = float(proxy)
+            scored[q] = len(initial_top_k)
+        elif depth > 0:
+            active.add(q)
+
+    model_pairs = 0
+    rerank_pairs_requested = 0
+    while active:
+        round_queries = []
+        round_candidates = []
+        for q in sorted(active):
+            increment = max(step, top_k_final) if scored[q] == 0 else step
+            new_candidates = initial_per_query[q][scored[q]:min(scored[q] + increment, plans[q][0])]
+            round_queries.extend([queries[q]] * len(new_candidates))
+            round_candidates.extend(new_candidates)
+            scored[q] += len(new_candidates)
+        rerank_pairs_requested += len(round_candidates)
+        model_pairs += rerank_candidates(round_queries, round_candidates, reranker_model, reranker_tokenizer, device, batch_size=batch_size)
+
+        for q in list(active):
+            ranked = sorted(initial_per_query[q][:scored[q]], key=lambda x: x["rerank_score"], reverse=True)
+            top_ids = [c["id"] for c in ranked[:top_k_final]]
+            if top_ids == previous_top[q] or scored[q] >= plans[q][0]:
+                active.discard(q)
+            previous_top[q] = top_ids
+
+    if stats is not None:
+        stats["rerank_pairs_available"] = sum(len(initial_top_k) for initial_top_k in initial_per_query)
+        stats["rerank_pairs_scored"] = rerank_pairs_requested
+        stats["rerank_model_pairs"] = model_pairs
+        stats["rerank_skipped_queries"] = sum(1 for _, skip in plans if skip)
+    print(f"Adaptive rerank: scored {rerank_pairs_requested} of {sum(len(i) for i in initial_per_query)} pairs "
+          f"({model_pairs} through the cross-encoder), skipped {sum(1 for _, skip in plans if skip)} queries.")
+    return [initial_top_k[:count] for initial_top_k, count in zip(initial_per_query, scored)]
+
+def merge_windows(windows):
+    """Rebuild a section's text from its overlapping windows (dicts with ``text`` and ``start``)"""
+    text = ""
+    for window in sorted(windows, key=lambda w: w["start"]):
+        overlap = len(text) - window["start"]
+        if overlap < 0:
+            # Windows without token overlap are separated only by whitespace
+            text += " "
+            overlap = 0
+        text += window["text"][overlap:]
+    return text
+
+def _parent_windows(collection_embeddings, parent_id):
+    if isinstance(collection_embeddings, DenseIndex):
+        return [collection_embeddings.documents[row] for row in collection_embeddings.rows_of_parent(parent_id)]
+    found = collection_embeddings.get(where={"parent_id": parent_id}, include=["documents", "metadatas"])
+    return [{"text": text, "start": metadata["start"]} for text, metadata in zip(found["documents"], found["metadatas"])]
+
+def aggregate_parents(ranked, collection_embeddings, top_k_final):
+    """Collapse reranked windows (best first) into their top ``top_k_final`` sections.
+
+    Each section keeps the scores of its best window, gets its full text back
+    and lists the ids of its windows that were retrieved under ``windows``.
+    """
+    parents = {}
+    for res in ranked:
+        parent_id = res.get("parent_id", res["id"])
+        if parent_id in parents:
+            parents[parent_id]["windows"].append(res["id"])
+            continue
+        if len(parents) == top_k_final:
+            continue
+        parent = dict(res, id=parent_id, windows=[res["id"]])
+        if parent_id != res["id"]:
+            windows = _parent_windows(collection_embeddings, parent_id)
+            if windows:
+                parent["text"] = merge_windows(windows)
+        parents[parent_id] = parent
+    return list(parents.values())
+
+def _finalize(candidates, top_k_final, granularity="window", collection_embeddings=None):
+    candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
+    if granularity == "parent":
+        final_results = aggregate_parents(candidates, collection_embeddings, top_k_final)
+    elif granularity == "window":
+        final_results = candidates[:top_k_final]
+    else:
+        raise ValueError(f"Unsupported result granularity: {granularity}")
+    for res in final_results:
+        res["embedding_score"] = float(res["embedding_score"])
+        res["bm25_score"] = float(res["bm25_score"])
+        res["combined_score"] = float(res["combined_score"])
+        res["rerank_score"] = float(res["rerank_score"])
+    return final_results
+
+def search_many(queries, collection_embeddings, bge_model, bge_tokenizer, reranker_model, reranker_tokenizer, bm25=None, alpha=0.5, k_embed_retrieval=50, top_k_initial=5, top_k_final=3, rerank_batch_size=RERANK_BATCH_SIZE, fusion=None, adaptive_rerank=None, granularity=None, stats=None, query_embeddings=None):
+    """Hybrid search and rerank for several queries at once.
+
+    All queries are embedded in one batch, the dense stage runs as a single
+    matrix product, BM25 scores all candidates in one pass over the postings
+    of every query's terms, and every (query, passage) pair goes through the
+    reranker in shared padded batches. Returns one result list per query;
+    ``query_embeddings`` skips encoding the queries when the caller already has them.
+    """
     start_time = time.time()
-    results_data = {}
-    
+    fusion = fusion or RETRIEVAL_CONFIG["FUSION"]
+    adaptive_rerank = RETRIEVAL_CONFIG["ADAPTIVE_RERANK"] if adaptive_rerank is None else adaptive_rerank
+    granularity = granularity or RETRIEVAL_CONFIG["RESULT_GRANULARITY"]
+    if not queries:
+        return []
+
     # 1. BGE Embedding Search
     try:
-        print(f"Step 1: Performing BGE Embedding Search (k_embed_retrieval={k_embed_retrieval})...")
-        query_embedding_bge = generate_embeddings([query], bge_model, bge_tokenizer)[0]
-        query_embedding_final = query_embedding_bge.tolist()
-        
-        embed_results = collection_embeddings.query(
-            query_embeddings=[query_embedding_final],
-            n_results=k_embed_retrieval,
-            include=['metadatas', 'documents', 'distances']
-        )
-        
-        if not embed_results or not embed_results.get("ids") or not embed_results["ids"][0]:
-            print("Warning: BGE Embedding search returned no results.")
-            return []
-        
-        for i, doc_id in enumerate(embed_results["ids"][0]):
-            distance = embed_results["distances"][0][i]
-            similarity = 1.0 - distance
-            results_data[doc_id] = {
-                "id": doc_id,
-                "text": embed_results["documents"][0][i],
-                "source": embed_results["metadatas"][0][i].get("source", "Không có nguồn"),
-                "embedding_score": similarity,
-                "bm25_score": 0.0,
-                "combined_score": 0.0,
-                "rerank_score": -float('inf')
-            }
-        print(f"Found {len(results_data)} candidates from BGE embedding search.")
-    
+        print(f"Step 1: Performing BGE Embedding Search for {len(queries)} queries (k_embed_retrieval={k_embed_retrieval})...")
+        if query_embeddings is None:
+            query_embeddings = embed_queries(queries, bge_model, bge_tokenizer)
+        else:
+            query_embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(len(queries), -1)
+        candidate_sets = _dense_search_many(query_embeddings, collection_embeddings, k_embed_retrieval)
+        print(f"Found {sum(len(r) for r in candidate_sets)} candidates from BGE embedding search.")
     except Exception as e:
         print(f"Error during BGE embedding search: {e}")
-        return []
-    
+        return [[] for _ in queries]
+
     # 2. BM25 Search
-    if bm25 and results_data:
+    if bm25:
+        print("Step 2: Calculating BM25 scores for embedding candidates...")
         try:
-            print("Step 2: Calculating BM25 scores for embedding candidates...")
-            query_tokens = query.lower().split()
-            candidate_indices = [int(doc_id) for doc_id in results_data.keys()]
-            candidate_bm25_scores = bm25.get_scores(query_tokens)
-            
-            max_bm25_score = 0
-            for doc_id in results_data.keys():
-                doc_index = int(doc_id)
-                if 0 <= doc_index < len(candidate_bm25_scores):
-                    score = candidate_bm25_scores[doc_index]
-                    results_data[doc_id]["bm25_score"] = score
-                    if score > max_bm25_score: max_bm25_score = score
-                else:
-                    print(f"Warning: Document index {doc_index} out of bounds for BM25 scores.")
-                    results_data[doc_id]["bm25_score"] = 0.0
+            _bm25_score_candidates_many(queries, candidate_sets, bm25)
         except Exception as e:
             print(f"Error during BM25 calculation: {e}")
-    
+
     # 3. Combine Scores and Initial Ranking
-    print(f"Step 3: Combining scores (alpha={alpha}) and selecting top {top_k_initial}...")
-    candidates = list(results_data.values())
-    if not candidates:
-        print("No candidates to combine or rank.")
-        return []
-    
-    embedding_scores = [c["embedding_score"] for c in candidates]
-    bm25_scores = [c["bm25_score"] for c in candidates]
-    
-    normalized_embedding = min_max_normalize(embedding_scores)
-    normalized_bm25 = min_max_normalize(bm25_scores) if bm25 else np.zeros(len(candidates))
-    
-    for i, candidate in enumerate(candidates):
-        candidate["combined_score"] = (alpha * normalized_embedding[i]) + ((1 - alpha) * normalized_bm25[i])
-    
-    candidates.sort(key=lambda x: x["combined_score"], reverse=True)
-    initial_top_k = candidates[:top_k_initial]
-    
-    if not initial_top_k:
-        print("No candidates after initial ranking.")
-        return []
-    print(f"Selected {len(initial_top_k)} candidates after initial ranking.")
-    
+    print(f"Step 3: Combining scores ({fusion}, alpha={alpha}) and selecting top {top_k_initial}...")
+    initial_per_query = [
+        _combine_and_select(candidates, bool(bm25), alpha, top_k_initial, fusion=fusion)
+        for candidates in candidate_sets
+    ]
+
     # 4. Reranking
-    print(f"Step 4: Reranking top {len(initial_top_k)} candidates...")
-    rerank_pairs = [[query, candidate['text']] for candidate in initial_top_k]
-    if rerank_pairs:
+    pair_owners = [(q, candidate) for q, initial_top_k in enumerate(initial_per_query) for candidate in initial_top_k]
+    print(f"Step 4: Reranking {len(pair_owners)} candidate pairs{' (adaptive)' if adaptive_rerank else ''}...")
+    if pair_owners and adaptive_rerank:
         try:
-            with torch.no_grad():
-                inputs = reranker_tokenizer(rerank_pairs, padding=True, truncation=True, return_tensors='pt', max_length=512).to(bge_model.device)  # Dùng device từ bge_model
-                scores = reranker_model(**inputs, return_dict=True).logits.view(-1).float()
-                rerank_scores = torch.sigmoid(scores).cpu().numpy()
-            
-            for i, candidate in enumerate(initial_top_k):
-                candidate["rerank_score"] = rerank_scores[i]
+            initial_per_query = adaptive_rerank_many(
+                queries, initial_per_query, top_k_final,
+                reranker_model, reranker_tokenizer, bge_model.device, batch_size=rerank_batch_size, stats=stats
+            )
         except Exception as e:
             print(f"Error during reranking: {e}")
-    
-    initial_top_k.sort(key=lambda x: x["rerank_score"], reverse=True)
-    
+    elif pair_owners:
+        try:
+            scored = rerank_candidates(
+                [queries[q] for q, _ in pair_owners],
+                [candidate for _, candidate in pair_owners],
+                reranker_model, reranker_tokenizer, bge_model.device, batch_size=rerank_batch_size
+            )
+            print(f"Cross-encoder scored {scored} of {len(pair_owners)} pairs (rest served from cache).")
+            if stats is not None:
+                stats["rerank_pairs_available"] = stats["rerank_pairs_scored"] = len(pair_owners)
+                stats["rerank_model_pairs"] = scored
+                stats["rerank_skipped_queries"] = 0
+        except Exception as e:
+            print(f"Error during reranking: {e}")
+
     # 5. Final Selection
-    final_results = initial_top_k[:top_k_final]
+    final_per_query = [
+        _finalize(initial_top_k, top_k_final, granularity, collection_embeddings)
+        for initial_top_k in initial_per_query
+    ]
     end_time = time.time()
-    print(f"Step 5: Selected final {len(final_results)} results. Total time: {end_time - start_time:.2f}s")
-    
-    for res in final_results:
-        res["embedding_score"] = float(res["embedding_score"])
-        res["bm25_score"] = float(res["bm25_score"])
-        res["combined_score"] = float(res["combined_score"])
-        res["rerank_score"] = float(res["rerank_score"])
-    
-    return final_results
\ No newline at end of file
+    print(f"Step 5: Selected final results for {len(queries)} queries. Total time: {end_time - start_time:.2f}s")
+    return final_per_query
+
+def hybrid_search_and_rerank(query, collection_embeddings, bge_model, bge_tokenizer, reranker_model, reranker_tokenizer, bm25=None, alpha=0.5, k_embed_retrieval=50, top_k_initial=5, top_k_final=3, fusion=None, adaptive_rerank=None, granularity=None, stats=None, query_embedding=None):
+    """Hybrid BGE + BM25 retrieval followed by cross-encoder reranking.
+
+    ``granularity`` selects "window" results (the best matching spans) or
+    "parent" results (whole sections ranked by their best window).
+    ``query_embedding`` skips encoding the query when the caller already has it.
+    """
+    return search_many(
+        [query], collection_embeddings, bge_model, bge_tokenizer, reranker_model, reranker_tokenizer,
+        bm25=bm25, alpha=alpha, k_embed_retrieval=k_embed_retrieval, top_k_initial=top_k_initial,
+        top_k_final=top_k_final, fusion=fusion, adaptive_rerank=adaptive_rerank, granularity=granularity,
+        stats=stats, query_embeddings=None if query_embedding is None else [query_embedding]
+    )[0]
@@ -1,13 +1,43 @@
-import re
+import hashlib
+import os
 import numpy as np
-from sklearn.preprocessing import MinMaxScaler
+
+def iter_input_files(paths):
+    """Expand knowledge-base inputs (files or directories of .txt files) into file paths"""
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".txt"):
+                        yield os.path.join(root, name)
+        elif os.path.exists(path):
+            yield str(path)
+        else:
+            print(f"Error: Data file not found at {path}")
+
+def iter_chunks(file_path):
+    """Yield the chunks of ``chunk_text_by_hash`` one at a time, reading the file line by line"""
+    with open(file_path, "r", encoding="utf-8") as file:
+        lines = []
+        for line_number, line in enumerate(file):
+            # Same boundaries as splitting the whole text on "\n# "
+            if line_number > 0 and line.startswith("# "):
+                chunk = "".join(lines).strip()
+                if chunk:
+                    yield "# " + chunk
+                lines = [line[2:]]
+            else:
+                lines.append(line)
+        chunk = "".join(lines).strip()
+        if chunk:
+            yield "# " + chunk
 
 def chunk_text_by_hash(file_path):
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read()
-        chunks_raw = re.split(r'\n# ', text)
-        chunks = ['# ' + chunk.strip() for chunk in chunks_raw if chunk.strip()]
+        chunks = list(iter_chunks(file_path))
         print(f"Successfully chunked {len(chunks)} documents from {file_path}")
         return chunks
     except FileNotFoundError:
@@ -17,10 +47,21 @@ def chunk_text_by_hash(file_path):
         print(f"Error reading or chunking file {file_path}: {e}")
         return []
 
+def section_heading(text):
+    """First line of a knowledge-base section (its "# ..." heading)"""
+    return text.split("\n", 1)[0].strip()
+
 def min_max_normalize(scores):
-    scores_np = np.array(scores).reshape(-1, 1)
-    if np.all(scores_np == scores_np[0]):
-         return np.full(scores_np.shape, 0.5).flatten()
-    scaler = MinMaxScaler()
-    normalized_scores = scaler.fit_transform(scores_np)
-    return normalized_scores.flatten()
\ No newline at end of file
+    scores_np = np.asarray(scores, dtype=np.float32).ravel()
+    if scores_np.size == 0:
+        return scores_np
+    low = scores_np.min()
+    span = scores_np.max() - low
+    if span == 0:
+        return np.full(scores_np.shape, 0.5, dtype=np.float32)
+    return (scores_np - low) / span
+
+def content_hash(*parts):
+    """Short, stable id derived from a chunk's content"""
+    digest = hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+    return digest[:16]
@@ -0,0 +1,71 @@
+import hashlib
+import os
+import sys
+import numpy as np
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The app modules import each other as top-level modules (they run from app/)
+sys.path.insert(0, os.path.join(ROOT_DIR, "app"))
+
+EMBEDDING_DIM = 16
+
+@pytest.fixture
+def knowledge_base_file():
+    """The knowledge base shipped in data/"""
+    return os.path.join(ROOT_DIR, "data", "data.txt")
+
+def fake_embeddings(texts):
+    """Deterministic unit vectors derived from each text's hash, standing in for BGE"""
+    vectors = []
+    for text in texts:
+        seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).astype(np.float32)
+        vectors.append(vector / np.linalg.norm(vector))
+    return np.stack(vectors) if vectors else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+@pytest.fixture
+def ingest_env(tmp_path, monkeypatch):
+    """``ingest.ingest`` writing into ``tmp_path`` with an in-process fake embedder.
+
+    Returns the list of chunk counts embedded by each ingest run.
+    """
+    import ingest
+    from configuration import RETRIEVAL_CONFIG
+    for key, value in {
+        "BUNDLE_PATH": str(tmp_path / "bundle"),
+        "INGEST_WORK_DIR": str(tmp_path / "shards"),
+        "DENSE_INDEX_DTYPE": "float32",
+        "DENSE_QUANTIZATION": "none",
+        "DENSE_PROJECTION": "none",
+        "DEDUP": False,
+    }.items():
+        monkeypatch.setitem(RETRIEVAL_CONFIG, key, value)
+    # Without a tokenizer sections are not split into windows, so no model is downloaded
+    import model_loader
+    monkeypatch.setattr(model_loader, "load_bge_tokenizer", lambda: None)
+
+    embedded_per_run = []
+    def embed_shards(data_paths, tokenizer, duplicates, work_dir, shard_size, reusable_ids, workers, threads):
+        os.makedirs(work_dir, exist_ok=True)
+        embedded = 0
+        for index, documents, missing_ids in ingest.iter_shards(data_paths, tokenizer, duplicates, shard_size, reusable_ids):
+            if missing_ids:
+                missing = set(missing_ids)
+                texts = [doc["text"] for doc in documents if doc["id"] in missing]
+                np.savez(ingest.shard_path(work_dir, index), ids=np.array(missing_ids), embeddings=fake_embeddings(texts))
+                embedded += len(missing_ids)
+        embedded_per_run.append(embedded)
+        return embedded
+    monkeypatch.setattr(ingest, "embed_shards", embed_shards)
+    return embedded_per_run
+
+@pytest.fixture
+def write_sections():
+    """Writes (heading, body) pairs to a file in the knowledge-base format"""
+    def write(path, sections):
+        with open(path, "w", encoding="utf-8") as f:
+            for heading, body in sections:
+                f.write(f"# {heading}\n{body}\nNguồn: https://example.org/{heading.replace(' ', '-')}\n")
+        return str(path)
+    return write
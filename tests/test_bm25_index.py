@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from bm25_index import BM25Index, tokenize
+from utils import chunk_text_by_hash
+
+@pytest.fixture
+def rank_bm25():
+    return pytest.importorskip("rank_bm25")
+
+@pytest.fixture
+def corpus(knowledge_base_file):
+    return [tokenize(chunk) for chunk in chunk_text_by_hash(knowledge_base_file)]
+
+@pytest.fixture
+def queries(corpus):
+    rng = np.random.default_rng(0)
+    picked = [corpus[i] for i in rng.choice(len(corpus), 40, replace=False)]
+    # Repeated terms, terms unknown to the corpus and an empty query included
+    return [doc[:12] for doc in picked] + [corpus[0][:3] * 2 + ["không-có-từ-này"], ["không-có-từ-này"], []]
+
+def test_scores_match_rank_bm25(rank_bm25, corpus, queries):
+    reference = rank_bm25.BM25Okapi(corpus)
+    index = BM25Index(corpus)
+    for query in queries:
+        np.testing.assert_allclose(index.get_scores(query), reference.get_scores(query), rtol=1e-5, atol=1e-5)
+
+def test_top_k_matches_rank_bm25(rank_bm25, corpus, queries):
+    reference = rank_bm25.BM25Okapi(corpus)
+    index = BM25Index(corpus)
+    for query in queries[:-1]:
+        expected = reference.get_scores(query)
+        rows, scores = index.top_k(query, 10)
+        np.testing.assert_allclose(scores, np.sort(expected[expected > 0])[::-1][:10], rtol=1e-5, atol=1e-5)
+        np.testing.assert_allclose(expected[rows], scores, rtol=1e-5, atol=1e-5)
+
+def test_score_candidates_many_matches_single_queries(corpus, queries):
+    index = BM25Index(corpus)
+    rng = np.random.default_rng(1)
+    candidates = [rng.integers(-1, len(corpus), size=rng.integers(0, 30)) for _ in queries]
+    batched = index.score_candidates_many(queries, candidates)
+    for query, rows, scores in zip(queries, candidates, batched):
+        expected = np.where(rows >= 0, index.get_scores(query)[rows], 0.0)
+        np.testing.assert_array_equal(index.score_candidates(query, rows), scores)
+        np.testing.assert_allclose(scores, expected, rtol=1e-6, atol=1e-6)
+
+def test_save_and_load_round_trip(tmp_path, corpus, queries):
+    index = BM25Index(corpus, ids=[f"doc-{i}" for i in range(len(corpus))])
+    index.save(str(tmp_path / "bm25"))
+    loaded = BM25Index.load(str(tmp_path / "bm25"))
+    assert loaded.ids == index.ids
+    for query in queries:
+        np.testing.assert_array_equal(loaded.get_scores(query), index.get_scores(query))
+
+# ========== Incremental updates ==========
+def assert_same_index(index, fresh, queries):
+    assert index.ids == fresh.ids
+    assert index.corpus_size == fresh.corpus_size
+    assert sorted(index.vocabulary) == sorted(fresh.vocabulary)
+    assert index.avgdl == pytest.approx(fresh.avgdl)
+    for query in queries:
+        np.testing.assert_allclose(index.get_scores(query), fresh.get_scores(query), rtol=1e-6, atol=1e-6)
+
+def test_remove_and_add_match_a_fresh_build(corpus, queries):
+    ids = [f"doc-{i}" for i in range(len(corpus))]
+    index = BM25Index(corpus[:-20], ids=ids[:-20])
+    removed = set(ids[:-20:7])
+    assert index.remove_documents(list(removed) + ["unknown"]) == len(removed)
+    assert index.add_documents(ids[-20:], corpus[-20:]) == 20
+
+    kept = [(doc_id, tokens) for doc_id, tokens in zip(ids, corpus) if doc_id not in removed]
+    fresh = BM25Index([tokens for _, tokens in kept], ids=[doc_id for doc_id, _ in kept])
+    assert_same_index(index, fresh, queries)
+
+def test_removing_the_only_documents_of_a_term_forgets_it(corpus, queries):
+    ids = [f"doc-{i}" for i in range(len(corpus))]
+    index = BM25Index(corpus + [["từ-riêng", "từ-riêng"]], ids=ids + ["unique"])
+    index.remove_documents(["unique"])
+    assert "từ-riêng" not in index.vocabulary
+    assert_same_index(index, BM25Index(corpus, ids=ids), queries + [["từ-riêng"]])
+
+def test_nothing_to_add_or_remove_leaves_index_unchanged(corpus, queries):
+    index = BM25Index(corpus)
+    assert index.remove_documents(["unknown"]) == 0
+    assert index.add_documents([], []) == 0
+    assert_same_index(index, BM25Index(corpus), queries)
@@ -0,0 +1,180 @@
+import time
+import numpy as np
+import pytest
+from cache_utils import LRUCache, QueryEmbeddingCache, RerankScoreCache, SemanticAnswerCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+# ========== LRUCache ==========
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+def test_lru_entries_expire_after_ttl(clock):
+    cache = LRUCache(max_size=4, ttl_seconds=10)
+    cache.put("a", 1)
+    clock.now += 10
+    assert cache.get("a") == 1
+    clock.now += 0.5
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_lru_put_refreshes_ttl(clock):
+    cache = LRUCache(max_size=4, ttl_seconds=10)
+    cache.put("a", 1)
+    clock.now += 8
+    cache.put("a", 2)
+    clock.now += 8
+    assert cache.get("a") == 2
+
+def test_lru_releases_every_entry_that_leaves():
+    released = []
+    class Tracking(LRUCache):
+        def _released(self, key, value):
+            released.append(key)
+    cache = Tracking(max_size=2)
+    cache.put("a", 1)
+    cache.put("a", 2)  # overwrite
+    cache.put("b", 2)
+    cache.put("c", 3)  # evicts "a"
+    cache.pop("b")
+    cache.put("d", 4)
+    assert cache.discard_where(lambda key: key == "d") == 1
+    cache.clear()
+    assert released == ["a", "a", "b", "d", "c"]
+    assert len(cache) == 0
+
+def test_lru_rejects_non_positive_size():
+    with pytest.raises(ValueError):
+        LRUCache(max_size=0)
+
+# ========== QueryEmbeddingCache ==========
+def test_query_embeddings_computed_once_per_distinct_normalized_text():
+    calls = []
+    def compute(texts):
+        calls.append(list(texts))
+        return [f"vec:{text}" for text in texts]
+    cache = QueryEmbeddingCache(max_size=8)
+    first = cache.get_or_compute("bge", ["Trầm cảm?", "  trầm   CẢM? ", "Lo âu"], compute)
+    assert calls == [["Trầm cảm?", "Lo âu"]]
+    assert first == ["vec:Trầm cảm?", "vec:Trầm cảm?", "vec:Lo âu"]
+
+    second = cache.get_or_compute("bge", ["lo âu", "Mất ngủ"], compute)
+    assert calls[-1] == ["Mất ngủ"]
+    assert second == ["vec:Lo âu", "vec:Mất ngủ"]
+
+def test_query_embeddings_are_kept_per_model():
+    cache = QueryEmbeddingCache(max_size=8)
+    cache.get_or_compute("bge", ["query"], lambda texts: ["bge"])
+    assert cache.get_or_compute("other", ["query"], lambda texts: ["other"]) == ["other"]
+
+# ========== RerankScoreCache ==========
+def test_rerank_scores_are_keyed_by_normalized_query_and_document():
+    cache = RerankScoreCache(max_size=8)
+    cache.store("reranker", "Trầm cảm là gì?", "doc-1", "passage one", 0.9)
+    assert cache.lookup("reranker", "  trầm cảm LÀ gì? ", "doc-1", "passage one") == 0.9
+    assert cache.lookup("reranker", "Trầm cảm là gì?", "doc-2", "passage one") is None
+    assert cache.lookup("other", "Trầm cảm là gì?", "doc-1", "passage one") is None
+
+def test_rerank_score_of_edited_passage_is_not_served():
+    cache = RerankScoreCache(max_size=8)
+    cache.store("reranker", "query", "doc-1", "old text", 0.9)
+    assert cache.lookup("reranker", "query", "doc-1", "new text") is None
+
+def test_rerank_invalidate_documents_drops_only_their_scores():
+    cache = RerankScoreCache(max_size=8)
+    for query in ("first", "second"):
+        for doc_id in ("doc-1", "doc-2"):
+            cache.store("reranker", query, doc_id, doc_id, 0.5)
+    assert cache.invalidate_documents(["doc-1", "unknown"]) == 2
+    assert cache.invalidate_documents([]) == 0
+    assert cache.lookup("reranker", "first", "doc-1", "doc-1") is None
+    assert cache.lookup("reranker", "second", "doc-2", "doc-2") == 0.5
+    assert len(cache) == 2
+
+# ========== SemanticAnswerCache ==========
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+@pytest.fixture
+def answer_cache():
+    cache = SemanticAnswerCache(max_size=2, ttl_seconds=60, threshold=0.95)
+    cache.set_knowledge_base_version("kb-1")
+    return cache
+
+def test_answer_served_to_close_query_with_same_documents(answer_cache):
+    answer_cache.store("llm", "Trầm cảm là gì?", unit(1, 0, 0), ["doc-1", "doc-2"], "answer")
+    answer, similarity = answer_cache.lookup("llm", unit(1, 0.1, 0), ["doc-1", "doc-2"])
+    assert answer == "answer"
+    assert similarity == pytest.approx(float(unit(1, 0.1, 0)[0]))
+    assert answer_cache.lookup("llm", unit(1, 1, 0), ["doc-1", "doc-2"]) is None  # below the threshold
+
+def test_answer_not_served_for_other_documents_or_model(answer_cache):
+    answer_cache.store("llm", "query", unit(1, 0, 0), ["doc-1", "doc-2"], "answer")
+    assert answer_cache.lookup("llm", unit(1, 0, 0), ["doc-2", "doc-1"]) is None
+    assert answer_cache.lookup("llm", unit(1, 0, 0), ["doc-1"]) is None
+    assert answer_cache.lookup("other-llm", unit(1, 0, 0), ["doc-1", "doc-2"]) is None
+
+def test_closest_answer_of_the_group_wins(answer_cache):
+    answer_cache.store("llm", "first", unit(1, 0, 0), ["doc-1"], "first answer")
+    answer_cache.store("llm", "second", unit(0.9, 0.3, 0), ["doc-1"], "second answer")
+    assert answer_cache.lookup("llm", unit(0.92, 0.25, 0), ["doc-1"])[0] == "second answer"
+    assert answer_cache.lookup("llm", unit(1, 0.01, 0), ["doc-1"])[0] == "first answer"
+
+def test_answers_evicted_least_recently_used(answer_cache):
+    answer_cache.store("llm", "a", unit(1, 0, 0), ["doc-1"], "a")
+    answer_cache.store("llm", "b", unit(0, 1, 0), ["doc-1"], "b")
+    assert answer_cache.lookup("llm", unit(1, 0, 0), ["doc-1"])[0] == "a"
+    answer_cache.store("llm", "c", unit(0, 0, 1), ["doc-1"], "c")
+    assert answer_cache.lookup("llm", unit(0, 1, 0), ["doc-1"]) is None
+    assert answer_cache.lookup("llm", unit(0, 0, 1), ["doc-1"])[0] == "c"
+    assert len(answer_cache) == 2
+    assert answer_cache._free_rows == []
+
+def test_answers_expire_after_ttl(answer_cache, clock):
+    answer_cache.store("llm", "a", unit(1, 0, 0), ["doc-1"], "a")
+    clock.now += 61
+    assert answer_cache.lookup("llm", unit(1, 0, 0), ["doc-1"]) is None
+    assert len(answer_cache) == 0
+    answer_cache.store("llm", "b", unit(0, 1, 0), ["doc-1"], "b")
+    answer_cache.store("llm", "c", unit(0, 0, 1), ["doc-1"], "c")  # the expired row was freed for reuse
+    assert len(answer_cache) == 2
+
+def test_new_knowledge_base_version_drops_answers(answer_cache):
+    answer_cache.store("llm", "a", unit(1, 0, 0), ["doc-1"], "a")
+    assert answer_cache.set_knowledge_base_version("kb-2") == 1
+    assert answer_cache.lookup("llm", unit(1, 0, 0), ["doc-1"]) is None
+    answer_cache.store("llm", "a", unit(1, 0, 0), ["doc-1"], "new a")
+    assert answer_cache.lookup("llm", unit(1, 0, 0), ["doc-1"])[0] == "new a"
+
+def test_storing_the_same_query_replaces_its_answer(answer_cache):
+    answer_cache.store("llm", "Trầm cảm?", unit(1, 0, 0), ["doc-1"], "old")
+    answer_cache.store("llm", " trầm cảm? ", unit(1, 0, 0), ["doc-1"], "new")
+    assert len(answer_cache) == 1
+    assert answer_cache.lookup("llm", unit(1, 0, 0), ["doc-1"])[0] == "new"
+
+def test_embeddings_of_another_dimension_reset_the_cache(answer_cache):
+    answer_cache.store("llm", "a", unit(1, 0, 0), ["doc-1"], "a")
+    assert answer_cache.lookup("llm", unit(1, 0), ["doc-1"]) is None
+    answer_cache.store("llm", "b", unit(1, 0), ["doc-1"], "b")
+    assert len(answer_cache) == 1
+    assert answer_cache.lookup("llm", unit(1, 0), ["doc-1"])[0] == "b"
@@ -0,0 +1,53 @@
+import pytest
+from configuration import RETRIEVAL_CONFIG
+from dedup import MinHasher, find_near_duplicates, shingles
+from ingestion import detect_near_duplicates, iter_documents, iter_sections
+from utils import iter_chunks
+
+@pytest.fixture
+def sections(knowledge_base_file):
+    """The first sections of the shipped knowledge base, none of them near-duplicates of another"""
+    return list(iter_chunks(knowledge_base_file))[:20]
+
+def near_copy(section, replacements=1):
+    """``section`` with ``replacements`` words in the middle of its body replaced"""
+    words = section.split(" ")
+    for offset in range(replacements):
+        words[len(words) // 2 + 5 * offset] = "khác"
+    return " ".join(words)
+
+def test_minhash_estimates_shingle_jaccard(sections):
+    hasher = MinHasher()
+    for first, second in [(sections[3], near_copy(sections[3], 6)), (sections[3], sections[4])]:
+        a, b = shingles(first), shingles(second)
+        exact = len(a & b) / len(a | b)
+        estimate = (hasher.signature(first) == hasher.signature(second)).mean()
+        assert estimate == pytest.approx(exact, abs=0.1)
+
+def test_exact_and_near_duplicates_are_grouped_and_distinct_sections_kept(sections):
+    documents = [{"id": str(i), "text": text, "source": "kb"} for i, text in enumerate(sections)]
+    assert len(find_near_duplicates(documents)) == 0
+
+    documents += [
+        {"id": "exact", "text": sections[7], "source": "copy"},
+        {"id": "near", "text": near_copy(sections[3]), "source": "copy"},
+        {"id": "rewritten", "text": near_copy(sections[5], 12), "source": "copy"},
+    ]
+    duplicates = find_near_duplicates(documents, threshold=0.8)
+    assert duplicates.canonical_of == {"exact": "7", "near": "3"}
+    assert duplicates.members["3"][0]["similarity"] >= 0.8
+    assert duplicates.annotate(documents[7])["duplicate_ids"] == ["exact"]
+    assert duplicates.annotate(documents[7])["sources"] == ["kb", "copy"]
+
+def test_ingestion_drops_duplicates_and_keeps_distinct_sections(tmp_path, monkeypatch, sections):
+    monkeypatch.setitem(RETRIEVAL_CONFIG, "DEDUP", True)
+    monkeypatch.setitem(RETRIEVAL_CONFIG, "DEDUP_THRESHOLD", 0.8)
+    knowledge_base = tmp_path / "kb.txt"
+    knowledge_base.write_text("\n".join(sections + [sections[7], near_copy(sections[3])]), encoding="utf-8")
+    data_paths = [str(knowledge_base)]
+
+    all_sections = list(iter_sections(data_paths))
+    documents = list(iter_documents(data_paths, None, detect_near_duplicates(data_paths)))
+    assert [doc["id"] for doc in documents] == [doc["id"] for doc in all_sections[:len(sections)]]
+    assert documents[7]["duplicate_ids"] == [all_sections[-2]["id"]]
+    assert documents[3]["duplicate_ids"] == [all_sections[-1]["id"]]
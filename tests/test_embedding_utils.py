@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast, XLMRobertaConfig, XLMRobertaModel
+from embedding_utils import pack_batches, generate_embeddings
+
+WORDS = ["<pad>", "<unk>"] + [f"từ{i}" for i in range(64)]
+
+@pytest.fixture(scope="module")
+def encoder():
+    tokenizer = Tokenizer(models.WordLevel({word: i for i, word in enumerate(WORDS)}, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    torch.manual_seed(0)
+    config = XLMRobertaConfig(
+        vocab_size=len(WORDS), hidden_size=32, num_hidden_layers=2, num_attention_heads=2, intermediate_size=64,
+        max_position_embeddings=128, pad_token_id=0
+    )
+    return XLMRobertaModel(config).eval(), PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", unk_token="<unk>")
+
+@pytest.fixture
+def texts():
+    rng = np.random.default_rng(0)
+    return [" ".join(WORDS[2 + i] for i in rng.integers(0, 64, rng.integers(1, 40))) for _ in range(30)]
+
+def unpadded_embedding(model, tokenizer, text):
+    """Mean of the last hidden states of ``text`` encoded on its own, without any padding"""
+    with torch.no_grad():
+        inputs = tokenizer([text], return_tensors="pt")
+        return model(**inputs).last_hidden_state[0].mean(dim=0)
+
+# ========== Packing ==========
+@pytest.mark.parametrize("max_batch_tokens, max_batch_size", [(64, None), (100, 3), (1, None), (10_000, None)])
+def test_pack_batches_covers_every_text_under_the_budget(max_batch_tokens, max_batch_size):
+    lengths = list(np.random.default_rng(1).integers(1, 50, 40))
+    batches = pack_batches(lengths, max_batch_tokens=max_batch_tokens, max_batch_size=max_batch_size)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    visited = [lengths[i] for batch in batches for i in batch]
+    assert visited == sorted(visited, reverse=True)
+    for batch in batches:
+        padded_length = max(lengths[i] for i in batch)
+        assert len(batch) == 1 or len(batch) * padded_length <= max_batch_tokens
+        assert max_batch_size is None or len(batch) <= max_batch_size
+
+# ========== Pooling ==========
+@pytest.mark.parametrize("max_batch_tokens, batch_size", [(128, None), (10_000, None), (10_000, 4), (1, None)])
+def test_packed_embeddings_match_unpadded_encoding(encoder, texts, max_batch_tokens, batch_size):
+    model, tokenizer = encoder
+    embeddings = generate_embeddings(texts, model, tokenizer, batch_size=batch_size, max_batch_tokens=max_batch_tokens)
+    expected = torch.stack([unpadded_embedding(model, tokenizer, text) for text in texts])
+    torch.testing.assert_close(embeddings, expected, rtol=1e-4, atol=1e-5)
+
+def test_padding_does_not_change_pooled_vectors(encoder, texts):
+    model, tokenizer = encoder
+    short = min(texts, key=len)
+    alone = generate_embeddings([short], model, tokenizer)
+    # In one batch with the longest text, the short one is mostly padding
+    padded = generate_embeddings([max(texts, key=len), short], model, tokenizer, max_batch_tokens=10_000)[1:]
+    torch.testing.assert_close(padded, alone, rtol=1e-4, atol=1e-5)
+
+def test_no_texts_give_an_empty_matrix(encoder):
+    model, tokenizer = encoder
+    assert generate_embeddings([], model, tokenizer).shape == (0, model.config.hidden_size)
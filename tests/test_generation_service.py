@@ -0,0 +1,98 @@
+import gc
+import weakref
+import pytest
+import torch
+from benchmark_generation import tiny_causal_lm, random_prompts
+from generation_service import GenerationService, GenerationRequest, get_generation_service, close_generation_service
+from kv_cache import cache_length, to_legacy
+
+VOCAB_SIZE = 256
+EOS_TOKEN_ID = 2
+
+@pytest.fixture(scope="module")
+def model():
+    return tiny_causal_lm(vocab_size=VOCAB_SIZE, hidden_size=64, layers=2, heads=4)
+
+def reference_generate(model, prompt, new_tokens):
+    with torch.no_grad():
+        outputs = model.generate(
+            torch.tensor([prompt]), max_new_tokens=new_tokens, do_sample=False,
+            eos_token_id=EOS_TOKEN_ID, pad_token_id=0
+        )
+    return outputs[0, len(prompt):].tolist()
+
+def stopped_service(model):
+    """A service whose worker has exited, so a test can drive ``_prefill`` and ``_step`` itself"""
+    service = GenerationService(model)
+    service.close()
+    return service
+
+def request(prompt, new_tokens, keep_past=False):
+    return GenerationRequest(prompt, max_new_tokens=new_tokens, eos_token_id=EOS_TOKEN_ID, keep_past=keep_past)
+
+def test_greedy_outputs_match_generate_across_concurrent_admissions(model):
+    prompts = random_prompts(8, VOCAB_SIZE, min_tokens=3, max_tokens=20, seed=1)
+    new_tokens = [3, 12, 6, 9, 1, 15, 4, 8]
+    service = GenerationService(model, max_batch_size=3)
+    try:
+        # The second wave is admitted into a batch that is already decoding
+        first = [service.submit(prompt, max_new_tokens=n, eos_token_id=EOS_TOKEN_ID) for prompt, n in zip(prompts[:4], new_tokens[:4])]
+        first[0].result()
+        second = [service.submit(prompt, max_new_tokens=n, eos_token_id=EOS_TOKEN_ID) for prompt, n in zip(prompts[4:], new_tokens[4:])]
+        outputs = [r.result(timeout=60) for r in first + second]
+        assert service.stats()["mean_batch_size"] > 1
+    finally:
+        service.close()
+    assert outputs == [reference_generate(model, prompt, n) for prompt, n in zip(prompts, new_tokens)]
+
+def test_retire_trims_left_padding_no_row_needs(model):
+    service = stopped_service(model)
+    long_prompt, short_prompt = random_prompts(2, VOCAB_SIZE, min_tokens=5, max_tokens=12, seed=2)
+    long_prompt, short_prompt = long_prompt + [7] * 12, short_prompt[:5]
+    finishing, remaining = request(long_prompt, 2), request(short_prompt, 6)
+    service._prefill(finishing)
+    service._prefill(remaining)
+    assert service._attention_mask.shape == (2, len(long_prompt))
+
+    service._step()  # the long prompt's row retires after its second token
+    assert finishing.future.done() and service._active == [remaining]
+    real_positions = len(short_prompt) + 1
+    assert service._attention_mask.shape == (1, real_positions) and bool(service._attention_mask.all())
+    assert cache_length(service._past) == real_positions
+
+    while service._active:
+        service._step()
+    assert remaining.result() == reference_generate(model, short_prompt, 6)
+
+def test_keep_past_holds_only_the_rows_own_positions(model):
+    service = stopped_service(model)
+    padded_prompt, kept_prompt = random_prompts(2, VOCAB_SIZE, min_tokens=4, max_tokens=8, seed=3)
+    padded_prompt = padded_prompt + [9] * 10
+    kept = request(kept_prompt, 4, keep_past=True)
+    service._prefill(request(padded_prompt, 10))
+    service._prefill(kept)
+    while not kept.future.done():
+        service._step()
+
+    sequence = kept_prompt + kept.result()
+    with torch.no_grad():
+        expected = to_legacy(model(torch.tensor([sequence[:-1]]), use_cache=True).past_key_values)
+    assert cache_length(kept.past_key_values) == len(sequence) - 1
+    for (key, value), (expected_key, expected_value) in zip(kept.past_key_values, expected):
+        torch.testing.assert_close(key, expected_key, rtol=1e-4, atol=1e-5)
+        torch.testing.assert_close(value, expected_value, rtol=1e-4, atol=1e-5)
+
+def test_closing_the_service_releases_the_model():
+    model = tiny_causal_lm(vocab_size=VOCAB_SIZE, hidden_size=32, layers=1, heads=2)
+    service = get_generation_service(model)
+    assert get_generation_service(model) is service
+    service.generate([5, 6, 7], max_new_tokens=2)
+
+    close_generation_service(model)
+    assert not service._thread.is_alive()
+    with pytest.raises(RuntimeError):
+        service.submit([5, 6, 7])
+    released = weakref.ref(model)
+    del model, service
+    gc.collect()
+    assert released() is None
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+def import_in_fresh_interpreter(module):
+    """Import ``module`` from app/ in a new process, so nothing stubbed or imported by another test hides a failure"""
+    # Without a MongoDB server, mongo_manager gives up on connecting after the selection timeout
+    env = dict(os.environ, MONGO_URI="mongodb://localhost:27017/?serverSelectionTimeoutMS=200")
+    return subprocess.run([sys.executable, "-c", f"import {module}"], cwd=APP_DIR, env=env, capture_output=True, text=True)
+
+@pytest.mark.parametrize("module, requires", [
+    ("model_loader", []),
+    ("ingest", []),
+    ("data_processor", ["chromadb"]),
+    ("answer_generator", ["pymongo"]),
+])
+def test_entry_point_modules_import(module, requires):
+    for dependency in requires:
+        pytest.importorskip(dependency)
+    result = import_in_fresh_interpreter(module)
+    assert result.returncode == 0, result.stderr
+
+def test_model_names_come_from_configuration():
+    import model_loader
+    from configuration import MODEL_CONFIG
+    assert model_loader.BGE_MODEL_NAME == MODEL_CONFIG["BGE_MODEL_NAME"]
+    assert model_loader.RERANKER_MODEL_NAME == MODEL_CONFIG["RERANKER_MODEL_NAME"]
+    assert model_loader.QWEN_MODEL_NAME == MODEL_CONFIG["QWEN_MODEL_NAME"]
@@ -0,0 +1,64 @@
+import numpy as np
+import ingest
+from configuration import RETRIEVAL_CONFIG
+from retrieval_bundle import load_bundle
+from bm25_index import tokenize
+
+SECTIONS = [(f"Câu {i}: Chủ đề {i}", f"Nội dung số {i} về sức khỏe tâm thần, giấc ngủ và căng thẳng {i * 7}.") for i in range(1, 11)]
+
+def run_ingest(data_path, **kwargs):
+    return ingest.ingest([data_path], "numpy", workers=1, threads=1, shard_size=3, **kwargs)
+
+def edited_sections():
+    """Section 3 edited, section 5 removed, one section inserted and one appended"""
+    sections = list(SECTIONS)
+    sections[2] = (sections[2][0], "Nội dung đã được cập nhật.")
+    del sections[4]
+    sections.insert(6, ("Câu 11: Chủ đề mới", "Một mục mới ở giữa tệp."))
+    return sections + [("Câu 12: Chủ đề cuối", "Một mục mới ở cuối tệp.")]
+
+def test_incremental_ingest_matches_a_full_rebuild(tmp_path, ingest_env, monkeypatch, write_sections):
+    knowledge_base = write_sections(tmp_path / "kb.txt", SECTIONS)
+    run_ingest(knowledge_base)
+    write_sections(knowledge_base, edited_sections())
+    run_ingest(knowledge_base)
+    documents_data, bm25, dense_index = load_bundle(RETRIEVAL_CONFIG["BUNDLE_PATH"])
+    assert ingest_env == [len(SECTIONS), 3]  # only the edited and the two new sections were embedded
+
+    monkeypatch.setitem(RETRIEVAL_CONFIG, "BUNDLE_PATH", str(tmp_path / "fresh"))
+    run_ingest(knowledge_base, full=True)
+    fresh_documents, fresh_bm25, fresh_dense = load_bundle(RETRIEVAL_CONFIG["BUNDLE_PATH"])
+
+    assert documents_data == fresh_documents
+    assert dense_index.ids == fresh_dense.ids
+    # Reused vectors are stored normalized and normalized again on rebuild: equal up to float32 rounding
+    np.testing.assert_allclose(np.asarray(dense_index.embeddings), np.asarray(fresh_dense.embeddings), rtol=0, atol=1e-6)
+    assert bm25.ids == fresh_bm25.ids
+    for doc in fresh_documents:
+        query = tokenize(doc["text"])[:6]
+        np.testing.assert_array_equal(bm25.get_scores(query), fresh_bm25.get_scores(query))
+
+def test_full_ingest_re_embeds_everything(tmp_path, ingest_env, write_sections):
+    knowledge_base = write_sections(tmp_path / "kb.txt", SECTIONS)
+    run_ingest(knowledge_base)
+    write_sections(knowledge_base, edited_sections())
+    run_ingest(knowledge_base, full=True)
+    assert ingest_env == [len(SECTIONS), len(edited_sections())]
+
+def test_interrupted_ingest_resumes_from_checkpointed_shards(tmp_path, ingest_env, monkeypatch, write_sections):
+    knowledge_base = write_sections(tmp_path / "kb.txt", SECTIONS)
+    original = ingest.write_streamed_bundle
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(ingest, "write_streamed_bundle", interrupted)
+    try:
+        run_ingest(knowledge_base)
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.setattr(ingest, "write_streamed_bundle", original)
+
+    # Every shard was checkpointed by the first run, so the second one only assembles them
+    monkeypatch.setattr(ingest, "embed_shards", lambda *args: 0)
+    assert run_ingest(knowledge_base)
+    documents_data, _, dense_index = load_bundle(RETRIEVAL_CONFIG["BUNDLE_PATH"])
+    assert len(documents_data) == len(dense_index) == len(SECTIONS)
@@ -0,0 +1,59 @@
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast, XLMRobertaConfig, XLMRobertaModel, XLMRobertaForSequenceClassification
+import model_loader
+from benchmark_generation import tiny_causal_lm
+from configuration import LOADING_CONFIG
+from cpu_inference import cpu_dtype
+
+WORDS = ["<pad>", "<s>", "</s>", "<unk>", "trầm", "cảm", "là", "gì", "lo", "âu", "mất", "ngủ"]
+
+def save_tokenizer(path):
+    tokenizer = Tokenizer(models.WordLevel({word: i for i, word in enumerate(WORDS)}, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="<pad>", bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    ).save_pretrained(path)
+
+@pytest.fixture(scope="module")
+def checkpoints(tmp_path_factory):
+    """Tiny random BGE, reranker and LLM checkpoints with the architectures the app loads"""
+    root = tmp_path_factory.mktemp("models")
+    encoder_config = XLMRobertaConfig(
+        vocab_size=len(WORDS), hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64,
+        max_position_embeddings=64, pad_token_id=0, bos_token_id=1, eos_token_id=2, num_labels=1
+    )
+    paths = {name: str(root / name) for name in ("bge", "reranker", "llm")}
+    XLMRobertaModel(encoder_config).save_pretrained(paths["bge"])
+    XLMRobertaForSequenceClassification(encoder_config).save_pretrained(paths["reranker"])
+    tiny_causal_lm(vocab_size=len(WORDS), hidden_size=32, layers=1, heads=2).save_pretrained(paths["llm"])
+    for path in paths.values():
+        save_tokenizer(path)
+    return paths
+
+def test_load_models_on_cpu_never_builds_the_gpu_configuration(checkpoints, monkeypatch):
+    monkeypatch.setitem(LOADING_CONFIG, "MODE", "cpu")
+    monkeypatch.setitem(LOADING_CONFIG, "CPU_INT8", "llm")
+    monkeypatch.setattr(model_loader, "BGE_MODEL_NAME", checkpoints["bge"])
+    monkeypatch.setattr(model_loader, "RERANKER_MODEL_NAME", checkpoints["reranker"])
+    def no_bitsandbytes(**kwargs):
+        raise AssertionError("bitsandbytes configuration built in CPU mode")
+    monkeypatch.setattr(model_loader, "BitsAndBytesConfig", no_bitsandbytes)
+
+    system = model_loader.load_models(checkpoints["llm"])
+
+    (bge_model, bge_tokenizer), (reranker_model, _), (llm_model, llm_tokenizer) = system["bge"], system["reranker"], system["llm"]
+    for model in (bge_model, reranker_model, llm_model):
+        assert not model.training
+        assert all(parameter.device.type == "cpu" for parameter in model.parameters())
+    assert bge_model.dtype == reranker_model.dtype == cpu_dtype()
+    # CPU_INT8="llm": only the LLM's Linear layers are dynamically quantized
+    assert any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in llm_model.modules())
+    assert not any(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in bge_model.modules())
+
+    with torch.no_grad():
+        bge_model(**bge_tokenizer(["trầm cảm là gì"], return_tensors="pt"))
+        prompt = llm_tokenizer("lo âu là gì", return_tensors="pt")["input_ids"]
+        outputs = llm_model.generate(prompt, max_new_tokens=3, do_sample=False, pad_token_id=0)
+    assert outputs.shape[1] > prompt.shape[1]
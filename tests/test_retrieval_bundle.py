@@ -0,0 +1,91 @@
+import json
+import os
+import pytest
+import ingest
+from configuration import RETRIEVAL_CONFIG
+from ingestion import bundle_settings
+from retrieval_bundle import compute_input_hash, load_bundle, read_manifest, MANIFEST_FILE
+
+SECTIONS = [
+    ("Câu 1: Trầm cảm là gì?", "Trầm cảm là một rối loạn tâm thần phổ biến."),
+    ("Câu 2: Lo âu là gì?", "Rối loạn lo âu gây lo lắng kéo dài và khó kiểm soát."),
+    ("Câu 3: Mất ngủ", "Mất ngủ kéo dài làm giảm khả năng tập trung."),
+]
+
+@pytest.fixture
+def knowledge_base(tmp_path, write_sections):
+    return write_sections(tmp_path / "kb.txt", SECTIONS)
+
+def run_ingest(data_path, **kwargs):
+    return ingest.ingest([data_path], "numpy", workers=1, threads=1, shard_size=2, **kwargs)
+
+def current_hash(data_path):
+    return compute_input_hash([data_path], bundle_settings("numpy"))
+
+# ========== Input hash ==========
+def test_input_hash_follows_content_name_and_settings(tmp_path, knowledge_base, write_sections):
+    settings = {"dense_backend": "numpy"}
+    base = compute_input_hash([knowledge_base], settings)
+    assert compute_input_hash([knowledge_base], dict(settings)) == base
+
+    assert compute_input_hash([knowledge_base], {"dense_backend": "ivf"}) != base
+    renamed = write_sections(tmp_path / "other.txt", SECTIONS)
+    assert compute_input_hash([renamed], settings) != base
+    write_sections(knowledge_base, SECTIONS[:2] + [("Câu 3: Mất ngủ", "Nội dung đã sửa.")])
+    assert compute_input_hash([knowledge_base], settings) != base
+
+def test_input_hash_ignores_path_order(tmp_path, knowledge_base, write_sections):
+    other = write_sections(tmp_path / "other.txt", SECTIONS[:1])
+    assert compute_input_hash([knowledge_base, other], {}) == compute_input_hash([other, knowledge_base], {})
+
+# ========== Loading and rebuilding ==========
+def test_bundle_loads_only_for_its_input_hash(ingest_env, knowledge_base):
+    assert load_bundle(RETRIEVAL_CONFIG["BUNDLE_PATH"]) is None
+    assert run_ingest(knowledge_base)
+    bundle_path = RETRIEVAL_CONFIG["BUNDLE_PATH"]
+
+    documents_data, bm25, dense_index = load_bundle(bundle_path, current_hash(knowledge_base))
+    assert [doc["text"].split("\n")[-1] for doc in documents_data] == [body for _, body in SECTIONS]
+    assert bm25.ids == dense_index.ids == [doc["id"] for doc in documents_data]
+    assert load_bundle(bundle_path, "another-hash") is None
+    assert load_bundle(bundle_path) is not None
+
+def test_bundle_of_another_format_version_is_not_loaded(ingest_env, knowledge_base):
+    run_ingest(knowledge_base)
+    manifest_path = os.path.join(RETRIEVAL_CONFIG["BUNDLE_PATH"], MANIFEST_FILE)
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["format_version"] += 1
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    assert load_bundle(RETRIEVAL_CONFIG["BUNDLE_PATH"]) is None
+
+def test_unchanged_inputs_are_not_rebuilt(ingest_env, knowledge_base):
+    run_ingest(knowledge_base)
+    created_at = read_manifest(RETRIEVAL_CONFIG["BUNDLE_PATH"])["created_at"]
+    assert run_ingest(knowledge_base)
+    assert ingest_env == [len(SECTIONS)]  # the second run did not embed anything
+    assert read_manifest(RETRIEVAL_CONFIG["BUNDLE_PATH"])["created_at"] == created_at
+
+def test_bundle_rebuilt_when_input_hash_changes(ingest_env, knowledge_base, write_sections):
+    run_ingest(knowledge_base)
+    old_hash = current_hash(knowledge_base)
+    write_sections(knowledge_base, SECTIONS + [("Câu 4: Căng thẳng", "Căng thẳng kéo dài ảnh hưởng đến giấc ngủ.")])
+    new_hash = current_hash(knowledge_base)
+    assert new_hash != old_hash
+
+    assert run_ingest(knowledge_base)
+    bundle_path = RETRIEVAL_CONFIG["BUNDLE_PATH"]
+    assert read_manifest(bundle_path)["input_hash"] == new_hash
+    assert load_bundle(bundle_path, old_hash) is None
+    documents_data, bm25, dense_index = load_bundle(bundle_path, new_hash)
+    assert len(documents_data) == len(bm25) == len(dense_index) == len(SECTIONS) + 1
+
+def test_settings_change_rebuilds_bundle(ingest_env, knowledge_base, monkeypatch):
+    run_ingest(knowledge_base)
+    monkeypatch.setitem(RETRIEVAL_CONFIG, "DENSE_INDEX_DTYPE", "float16")
+    assert load_bundle(RETRIEVAL_CONFIG["BUNDLE_PATH"], current_hash(knowledge_base)) is None
+    run_ingest(knowledge_base)
+    assert ingest_env == [len(SECTIONS), len(SECTIONS)]  # other settings: no vectors reused
+    _, _, dense_index = load_bundle(RETRIEVAL_CONFIG["BUNDLE_PATH"], current_hash(knowledge_base))
+    assert dense_index.embeddings.dtype.name == "float16"
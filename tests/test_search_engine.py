@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from search_engine import fuse_scores
+
+# Candidate 1 was found by the dense search only: BM25 did not match it
+EMBEDDING_SCORES = np.array([0.9, 0.5, 0.7, 0.1], dtype=np.float32)
+BM25_SCORES = np.array([2.0, 0.0, 3.0, 1.0], dtype=np.float32)
+
+def test_rrf_sums_weighted_reciprocal_ranks():
+    # Dense ranks 1, 3, 2, 4; BM25 ranks 2, -, 1, 3
+    expected = [0.5 / 61 + 0.5 / 62, 0.5 / 63, 0.5 / 62 + 0.5 / 61, 0.5 / 64 + 0.5 / 63]
+    np.testing.assert_allclose(fuse_scores(EMBEDDING_SCORES, BM25_SCORES, method="rrf", rrf_k=60), expected, rtol=1e-6)
+
+def test_rrf_weights_and_k():
+    expected = [0.3 / 11 + 0.7 / 12, 0.3 / 13, 0.3 / 12 + 0.7 / 11, 0.3 / 14 + 0.7 / 13]
+    np.testing.assert_allclose(fuse_scores(EMBEDDING_SCORES, BM25_SCORES, alpha=0.3, method="rrf", rrf_k=10), expected, rtol=1e-6)
+    without_bm25 = fuse_scores(EMBEDDING_SCORES, BM25_SCORES, alpha=0.3, method="rrf", use_bm25=False, rrf_k=10)
+    np.testing.assert_allclose(without_bm25, [0.3 / 11, 0.3 / 13, 0.3 / 12, 0.3 / 14], rtol=1e-6)
+
+def test_rrf_does_not_rank_unmatched_candidates_by_their_position():
+    bm25_scores = np.array([2.0, 0.0, 3.0, 0.0], dtype=np.float32)
+    fused = fuse_scores(EMBEDDING_SCORES, bm25_scores, method="rrf")
+    reversed_order = fuse_scores(EMBEDDING_SCORES[::-1].copy(), bm25_scores[::-1].copy(), method="rrf")[::-1]
+    np.testing.assert_allclose(reversed_order, fused, rtol=1e-6)
+    np.testing.assert_allclose(fused[[1, 3]], [0.5 / 63, 0.5 / 64], rtol=1e-6)
+
+def test_linear_blends_min_max_normalized_scores():
+    # Normalized dense 1, 0.5, 0.75, 0; normalized BM25 2/3, 0, 1, 1/3
+    expected = [0.5 * 1 + 0.5 * 2 / 3, 0.5 * 0.5, 0.5 * 0.75 + 0.5 * 1, 0.5 / 3]
+    np.testing.assert_allclose(fuse_scores(EMBEDDING_SCORES, BM25_SCORES), expected, rtol=1e-6)
+    np.testing.assert_allclose(fuse_scores(EMBEDDING_SCORES, BM25_SCORES, use_bm25=False), [0.5, 0.25, 0.375, 0], rtol=1e-6)
+
+def test_unknown_fusion_method_is_rejected():
+    with pytest.raises(ValueError):
+        fuse_scores(EMBEDDING_SCORES, BM25_SCORES, method="max")
@@ -0,0 +1,46 @@
+import random
+import re
+import pytest
+from utils import iter_chunks, iter_input_files
+
+def regex_chunks(text):
+    """The original chunking: split the whole text on "\\n# " """
+    return ["# " + chunk.strip() for chunk in re.split(r"\n# ", text) if chunk.strip()]
+
+def write(tmp_path, text, name="kb.txt"):
+    path = tmp_path / name
+    path.write_bytes(text.encode("utf-8"))
+    return str(path)
+
+def test_iter_chunks_matches_regex_split_on_knowledge_base(knowledge_base_file):
+    with open(knowledge_base_file, "r", encoding="utf-8") as f:
+        expected = regex_chunks(f.read())
+    assert list(iter_chunks(knowledge_base_file)) == expected
+
+@pytest.mark.parametrize("text", [
+    "",
+    "\n\n",
+    "# only heading",
+    "# Câu 1\nbody\nNguồn: a\n# Câu 2\nbody\n",
+    "preamble without heading\n# Câu 1\nbody",
+    "# Câu 1\n#not a heading\n #indented\nx # inline\n# \n# Câu 2",
+    "# Câu 1\r\nbody\r\n# Câu 2\r\nbody\r\n",
+    "\n# leading newline\n\n\n# \n\n# last",
+    "# # nested\n# ## deeper\n",
+])
+def test_iter_chunks_matches_regex_split(tmp_path, text):
+    assert list(iter_chunks(write(tmp_path, text))) == regex_chunks(text.replace("\r\n", "\n"))
+
+def test_iter_chunks_matches_regex_split_on_random_text(tmp_path):
+    rng = random.Random(0)
+    pieces = ["# ", "#", " ", "\n", "\n# ", "a", "Câu", "\r\n", "\t"]
+    for _ in range(300):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 40)))
+        assert list(iter_chunks(write(tmp_path, text))) == regex_chunks(text.replace("\r\n", "\n")), repr(text)
+
+def test_iter_input_files_expands_directories_in_order(tmp_path):
+    write(tmp_path, "b", "b.txt")
+    (tmp_path / "sub").mkdir()
+    write(tmp_path / "sub", "a", "a.txt")
+    write(tmp_path, "ignored", "notes.md")
+    assert list(iter_input_files(str(tmp_path))) == [str(tmp_path / "b.txt"), str(tmp_path / "sub" / "a.txt")]
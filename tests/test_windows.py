@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+from dense_index import DenseIndex
+from ingestion import split_into_windows
+from search_engine import aggregate_parents, merge_windows, _finalize
+
+WORDS = [f"từ{i}" for i in range(200)]
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    """One token per whitespace-separated word, with character offsets"""
+    vocab = {word: i for i, word in enumerate(["[UNK]"] + WORDS)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token="[UNK]")
+
+def section(doc_id, words):
+    return {"id": doc_id, "text": " ".join(WORDS[:words]), "source": "kb"}
+
+# ========== Splitting ==========
+@pytest.mark.parametrize("words, window_tokens, overlap", [(50, 12, 4), (50, 12, 0), (13, 12, 11), (97, 16, 5)])
+def test_windows_overlap_as_configured_and_rebuild_the_section(tokenizer, words, window_tokens, overlap):
+    doc = section("doc", words)
+    windows = split_into_windows(doc, tokenizer, window_tokens=window_tokens, overlap=overlap)
+    tokens = [window["text"].split() for window in windows]
+
+    assert [window["id"] for window in windows] == [f"doc:{n}" for n in range(len(windows))]
+    assert all(window["parent_id"] == "doc" and window["source"] == "kb" for window in windows)
+    assert all(len(window) <= window_tokens for window in tokens)
+    for window in windows:
+        assert doc["text"][window["start"]:window["start"] + len(window["text"])] == window["text"]
+    for previous, following in zip(tokens, tokens[1:]):
+        assert len(previous) == window_tokens
+        assert previous[len(previous) - overlap:] == following[:overlap]
+    assert tokens[0][0] == WORDS[0] and tokens[-1][-1] == WORDS[words - 1]
+    assert merge_windows(windows) == doc["text"]
+    assert merge_windows(list(reversed(windows))) == doc["text"]
+
+def test_section_that_fits_is_not_split(tokenizer):
+    doc = section("doc", 12)
+    assert split_into_windows(doc, tokenizer, window_tokens=12, overlap=4) == [doc]
+
+@pytest.mark.parametrize("overlap", [-1, 12, 20])
+def test_overlap_must_be_smaller_than_the_window(tokenizer, overlap):
+    with pytest.raises(ValueError):
+        split_into_windows(section("doc", 50), tokenizer, window_tokens=12, overlap=overlap)
+
+# ========== Parent aggregation ==========
+@pytest.fixture
+def collection(tokenizer):
+    sections = [section("a", 60), section("b", 40), section("c", 8)]
+    documents = [window for doc in sections for window in split_into_windows(doc, tokenizer, window_tokens=16, overlap=4)]
+    return sections, DenseIndex(np.zeros((len(documents), 4), dtype=np.float32), documents)
+
+def hit(collection, doc_id, score):
+    _, index = collection
+    doc = next(doc for doc in index.documents if doc["id"] == doc_id)
+    return dict(doc, embedding_score=score, bm25_score=score, combined_score=score, rerank_score=score)
+
+def test_aggregate_parents_gives_one_hit_per_parent_with_its_best_window(collection):
+    sections, index = collection
+    ranked = [hit(collection, *pair) for pair in [("a:2", 0.9), ("b:0", 0.8), ("a:0", 0.7), ("c", 0.6), ("b:1", 0.5)]]
+
+    parents = aggregate_parents(ranked, index, top_k_final=2)
+    assert [parent["id"] for parent in parents] == ["a", "b"]
+    assert [parent["rerank_score"] for parent in parents] == [0.9, 0.8]
+    assert [parent["windows"] for parent in parents] == [["a:2", "a:0"], ["b:0", "b:1"]]
+    assert [parent["text"] for parent in parents] == [sections[0]["text"], sections[1]["text"]]
+
+    parents = aggregate_parents(ranked, index, top_k_final=5)
+    assert [parent["id"] for parent in parents] == ["a", "b", "c"]
+    assert parents[2]["windows"] == ["c"] and parents[2]["text"] == sections[2]["text"]
+
+def test_parent_granularity_ranks_parents_by_their_best_window(collection):
+    _, index = collection
+    candidates = [hit(collection, *pair) for pair in [("a:0", 0.2), ("b:1", 0.4), ("a:3", 0.95), ("c", 0.3), ("b:2", 0.5)]]
+    parents = _finalize(candidates, 2, granularity="parent", collection_embeddings=index)
+    assert [(parent["id"], parent["rerank_score"]) for parent in parents] == [("a", 0.95), ("b", 0.5)]